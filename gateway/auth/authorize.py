@@ -2,27 +2,31 @@
 Contains authorization logic to verify user roles based on tokens.
 """
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 import httpx
+from gateway.auth.jwt_verifier import UnknownSigningKey, get_local_verifier
+from gateway.auth.revocation import get_revocation_list
+from gateway.auth.token_cache import get_token_cache, hash_token
+from gateway.upstream.calls import call_http
 
 # Define the security scheme
 security = HTTPBearer()
 """
 Get user roles from the authentication service using the provided token
 """
-async def get_user_roles(token: str) -> list[str]:
-    async with httpx.AsyncClient() as client:
-        # Validate the token with the auth service
-        # Use the auth service hostname within the Docker network
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            # Call the auth service validate-token endpoint
-            token_response = await client.get(f"http://auth-service:5001/api/auth", headers=headers)
-            # Raise an exception if the request failed
-            token_response.raise_for_status()
-        except httpx.HTTPError as e:
-            # Invalid token or expired
-            raise HTTPException(status_code=401, detail="Unauthorized") from e
+async def get_user_roles(token: str, request: Request = None) -> list[str]:
+    # Validate the token with the auth service
+    # Use the auth service hostname within the Docker network
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        # Call the auth service validate-token endpoint on the shared pooled client,
+        # bounded by the request deadline
+        token_response = await call_http(request, "auth", "GET", f"http://auth-service:5001/api/auth", headers=headers)
+        # Raise an exception if the request failed
+        token_response.raise_for_status()
+    except httpx.HTTPError as e:
+        # Invalid token or expired
+        raise HTTPException(status_code=401, detail="Unauthorized") from e
     # If the token is invalid, raise an exception
     if token_response is None or token_response.status_code != 200:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -30,15 +34,55 @@ async def get_user_roles(token: str) -> list[str]:
     roles = token_response.json().get("roles", [])
     return roles
 """
+Resolve user roles for a token. Checks the per-request memo, then local JWT verification
+(when enabled), then the token cache, and only then calls the authentication service.
+"""
+async def resolve_user_roles(token: str, request: Request = None) -> list[str]:
+    key = hash_token(token)
+    # Stacked dependencies on the same request reuse the first validation
+    memo = getattr(request.state, "auth_roles", None) if request is not None else None
+    if memo is not None and key in memo:
+        return memo[key]
+    # Logged-out tokens are rejected even if still cached or validly signed
+    revocations = get_revocation_list()
+    if revocations.is_revoked(key):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    # Once revocations have been evicted only the auth service knows every logged-out
+    # token, so local verification and the token cache are skipped
+    trust_local = not revocations.is_saturated()
+    roles = None
+    # Verify the signature locally; unknown signing keys fall back to the auth service
+    verifier = get_local_verifier() if trust_local else None
+    if verifier is not None:
+        try:
+            roles = await verifier.verify(token)
+        except UnknownSigningKey:
+            roles = None
+    # Check the validated token cache before going to the auth service
+    cache = get_token_cache()
+    if roles is None and cache is not None and trust_local:
+        roles = await cache.get(token)
+    if roles is None:
+        roles = await get_user_roles(token, request)
+        if cache is not None:
+            await cache.set(token, roles)
+    # Memoize for the rest of the request
+    if request is not None:
+        if memo is None:
+            memo = {}
+            request.state.auth_roles = memo
+        memo[key] = roles
+    return roles
+"""
 Authorization dependency to check for required roles. It can validate it if no roles are specified.
 """
 def authorize(*required_roles: str):
     # Dependency function to check user roles
-    async def role_checker(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    async def role_checker(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
         # Extract the token from the credentials
         token = credentials.credentials
-        # Get user roles from the token
-        roles = await get_user_roles(token)
+        # Get user roles from the token (cached and memoized per request)
+        roles = await resolve_user_roles(token, request)
         # If specific roles are required, check if the user has any of them
         if required_roles:
             if not any(role in roles for role in required_roles):
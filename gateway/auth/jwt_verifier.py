@@ -0,0 +1,197 @@
+"""
+Local JWT Verification for Censudx API Gateway
+Verifies token signature, expiry and roles against cached signing keys
+"""
+
+import base64
+import logging
+import time
+from typing import Dict, Any, List, Optional
+
+import jwt
+from fastapi import HTTPException
+
+from gateway.config import Config
+from gateway.upstream.http_pool import get_http_pool
+
+logger = logging.getLogger(__name__)
+
+# Role claim names used by common issuers (.NET emits the schema URI)
+ROLE_CLAIM_FALLBACKS = [
+    "roles",
+    "role",
+    "http://schemas.microsoft.com/ws/2008/06/identity/claims/role",
+]
+
+
+class UnknownSigningKey(Exception):
+    """Raised when a token is signed with a key the gateway does not hold"""
+    pass
+
+
+def extract_roles(claims: Dict[str, Any], roles_claim: str = "role") -> List[str]:
+    """Read roles from the configured claim or a known fallback"""
+    for name in [roles_claim] + ROLE_CLAIM_FALLBACKS:
+        value = claims.get(name)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            return [value]
+        return list(value)
+    return []
+
+
+class SigningKeyStore:
+    """
+    Cache of token signing keys
+    Keys come from a JWKS document (refreshed periodically so rotation needs no restart)
+    and/or a static shared secret
+    """
+
+    def __init__(
+        self,
+        jwks_url: str = "",
+        static_secret: str = "",
+        refresh_interval: int = 300,
+        min_refresh_interval: int = 30
+    ):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.keys: Dict[Optional[str], jwt.PyJWK] = {}
+        self.static_key: Optional[jwt.PyJWK] = None
+        if static_secret:
+            self.static_key = jwt.PyJWK({
+                "kty": "oct",
+                "k": base64.urlsafe_b64encode(static_secret.encode("utf-8")).decode("ascii").rstrip("="),
+                "alg": "HS256"
+            })
+        self.last_refresh = 0.0
+        self.refreshing = False
+
+    def load_jwks(self, jwks: Dict[str, Any]) -> None:
+        """Replace the key set with the keys of a JWKS document"""
+        keys: Dict[Optional[str], jwt.PyJWK] = {}
+        for jwk in jwks.get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+            except jwt.PyJWTError as e:
+                logger.warning(f"Skipping unusable signing key {jwk.get('kid')}: {e}")
+        self.keys = keys
+        self.last_refresh = time.monotonic()
+        logger.info(f"Loaded {len(keys)} token signing keys")
+
+    async def refresh(self) -> None:
+        """Fetch the JWKS document from the auth service"""
+        if not self.jwks_url or self.refreshing:
+            return
+        self.refreshing = True
+        try:
+            response = await get_http_pool().get("auth").get(self.jwks_url)
+            response.raise_for_status()
+            self.load_jwks(response.json())
+        except Exception as e:
+            # Keep serving the previous key set
+            logger.warning(f"Failed to refresh signing keys from {self.jwks_url}: {e}")
+            self.last_refresh = time.monotonic()
+        finally:
+            self.refreshing = False
+
+    async def get_key(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        """
+        Get the signing key for a key id
+
+        Refreshes when the key set is stale, or when the key id is unknown and the
+        last refresh is older than the minimum refresh interval.
+        """
+        age = time.monotonic() - self.last_refresh
+        if self.jwks_url and (age > self.refresh_interval or (kid not in self.keys and age > self.min_refresh_interval)):
+            await self.refresh()
+
+        if kid in self.keys:
+            return self.keys[kid]
+        if kid is None:
+            if self.static_key is not None:
+                return self.static_key
+            if len(self.keys) == 1:
+                return next(iter(self.keys.values()))
+        return None
+
+
+class LocalTokenVerifier:
+    """Verifies JWTs in-process instead of calling the auth service"""
+
+    def __init__(
+        self,
+        key_store: SigningKeyStore,
+        algorithms: List[str],
+        issuer: str = "",
+        audience: str = "",
+        roles_claim: str = "role"
+    ):
+        self.key_store = key_store
+        self.algorithms = algorithms
+        self.issuer = issuer
+        self.audience = audience
+        self.roles_claim = roles_claim
+        self.stats = {"verified": 0, "rejected": 0, "unknown_key": 0}
+
+    async def verify(self, token: str) -> List[str]:
+        """
+        Verify a token and return its roles
+
+        Raises:
+            UnknownSigningKey: The key id is not in the key store (caller should fall back)
+            HTTPException: 401 if the token is malformed, expired or badly signed
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Unauthorized") from e
+
+        key = await self.key_store.get_key(header.get("kid"))
+        # The token algorithm must be allowed and match the key (no algorithm confusion)
+        if key is None or header.get("alg") not in self.algorithms or key.algorithm_name != header.get("alg"):
+            self.stats["unknown_key"] += 1
+            raise UnknownSigningKey(header.get("kid"))
+
+        try:
+            claims = jwt.decode(
+                token,
+                key.key,
+                algorithms=[header["alg"]],
+                issuer=self.issuer or None,
+                audience=self.audience or None,
+                options={"require": ["exp"], "verify_aud": bool(self.audience)}
+            )
+        except jwt.PyJWTError as e:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=401, detail="Unauthorized") from e
+
+        self.stats["verified"] += 1
+        return extract_roles(claims, self.roles_claim)
+
+
+# Process-wide verifier instance
+_verifier: Optional[LocalTokenVerifier] = None
+
+
+def get_local_verifier() -> Optional[LocalTokenVerifier]:
+    """Get the process-wide verifier (None unless local verification is enabled)"""
+    global _verifier
+    if _verifier is None and Config.AUTH.JWT_LOCAL_VERIFICATION:
+        key_store = SigningKeyStore(
+            jwks_url=Config.AUTH.JWKS_URL,
+            static_secret=Config.AUTH.JWT_SECRET_KEY,
+            refresh_interval=Config.AUTH.JWKS_REFRESH_INTERVAL,
+            min_refresh_interval=Config.AUTH.JWKS_MIN_REFRESH_INTERVAL
+        )
+        _verifier = LocalTokenVerifier(
+            key_store,
+            algorithms=[a.strip() for a in Config.AUTH.JWT_ALGORITHMS.split(",") if a.strip()],
+            issuer=Config.AUTH.JWT_ISSUER,
+            audience=Config.AUTH.JWT_AUDIENCE,
+            roles_claim=Config.AUTH.JWT_ROLES_CLAIM
+        )
+    return _verifier
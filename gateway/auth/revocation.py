@@ -0,0 +1,196 @@
+"""
+Token Revocation List for Censudx API Gateway
+Keeps logged-out tokens rejected while they are still cached or locally verifiable
+"""
+
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from gateway.auth.token_cache import hash_token, token_expiry
+from gateway.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Digest bytes kept per revoked token (128 bits is plenty to avoid collisions)
+DIGEST_BYTES = 16
+
+
+def _compact_key(token_hash: str) -> bytes:
+    """Truncate a SHA-256 hex digest to a compact binary key"""
+    return bytes.fromhex(token_hash)[:DIGEST_BYTES]
+
+
+class RevocationList:
+    """
+    Set of revoked token hashes
+    Each entry lives until the token would have expired anyway, then it is pruned.
+    Past max_entries the entries closest to expiry are evicted, and the list reports
+    itself saturated until the last evicted token expires
+    """
+
+    def __init__(self, max_entries: int = 100000, default_ttl: int = 3600):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # compact key -> wall-clock expiry
+        self.entries: Dict[bytes, float] = {}
+        # (expiry, key) min-heap so pruning only touches expired entries
+        self.expiry_heap: List[Tuple[float, bytes]] = []
+        # Updated from the RabbitMQ consumer thread and the event loop
+        self.lock = threading.Lock()
+        # Expiry of the latest evicted entry: until then a revoked token may pass is_revoked
+        self.evicted_until = 0.0
+        self.stats = {"revoked": 0, "received": 0, "pruned": 0, "rejected": 0, "evicted": 0}
+
+    def revoke(self, token_hash: str, expires_at: Optional[float] = None) -> None:
+        """
+        Add a token hash to the list
+
+        Args:
+            token_hash: SHA-256 hex digest of the token
+            expires_at: Unix timestamp of the token's expiry (default TTL if unknown)
+        """
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.default_ttl
+        if expires_at <= now:
+            return
+        key = _compact_key(token_hash)
+        with self.lock:
+            self._prune(now)
+            if key not in self.entries or self.entries[key] < expires_at:
+                self.entries[key] = expires_at
+                heapq.heappush(self.expiry_heap, (expires_at, key))
+            # Hard cap: drop the entries closest to expiry first
+            while len(self.entries) > self.max_entries:
+                expiry, old_key = heapq.heappop(self.expiry_heap)
+                if self.entries.get(old_key) == expiry:
+                    del self.entries[old_key]
+                    self.evicted_until = max(self.evicted_until, expiry)
+                    self.stats["evicted"] += 1
+                    logger.warning(
+                        f"Revocation list full ({self.max_entries} entries): evicted a token revoked "
+                        f"for another {expiry - now:.0f}s"
+                    )
+            self.stats["revoked"] += 1
+
+    def is_revoked(self, token_hash: str) -> bool:
+        """Check whether a token hash has been revoked and has not yet expired"""
+        expires_at = self.entries.get(_compact_key(token_hash))
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            return False
+        self.stats["rejected"] += 1
+        return True
+
+    def is_saturated(self) -> bool:
+        """Whether evicted revocations may still be live (local checks cannot be trusted)"""
+        return time.time() < self.evicted_until
+
+    def _prune(self, now: float) -> None:
+        """Remove expired entries (caller holds the lock)"""
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expiry, key = heapq.heappop(self.expiry_heap)
+            # Skip heap records superseded by a later expiry for the same key
+            if self.entries.get(key) == expiry:
+                del self.entries[key]
+                self.stats["pruned"] += 1
+
+    def prune(self) -> None:
+        """Remove expired entries"""
+        with self.lock:
+            self._prune(time.time())
+
+    def process_message(self, message: Dict[str, Any]) -> None:
+        """
+        Consumer callback for token_revoked events
+
+        Args:
+            message: Message dictionary (see MessageSchema.token_revoked)
+        """
+        if message.get("event_type") != "token_revoked":
+            return
+        payload = message.get("payload", {})
+        token_hash = payload.get("token_hash")
+        if not token_hash:
+            logger.warning("Ignoring token revocation without token_hash")
+            return
+        self.stats["received"] += 1
+        self.revoke(token_hash, payload.get("expires_at"))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters and current size"""
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "saturated": self.is_saturated()
+        }
+
+
+class RevocationPublisher:
+    """
+    Publishes revocations over RabbitMQ from a single background thread
+    pika's blocking connection never runs on the event loop
+    """
+
+    def __init__(self, rabbitmq_url: str):
+        self.rabbitmq_url = rabbitmq_url
+        self.messaging_service = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revocation-publisher")
+
+    def _publish(self, token_hash: str, expires_at: Optional[float]) -> None:
+        """Publish on the executor thread, connecting lazily"""
+        from services.messaging import RabbitMQService
+
+        if self.messaging_service is None or self.messaging_service.channel is None:
+            self.messaging_service = RabbitMQService(self.rabbitmq_url)
+            self.messaging_service.max_retries = 1
+            if not self.messaging_service.connect():
+                self.messaging_service = None
+                logger.error("Token revocation not broadcast: RabbitMQ unavailable")
+                return
+        if not self.messaging_service.publish_token_revoked(token_hash, expires_at):
+            # Reconnect on the next publish
+            self.messaging_service = None
+
+    def publish(self, token_hash: str, expires_at: Optional[float]) -> None:
+        """Queue a revocation for broadcast (returns immediately)"""
+        self.executor.submit(self._publish, token_hash, expires_at)
+
+
+# Process-wide instances
+_revocation_list: Optional[RevocationList] = None
+_revocation_publisher: Optional[RevocationPublisher] = None
+
+
+def get_revocation_list() -> RevocationList:
+    """Get or create the process-wide revocation list"""
+    global _revocation_list
+    if _revocation_list is None:
+        _revocation_list = RevocationList(
+            max_entries=Config.AUTH.REVOCATION_MAX_ENTRIES,
+            default_ttl=Config.AUTH.REVOCATION_DEFAULT_TTL
+        )
+    return _revocation_list
+
+
+def revoke_token(token: str) -> None:
+    """
+    Revoke a token on this replica and broadcast it to the others
+
+    Args:
+        token: Raw bearer token
+    """
+    global _revocation_publisher
+    token_hash = hash_token(token)
+    expires_at = token_expiry(token)
+    get_revocation_list().revoke(token_hash, expires_at)
+    if Config.AUTH.REVOCATION_BROADCAST_ENABLED:
+        if _revocation_publisher is None:
+            _revocation_publisher = RevocationPublisher(Config.RABBITMQ.URL)
+        _revocation_publisher.publish(token_hash, expires_at)
@@ -0,0 +1,198 @@
+"""
+Token Validation Cache for Censudx API Gateway
+Caches validated token -> roles lookups in-process and, optionally, in Redis
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import jwt
+
+from gateway.config import Config
+
+# Redis is optional: without it the cache runs with the in-process tier only
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "gateway:token:"
+
+
+def hash_token(token: str) -> str:
+    """Hash a token so raw credentials are never used as cache keys"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Read the exp claim of a JWT without verifying it (None if absent or not a JWT)"""
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return None
+    exp = claims.get("exp")
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+class TokenCache:
+    """
+    Two-tier cache of validated tokens
+    Tier 1 is a per-process TTL/LRU dict, tier 2 is a shared Redis keyspace
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        default_ttl: int = 60,
+        redis_url: Optional[str] = None,
+        redis_client: Any = None
+    ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # token hash -> (monotonic expiry, roles)
+        self.entries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self.redis = redis_client
+        if self.redis is None and redis_url and aioredis is not None:
+            self.redis = aioredis.from_url(
+                redis_url,
+                socket_timeout=Config.REDIS.SOCKET_TIMEOUT,
+                socket_connect_timeout=Config.REDIS.SOCKET_TIMEOUT
+            )
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "redis_errors": 0
+        }
+
+    def ttl_for(self, token: str) -> int:
+        """TTL for a token: the configured TTL capped by the token's own expiry"""
+        ttl = self.default_ttl
+        exp = token_expiry(token)
+        if exp is not None:
+            ttl = min(ttl, int(exp - time.time()))
+        return max(ttl, 0)
+
+    def _get_local(self, key: str) -> Optional[List[str]]:
+        """Look up the in-process tier, dropping the entry if it has expired"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, roles = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return roles
+
+    def _set_local(self, key: str, roles: List[str], ttl: int) -> None:
+        """Store in the in-process tier, evicting the least recently used entry"""
+        self.entries[key] = (time.monotonic() + ttl, roles)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def peek(self, token: str) -> Optional[List[str]]:
+        """
+        Cached roles of a token from the in-process tier only
+
+        Leaves Redis, the LRU order and the hit/miss stats alone, so lookups made
+        outside token validation (rate limit keying) cost no round trip.
+        """
+        entry = self.entries.get(hash_token(token))
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    async def get(self, token: str) -> Optional[List[str]]:
+        """
+        Get cached roles for a token
+
+        Returns:
+            List of roles, or None on a miss in both tiers
+        """
+        key = hash_token(token)
+        roles = self._get_local(key)
+        if roles is not None:
+            self.stats["local_hits"] += 1
+            return roles
+
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"Token cache Redis lookup failed: {e}")
+                raw = None
+            if raw is not None:
+                roles = json.loads(raw)
+                ttl = self.ttl_for(token)
+                if ttl > 0:
+                    self._set_local(key, roles, ttl)
+                self.stats["redis_hits"] += 1
+                return roles
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, token: str, roles: List[str]) -> None:
+        """Cache the roles of a validated token in both tiers"""
+        ttl = self.ttl_for(token)
+        if ttl <= 0:
+            return
+        key = hash_token(token)
+        self._set_local(key, roles, ttl)
+        self.stats["stores"] += 1
+        if self.redis is not None:
+            try:
+                await self.redis.set(REDIS_KEY_PREFIX + key, json.dumps(roles), ex=ttl)
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"Token cache Redis store failed: {e}")
+
+    async def invalidate(self, token: str) -> None:
+        """Remove a token from both tiers"""
+        key = hash_token(token)
+        self.entries.pop(key, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"Token cache Redis delete failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.stats["local_hits"] + self.stats["redis_hits"] + self.stats["misses"]
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "redis_enabled": self.redis is not None,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Process-wide cache instance
+_token_cache: Optional[TokenCache] = None
+
+
+def get_token_cache() -> Optional[TokenCache]:
+    """Get the process-wide token cache (None when caching is disabled)"""
+    global _token_cache
+    if _token_cache is None and Config.AUTH.TOKEN_CACHE_ENABLED:
+        redis_url = Config.REDIS.URL if Config.AUTH.TOKEN_CACHE_REDIS_ENABLED else None
+        _token_cache = TokenCache(
+            max_entries=Config.AUTH.TOKEN_CACHE_MAX_ENTRIES,
+            default_ttl=Config.AUTH.TOKEN_CACHE_TTL,
+            redis_url=redis_url
+        )
+    return _token_cache
@@ -0,0 +1,156 @@
+"""
+Priority Admission Control for Censudx API Gateway
+Queues requests by route priority once the gateway is busy and sheds the lowest priorities first
+"""
+
+import asyncio
+import collections
+import logging
+from typing import Any, Deque, Dict, List, Optional, Pattern, Tuple
+
+from gateway.config import ADMISSION_PRIORITIES, ADMISSION_PRIORITY_ROUTES, Config
+from gateway.middleware.rate_limit_policies import MAX_CACHED_ROUTES, compile_path, normalize_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = "normal"
+
+
+class AdmissionController:
+    """
+    Gateway-wide in-flight capacity shared out by priority
+    A priority is admitted straight away while fewer than max_utilization * capacity
+    requests are in flight (and no request of the same or a higher priority is waiting),
+    so lower priorities stop being admitted before higher ones. Otherwise the request
+    waits up to its queue_timeout; freed slots go to the highest priority waiting
+    """
+
+    def __init__(
+        self,
+        capacity: int = 0,
+        priorities: Optional[Dict[str, Dict[str, Any]]] = None,
+        routes: Optional[List[Dict[str, Any]]] = None
+    ):
+        priorities = ADMISSION_PRIORITIES if priorities is None else priorities
+        if DEFAULT_PRIORITY not in priorities:
+            raise ValueError(f"Admission priorities must define '{DEFAULT_PRIORITY}'")
+        # 0 disables admission control
+        self.capacity = capacity
+        self.order = list(priorities)
+        self.queue_timeouts = {name: float(p.get("queue_timeout", 0)) for name, p in priorities.items()}
+        self.limits = {
+            name: max(1, int(capacity * p.get("max_utilization", 1.0)))
+            for name, p in priorities.items()
+        }
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {name: collections.deque() for name in self.order}
+        self.in_flight = 0
+        self.stats = {name: {"admitted": 0, "queued": 0, "shed": 0} for name in self.order}
+
+        self.rules: List[Tuple[str, Pattern, str]] = []
+        for route in ADMISSION_PRIORITY_ROUTES if routes is None else routes:
+            priority = route["priority"]
+            if priority not in priorities:
+                raise ValueError(f"Admission route {route['path']} uses unknown priority '{priority}'")
+            self.rules.append((route.get("method", "*").upper(), compile_path(route["path"]), priority))
+        self.cache: Dict[Tuple[str, str], str] = {}
+
+    def priority_of(self, method: str, path: str) -> str:
+        """Priority of the first route matching method and path ("normal" otherwise)"""
+        cache_key = (method, path)
+        priority = self.cache.get(cache_key)
+        if priority is not None:
+            return priority
+        priority = DEFAULT_PRIORITY
+        normalized = normalize_path(path)
+        for rule_method, pattern, rule_priority in self.rules:
+            if (rule_method == "*" or rule_method == method) and pattern.match(normalized):
+                priority = rule_priority
+                break
+        if len(self.cache) >= MAX_CACHED_ROUTES:
+            self.cache.clear()
+        self.cache[cache_key] = priority
+        return priority
+
+    def waiting_ahead(self, priority: str) -> bool:
+        """Whether a request of this or a higher priority is already queued"""
+        for name in self.order:
+            if self.waiters[name]:
+                return True
+            if name == priority:
+                return False
+        return False
+
+    async def acquire(self, priority: str) -> bool:
+        """
+        Admit a request of a priority, queueing it if the gateway is busy
+
+        Returns:
+            False when the request is shed; the caller must release() an admitted one
+        """
+        stats = self.stats[priority]
+        if not self.capacity or (self.in_flight < self.limits[priority] and not self.waiting_ahead(priority)):
+            self.in_flight += 1
+            stats["admitted"] += 1
+            return True
+        queue = self.waiters[priority]
+        timeout = self.queue_timeouts[priority]
+        if timeout <= 0 or len(queue) >= self.capacity:
+            stats["shed"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        stats["queued"] += 1
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the client went away
+                self.release()
+            else:
+                queue.remove(waiter)
+                waiter.cancel()
+            raise
+        if not waiter.done():
+            queue.remove(waiter)
+            waiter.cancel()
+            stats["shed"] += 1
+            return False
+        stats["admitted"] += 1
+        return True
+
+    def release(self) -> None:
+        """Give back an admitted request's slot, handing it to the highest priority waiting"""
+        self.in_flight -= 1
+        for name in self.order:
+            queue = self.waiters[name]
+            while queue and self.in_flight < self.limits[name]:
+                # in_flight carries over to the woken request
+                self.in_flight += 1
+                queue.popleft().set_result(None)
+            if queue:
+                # Lower priorities never overtake a higher one still waiting
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        """In-flight requests and per-priority counters and queue lengths"""
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "priorities": {
+                name: {**self.stats[name], "queue": len(self.waiters[name]), "limit": self.limits[name]}
+                for name in self.order
+            }
+        }
+
+
+# Process-wide admission controller instance
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Get or create the process-wide admission controller"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(Config.RATE_LIMIT.MAX_IN_FLIGHT)
+    return _admission_controller
@@ -0,0 +1,108 @@
+"""
+Concurrency Limiting for Censudx API Gateway
+Caps in-flight requests per client key and for the whole gateway process
+"""
+
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from gateway.config import RATE_LIMIT_CLASSES
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyDecision:
+    """Outcome of a concurrency check and the headers that describe it"""
+
+    __slots__ = ("allowed", "status", "limit", "in_flight")
+
+    def __init__(self, allowed: bool, status: int, limit: Optional[int], in_flight: int):
+        self.allowed = allowed
+        # 429 when the client is over its own limit, 503 when the gateway is saturated
+        self.status = status
+        self.limit = limit
+        self.in_flight = in_flight
+
+    def headers(self) -> List[Tuple[bytes, bytes]]:
+        """X-Concurrency-* (and Retry-After on rejection) as raw ASGI headers"""
+        headers = []
+        if self.limit is not None:
+            headers.append((b"x-concurrency-limit", str(self.limit).encode()))
+            headers.append((b"x-concurrency-remaining", str(max(0, self.limit - self.in_flight)).encode()))
+        if not self.allowed:
+            # In-flight requests usually finish within a second
+            headers.append((b"retry-after", b"1"))
+        return headers
+
+
+class ConcurrencyLimiter:
+    """
+    In-flight request counters keyed like the rate limiter (limit class + client identity)
+    Per-key limits come from the max_in_flight of each rate limit class; the event loop
+    is the only writer, so no locking is needed
+    """
+
+    def __init__(
+        self,
+        limit_classes: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_in_flight: int = 0
+    ):
+        self.limits = {
+            name: limits.get("max_in_flight")
+            for name, limits in (limit_classes or RATE_LIMIT_CLASSES).items()
+        }
+        # Process-wide cap (0 disables it)
+        self.max_in_flight = max_in_flight
+        self.in_flight: Dict[str, int] = {}
+        self.total = 0
+        self.stats = {"admitted": 0, "rejected_client": 0, "rejected_overload": 0, "peak_in_flight": 0}
+
+    def acquire(self, key: str) -> ConcurrencyDecision:
+        """Admit a request for key (the caller must release it when admitted)"""
+        limit = self.limits.get(key.split(":")[0])
+        current = self.in_flight.get(key, 0)
+        if self.max_in_flight and self.total >= self.max_in_flight:
+            self.stats["rejected_overload"] += 1
+            return ConcurrencyDecision(False, 503, limit, current)
+        if limit is not None and current >= limit:
+            self.stats["rejected_client"] += 1
+            return ConcurrencyDecision(False, 429, limit, current)
+        current += 1
+        self.in_flight[key] = current
+        self.total += 1
+        self.stats["admitted"] += 1
+        if self.total > self.stats["peak_in_flight"]:
+            self.stats["peak_in_flight"] = self.total
+        return ConcurrencyDecision(True, 200, limit, current)
+
+    def release(self, key: str) -> None:
+        """Release a request admitted for key"""
+        current = self.in_flight.get(key, 0) - 1
+        if current > 0:
+            self.in_flight[key] = current
+        else:
+            # Idle keys take no memory
+            self.in_flight.pop(key, None)
+        self.total = max(0, self.total - 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters and current in-flight requests"""
+        return {
+            **self.stats,
+            "in_flight": self.total,
+            "max_in_flight": self.max_in_flight,
+            "active_keys": len(self.in_flight)
+        }
+
+
+# Process-wide concurrency limiter instance
+_concurrency_limiter: Optional[ConcurrencyLimiter] = None
+
+
+def get_concurrency_limiter() -> ConcurrencyLimiter:
+    """Get or create the process-wide concurrency limiter"""
+    global _concurrency_limiter
+    if _concurrency_limiter is None:
+        # The gateway-wide cap is enforced by priority in the admission controller
+        _concurrency_limiter = ConcurrencyLimiter()
+    return _concurrency_limiter
@@ -0,0 +1,245 @@
+"""
+Client IP Filter for Censudx API Gateway
+Resolves the real client IP through trusted proxies and rejects blocklisted ranges before any other middleware
+"""
+
+import ipaddress
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from gateway.config import Config
+
+logger = logging.getLogger(__name__)
+
+FORBIDDEN_BODY = b'{"error":"Forbidden","message":"Access from this address is not allowed."}'
+
+
+class CIDRTrie:
+    """
+    Binary prefix trie of IPv4 and IPv6 networks
+    A lookup walks at most 32 (IPv4) or 128 (IPv6) bits, whatever the number of networks
+    """
+
+    def __init__(self, networks: Iterable[str] = ()):
+        # Node: [child for bit 0, child for bit 1, terminal flag]; one root per IP version
+        self.roots: Dict[int, list] = {4: [None, None, False], 6: [None, None, False]}
+        self.size = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network: str) -> None:
+        """Add a network in CIDR notation (a bare address is a /32 or /128)"""
+        parsed = ipaddress.ip_network(network.strip(), strict=False)
+        value = int(parsed.network_address)
+        node = self.roots[parsed.version]
+        for i in range(parsed.max_prefixlen - 1, parsed.max_prefixlen - 1 - parsed.prefixlen, -1):
+            bit = (value >> i) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+        self.size += 1
+
+    def contains(self, address: str) -> bool:
+        """Whether an address falls in any network of the trie (False if unparsable)"""
+        try:
+            parsed = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        if parsed.version == 6 and parsed.ipv4_mapped is not None:
+            parsed = parsed.ipv4_mapped
+        value = int(parsed)
+        node = self.roots[parsed.version]
+        bits = parsed.max_prefixlen
+        for i in range(bits - 1, -1, -1):
+            if node[2]:
+                return True
+            node = node[(value >> i) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def parse_networks(text: str) -> List[str]:
+    """CIDRs from a comma/newline separated list, ignoring blanks and # comments"""
+    networks = []
+    for line in text.replace(",", "\n").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            networks.append(line)
+    return networks
+
+
+class IPBlocklist:
+    """
+    Blocklisted networks from configuration and an optional file
+    reload() builds a new trie and swaps it in, so lookups never see a partial list.
+    Every worker holds its own copy and reloads it when the file changes (check_file)
+    """
+
+    def __init__(self, networks: str = "", path: str = "", check_interval: float = 1.0):
+        self.networks = networks
+        self.path = path
+        self.check_interval = check_interval
+        self.trie = CIDRTrie()
+        self.lock = threading.Lock()
+        # (mtime, size) of the file as last read, and when to look at it again
+        self.file_version: Optional[Tuple[int, int]] = None
+        self.next_check = 0.0
+        self.stats = {"blocked": 0, "reloads": 0, "reload_errors": 0}
+        self.reload()
+
+    def read_file_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self) -> int:
+        """
+        Re-read the configured networks and file
+
+        Returns:
+            Number of networks loaded
+
+        Raises:
+            ValueError: A network is malformed (the current list is kept)
+        """
+        with self.lock:
+            file_version = self.read_file_version() if self.path else None
+            networks = parse_networks(self.networks)
+            if self.path and os.path.exists(self.path):
+                with open(self.path) as blocklist_file:
+                    networks.extend(parse_networks(blocklist_file.read()))
+            trie = CIDRTrie(networks)
+            self.trie = trie
+            self.file_version = file_version
+            self.stats["reloads"] += 1
+        logger.info(f"IP blocklist loaded: {len(trie)} networks")
+        return len(trie)
+
+    def check_file(self) -> None:
+        """Reload if the blocklist file changed, looking at most once per check_interval"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        file_version = self.read_file_version()
+        if file_version == self.file_version:
+            return
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            # Keep the current list and wait for the file to change again
+            self.file_version = file_version
+            self.stats["reload_errors"] += 1
+            logger.error(f"IP blocklist not reloaded: {e}")
+
+    def is_blocked(self, address: str) -> bool:
+        if self.trie.contains(address):
+            self.stats["blocked"] += 1
+            return True
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "networks": len(self.trie), "file": self.path or None}
+
+
+def resolve_client_ip(scope: Dict[str, Any], trusted_proxies: CIDRTrie) -> Optional[str]:
+    """
+    Client IP of a request, honouring forwarded headers only from trusted proxies
+
+    X-Forwarded-For is walked right to left; the first address not in a trusted proxy
+    network is the client. Headers sent by untrusted peers are ignored.
+    """
+    client = scope.get("client")
+    peer = client[0] if client else None
+    if peer is None or not trusted_proxies.contains(peer):
+        return peer
+    forwarded_for = None
+    real_ip = None
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            # Repeated headers are one comma-separated list
+            forwarded_for = value if forwarded_for is None else forwarded_for + b"," + value
+        elif name == b"x-real-ip":
+            real_ip = value
+    if forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.decode("latin-1").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not trusted_proxies.contains(hop):
+                return hop
+        # Every hop is a trusted proxy: the leftmost is the closest we get to the client
+        return hops[0] if hops else peer
+    if real_ip:
+        return real_ip.decode("latin-1").strip()
+    return peer
+
+
+class IPFilterMiddleware:
+    """
+    Outermost pure-ASGI stage
+    Rewrites scope["client"] to the resolved client IP for every later stage and answers
+    blocklisted sources with 403 before any other work is done
+    """
+
+    def __init__(self, app, trusted_proxies: Optional[CIDRTrie] = None, blocklist: Optional[IPBlocklist] = None):
+        self.app = app
+        self.trusted_proxies = trusted_proxies if trusted_proxies is not None else CIDRTrie(
+            parse_networks(Config.GATEWAY.TRUSTED_PROXIES)
+        )
+        self.blocklist = blocklist
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        client_ip = resolve_client_ip(scope, self.trusted_proxies)
+        if client_ip is not None:
+            client = scope.get("client")
+            scope["client"] = (client_ip, client[1] if client else 0)
+
+        blocklist = self.blocklist or get_ip_blocklist()
+        blocklist.check_file()
+        if client_ip is not None and blocklist.is_blocked(client_ip):
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            await send({
+                "type": "http.response.start",
+                "status": 403,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(FORBIDDEN_BODY)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": FORBIDDEN_BODY})
+            return
+
+        await self.app(scope, receive, send)
+
+
+# Process-wide blocklist instance
+_ip_blocklist: Optional[IPBlocklist] = None
+
+
+def get_ip_blocklist() -> IPBlocklist:
+    """Get or create the process-wide IP blocklist"""
+    global _ip_blocklist
+    if _ip_blocklist is None:
+        _ip_blocklist = IPBlocklist(
+            Config.GATEWAY.IP_BLOCKLIST,
+            Config.GATEWAY.IP_BLOCKLIST_FILE,
+            Config.GATEWAY.IP_BLOCKLIST_CHECK_INTERVAL
+        )
+    return _ip_blocklist
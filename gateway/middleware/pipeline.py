@@ -0,0 +1,239 @@
+"""
+Gateway Pipeline for Censudx API Gateway
+Single pure-ASGI stage: request ID, rate limit and priority admission and response headers in one pass
+"""
+
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import jwt
+from fastapi import HTTPException
+
+from gateway.auth.jwt_verifier import UnknownSigningKey, get_local_verifier
+from gateway.auth.token_cache import get_token_cache
+from gateway.config import Config
+from gateway.middleware.admission import AdmissionController, get_admission_controller
+from gateway.middleware.concurrency import ConcurrencyLimiter, get_concurrency_limiter
+from gateway.middleware.rate_limiting import RateLimiter, get_rate_limiter
+from gateway.middleware.request_id import REQUEST_ID_HEADER, assign_request_id
+from gateway.middleware.traffic_analytics import TrafficAnalytics, get_traffic_analytics
+from gateway.upstream.stale_cache import stale_headers
+
+logger = logging.getLogger(__name__)
+
+# Health checks and internal endpoints are never rate limited
+SKIP_PATHS = frozenset({"/health", "/gateway/health", "/gateway/ready", "/nginx_status"})
+
+RATE_LIMITED_BODY = b'{"error":"Rate limit exceeded","message":"Too many requests. Please try again later."}'
+CONCURRENCY_LIMITED_BODY = b'{"error":"Too many concurrent requests","message":"Wait for your pending requests to finish."}'
+OVERLOADED_BODY = b'{"error":"Gateway overloaded","message":"Too many requests in progress. Please try again later."}'
+
+# Claims that may carry the user id, in order of preference
+SUBJECT_CLAIMS = ("sub", "nameid", "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/nameidentifier", "id")
+
+API_KEY_HEADER = Config.RATE_LIMIT.API_KEY_HEADER.lower().encode("latin-1")
+
+
+def get_client_ip(scope: Dict[str, Any]) -> str:
+    """
+    Client IP address of an ASGI scope
+
+    Forwarded headers are not read here: IPFilterMiddleware has already replaced the
+    peer address with the client IP vouched for by a trusted proxy.
+    """
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def hash_api_key(value: bytes) -> str:
+    """Limiter identity of an API key (raw keys never end up in limiter keys or Redis)"""
+    return "key:" + hashlib.sha256(value).hexdigest()[:32]
+
+
+# Identities of the configured API keys; any other key is ignored
+API_KEY_IDENTITIES = frozenset(
+    hash_api_key(key.strip().encode("latin-1")) for key in Config.RATE_LIMIT.API_KEYS.split(",") if key.strip()
+)
+
+# Limit classes whose requests are also charged to the client IP, so verified
+# identities cannot multiply the attempts one address gets on login routes
+PER_IP_CLASSES = frozenset({"auth"})
+
+
+def token_subject(token: str) -> Optional[str]:
+    """
+    User id claim of a bearer JWT (None for opaque or malformed tokens)
+
+    The signature is not checked here; callers only trust the result once the token
+    itself has been verified (see verified_subject).
+    """
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return None
+    for claim in SUBJECT_CLAIMS:
+        value = claims.get(claim)
+        if isinstance(value, (str, int)) and value != "":
+            return str(value)
+    return None
+
+
+async def verified_subject(token: str) -> Optional[str]:
+    """
+    User id of a bearer JWT whose signature has been checked (None otherwise)
+
+    A token counts as checked when the local verifier accepts it or when it is in the
+    in-process tier of the validated token cache (the auth service accepted it);
+    made-up tokens are never trusted, so they cannot buy a fresh rate limit bucket
+    per request.
+    """
+    subject = token_subject(token)
+    if subject is None:
+        return None
+    verifier = get_local_verifier()
+    if verifier is not None:
+        try:
+            await verifier.verify(token)
+            return subject
+        except UnknownSigningKey:
+            pass
+        except HTTPException:
+            return None
+    cache = get_token_cache()
+    if cache is not None and cache.peek(token) is not None:
+        return subject
+    return None
+
+
+async def get_rate_limit_identity(scope: Dict[str, Any]) -> Optional[str]:
+    """Configured API key or verified subject of a request (None for anyone else)"""
+    authorization = None
+    for name, value in scope["headers"]:
+        if name == API_KEY_HEADER and value:
+            identity = hash_api_key(value)
+            if identity in API_KEY_IDENTITIES:
+                return identity
+        elif name == b"authorization":
+            authorization = value
+    if authorization and authorization[:7].lower() == b"bearer ":
+        subject = await verified_subject(authorization[7:].decode("latin-1").strip())
+        if subject is not None:
+            return "sub:" + subject
+    return None
+
+
+async def send_response(send: Callable, status: int, body: bytes, headers: List[Tuple[bytes, bytes]]) -> None:
+    """Send a complete JSON response without going through the application"""
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class GatewayPipelineMiddleware:
+    """
+    Replaces the RequestID and RateLimiting BaseHTTPMiddleware layers
+    No per-request task or body wrapper: over-limit traffic is answered before routing
+    and headers are added to the response start message on the way out
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: Optional[ConcurrencyLimiter] = None,
+        analytics: Optional[TrafficAnalytics] = None,
+        admission: Optional[AdmissionController] = None
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.analytics = analytics
+        self.admission = admission
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = assign_request_id(scope)
+        extra_headers = [(REQUEST_ID_HEADER, request_id.encode("latin-1"))]
+
+        path = scope["path"]
+        concurrency_key = None
+        if path not in SKIP_PATHS:
+            limiter = self.limiter or get_rate_limiter()
+            # Configured API keys and verified subjects are limited per identity, anyone else per IP
+            client_ip = get_client_ip(scope)
+            identity = await get_rate_limit_identity(scope) or client_ip
+            key, cost = limiter.resolve(scope["method"], path, identity)
+            decision = await limiter.check(key, cost)
+            limit_class = key.split(":", 1)[0]
+            if decision.allowed and identity != client_ip and limit_class in PER_IP_CLASSES:
+                ip_decision = await limiter.check(f"{limit_class}:{client_ip}", cost)
+                if not ip_decision.allowed:
+                    decision = ip_decision
+            analytics = self.analytics or get_traffic_analytics()
+            if not decision.allowed:
+                analytics.record(identity, scope["method"], path, rejected=True)
+                logger.warning(f"Rate limit exceeded for {identity} on {path}")
+                await send_response(send, 429, RATE_LIMITED_BODY, extra_headers + decision.headers())
+                return
+            extra_headers.extend(decision.headers())
+
+            # Bound in-flight requests so slow endpoints cannot be monopolized by a few clients;
+            # slots are keyed like the rate limit (verified identity, else client IP), so
+            # made-up tokens or keys cannot open extra ones
+            concurrency = self.concurrency or get_concurrency_limiter()
+            admission = concurrency.acquire(key)
+            if not admission.allowed:
+                analytics.record(identity, scope["method"], path, rejected=True)
+                logger.warning(f"Concurrency limit ({admission.status}) for {identity} on {path}")
+                body = CONCURRENCY_LIMITED_BODY if admission.status == 429 else OVERLOADED_BODY
+                await send_response(send, admission.status, body, extra_headers + admission.headers())
+                return
+            extra_headers.extend(admission.headers())
+
+            # Under load, lower priority routes queue behind higher ones and are shed first
+            controller = self.admission or get_admission_controller()
+            priority = controller.priority_of(scope["method"], path)
+            try:
+                admitted = await controller.acquire(priority)
+            except BaseException:
+                concurrency.release(key)
+                raise
+            analytics.record(identity, scope["method"], path, rejected=not admitted)
+            if not admitted:
+                concurrency.release(key)
+                logger.warning(f"Shed {priority} priority request from {identity} on {path}")
+                await send_response(send, 503, OVERLOADED_BODY, extra_headers + [(b"retry-after", b"1")])
+                return
+            concurrency_key = key
+
+        names = {name for name, _ in extra_headers}
+
+        async def send_with_headers(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = [h for h in message.get("headers", []) if h[0].lower() not in names]
+                headers.extend(extra_headers)
+                # Answers built from a stale upstream response say so
+                headers.extend(stale_headers(scope))
+                message["headers"] = headers
+            await send(message)
+
+        if concurrency_key is None:
+            await self.app(scope, receive, send_with_headers)
+            return
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            # Runs on completion, error and cancellation (client disconnect) alike
+            concurrency.release(concurrency_key)
+            controller.release()
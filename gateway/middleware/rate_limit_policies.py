@@ -0,0 +1,96 @@
+"""
+Rate Limit Policies for Censudx API Gateway
+Compiles the route policy table into per-route limit classes and token costs
+"""
+
+import re
+from typing import Dict, Any, List, Pattern, Tuple
+
+# Resolved (method, path) pairs kept before the resolution cache is reset
+MAX_CACHED_ROUTES = 10000
+
+
+class RateLimitPolicy:
+    """Limit class and token cost of a route"""
+
+    __slots__ = ("limit_class", "cost")
+
+    def __init__(self, limit_class: str, cost: int = 1):
+        self.limit_class = limit_class
+        self.cost = cost
+
+
+def normalize_path(path: str) -> str:
+    """Drop the trailing slash so /api/v1/inventory/ and /api/v1/inventory match alike"""
+    if len(path) > 1 and path.endswith("/"):
+        return path[:-1]
+    return path
+
+
+def compile_path(template: str) -> Pattern:
+    """
+    Compile a route template into a regex
+
+    {param} matches one path segment and a trailing /* matches any suffix.
+    """
+    template = normalize_path(template)
+    prefix = template.endswith("/*")
+    if prefix:
+        template = template[:-2]
+    pattern = ""
+    for part in re.split(r"(\{[^/{}]+\})", template):
+        if part.startswith("{") and part.endswith("}"):
+            pattern += "[^/]+"
+        else:
+            pattern += re.escape(part)
+    if prefix:
+        pattern += "(?:/.*)?"
+    return re.compile(pattern + "$")
+
+
+class RateLimitPolicyTable:
+    """
+    Ordered route policies compiled once at startup
+    Lookups go through a bounded cache so regexes only run for new routes
+    """
+
+    def __init__(self, policies: List[Dict[str, Any]], limit_classes: Dict[str, Dict[str, Any]]):
+        self.default = RateLimitPolicy("default", 1)
+        self.rules: List[Tuple[str, Pattern, RateLimitPolicy]] = []
+        for policy in policies:
+            limit_class = policy.get("class", "default")
+            if limit_class not in limit_classes:
+                raise ValueError(f"Rate limit policy for {policy['path']} uses unknown class '{limit_class}'")
+            cost = int(policy.get("cost", 1))
+            if cost < 1:
+                raise ValueError(f"Rate limit policy for {policy['path']} must cost at least 1 token")
+            capacity = limit_classes[limit_class]["tokens"]
+            if cost > capacity:
+                # Such a route could never be admitted, not even with a full bucket
+                raise ValueError(
+                    f"Rate limit policy for {policy['path']} costs {cost} tokens, "
+                    f"more than the {capacity} of class '{limit_class}'"
+                )
+            self.rules.append((
+                policy.get("method", "*").upper(),
+                compile_path(policy["path"]),
+                RateLimitPolicy(limit_class, cost)
+            ))
+        self.cache: Dict[Tuple[str, str], RateLimitPolicy] = {}
+
+    def resolve(self, method: str, path: str) -> RateLimitPolicy:
+        """Policy of the first rule matching method and path (default class otherwise)"""
+        cache_key = (method, path)
+        policy = self.cache.get(cache_key)
+        if policy is not None:
+            return policy
+        policy = self.default
+        normalized = normalize_path(path)
+        for rule_method, pattern, rule_policy in self.rules:
+            if (rule_method == "*" or rule_method == method) and pattern.match(normalized):
+                policy = rule_policy
+                break
+        if len(self.cache) >= MAX_CACHED_ROUTES:
+            self.cache.clear()
+        self.cache[cache_key] = policy
+        return policy
@@ -1,142 +1,200 @@
 """
-Rate Limiting Middleware for Censudx API Gateway
-Implements token bucket algorithm for rate limiting
+Rate Limiting for Censudx API Gateway
+Implements GCRA (token bucket equivalent) rate limiting
 """
 
 import time
-from typing import Dict, Any
-from fastapi import Request, Response, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+from gateway.config import RATE_LIMIT_CLASSES, RATE_LIMIT_POLICIES, Config
+from gateway.middleware.rate_limit_policies import RateLimitPolicyTable
+
 logger = logging.getLogger(__name__)
 
-class TokenBucket:
-    def __init__(self, tokens: int, refill_rate: float):
-        self.capacity = tokens
-        self.tokens = tokens
-        self.refill_rate = refill_rate
-        self.last_refill = time.time()
-    
-    def consume(self, tokens: int = 1) -> bool:
-        """Try to consume tokens from the bucket"""
+# Slack for float rounding when comparing GCRA arrival times (seconds)
+EPSILON = 1e-6
+
+class RateLimitDecision:
+    """Outcome of a rate limit check and the headers that describe it"""
+
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: float, reset_after: float, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Seconds until the bucket is full again
+        self.reset_after = reset_after
+        # Seconds until the next request would be admitted (rejections only)
+        self.retry_after = retry_after
+
+    def headers(self) -> List[Tuple[bytes, bytes]]:
+        """X-RateLimit-* (and Retry-After on rejection) as raw ASGI headers"""
         now = time.time()
-        # Refill tokens based on time passed
-        self.tokens = min(
-            self.capacity,
-            self.tokens + (now - self.last_refill) * self.refill_rate
+        if self.allowed:
+            reset = int(now + self.reset_after)
+        else:
+            reset = int(now + int(self.retry_after))
+        headers = [
+            (b"x-ratelimit-limit", str(self.limit).encode()),
+            (b"x-ratelimit-remaining", str(int(self.remaining)).encode()),
+            (b"x-ratelimit-reset", str(reset).encode()),
+        ]
+        if not self.allowed:
+            headers.append((b"retry-after", str(int(self.retry_after)).encode()))
+        return headers
+
+class GCRAKeyStore:
+    """
+    Bounded GCRA state: one theoretical arrival time (TAT) per key in flat arrays
+    A CLOCK hand evicts in amortized O(1) once max_keys is reached, idle keys first
+    (an idle key's TAT is in the past, i.e. a full bucket, so dropping it loses nothing)
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> slot
+        self.slots: Dict[str, int] = {}
+        # Per-slot key, TAT (monotonic seconds) and CLOCK reference bit
+        self.keys: List[str] = []
+        self.tats = array("d")
+        self.referenced = bytearray()
+        self.hand = 0
+        self.stats = {"evicted_idle": 0, "evicted_active": 0}
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def get(self, key: str) -> float:
+        """TAT of key (0.0 if unknown, i.e. a full bucket)"""
+        slot = self.slots.get(key)
+        if slot is None:
+            return 0.0
+        self.referenced[slot] = 1
+        return self.tats[slot]
+
+    def set(self, key: str, tat: float, now: float) -> None:
+        """Store the TAT of key, evicting another key if the store is full"""
+        slot = self.slots.get(key)
+        if slot is None:
+            if len(self.keys) < self.max_keys:
+                slot = len(self.keys)
+                self.keys.append(key)
+                self.tats.append(tat)
+                self.referenced.append(1)
+                self.slots[key] = slot
+                return
+            slot = self.evict(now)
+            self.keys[slot] = key
+            self.slots[key] = slot
+        self.tats[slot] = tat
+        self.referenced[slot] = 1
+
+    def evict(self, now: float) -> int:
+        """Free a slot: the first idle or unreferenced one under the CLOCK hand"""
+        while True:
+            slot = self.hand
+            self.hand = (slot + 1) % self.max_keys
+            if self.tats[slot] <= now:
+                self.stats["evicted_idle"] += 1
+                break
+            if not self.referenced[slot]:
+                self.stats["evicted_active"] += 1
+                break
+            # Second chance for recently used keys
+            self.referenced[slot] = 0
+        del self.slots[self.keys[slot]]
+        return slot
+
+class LocalRateLimitBackend:
+    """
+    GCRA rate limiting in process memory (equivalent to a token bucket)
+    Each worker/replica enforces its own quota; also the fallback of shared backends
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.store = GCRAKeyStore(max_keys)
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> RateLimitDecision:
+        """Consume cost tokens for key and report the outcome"""
+        now = time.monotonic()
+        # One token every interval seconds, bursts of up to capacity tokens
+        interval = 1.0 / refill_rate
+        burst = capacity * interval
+        tat = max(self.store.get(key), now)
+        new_tat = tat + cost * interval
+        if new_tat - now > burst + EPSILON:
+            retry_after = new_tat - now - burst
+            remaining = max(0.0, (burst - (tat - now)) / interval)
+            return RateLimitDecision(False, capacity, remaining, retry_after, retry_after)
+        self.store.set(key, new_tat, now)
+        remaining = int((burst - (new_tat - now)) / interval + EPSILON)
+        return RateLimitDecision(True, capacity, remaining, new_tat - now)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tracked keys and evictions"""
+        return {"backend": "memory", "keys": len(self.store), "max_keys": self.store.max_keys, **self.store.stats}
+
+class RateLimiter:
+    """
+    Rate limits keyed by limit class and client identity, with per-route token costs
+    Bucket state lives in a pluggable backend (in-process by default, Redis when shared)
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        policies: Optional[List[Dict[str, Any]]] = None,
+        rate_limits: Optional[Dict[str, Dict[str, Any]]] = None
+    ):
+        self.backend = backend or LocalRateLimitBackend(Config.RATE_LIMIT.MAX_KEYS)
+
+        # Rate limiting classes (bucket size and refill rate in requests per second)
+        self.rate_limits = {name: dict(limits) for name, limits in (rate_limits or RATE_LIMIT_CLASSES).items()}
+        # Route -> (limit class, token cost), compiled once
+        self.policies = RateLimitPolicyTable(
+            RATE_LIMIT_POLICIES if policies is None else policies,
+            self.rate_limits
         )
-        self.last_refill = now
-        
-        if self.tokens >= tokens:
-            self.tokens -= tokens
-            return True
-        return False
-
-class RateLimitingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-        # In-memory storage for rate limiting (use Redis in production)
-        self.buckets: Dict[str, TokenBucket] = {}
-        
-        # Rate limiting rules (requests per second)
-        self.rate_limits = {
-            "default": {"tokens": 60, "refill_rate": 1.0},  # 60 req/min
-            "auth": {"tokens": 10, "refill_rate": 0.17},    # 10 req/min
-            "api": {"tokens": 100, "refill_rate": 1.67},    # 100 req/min
-        }
-    
-    def get_client_ip(self, request: Request) -> str:
-        """Extract client IP address"""
-        # Check for forwarded headers first
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
-        
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-            
-        return request.client.host if request.client else "unknown"
-    
-    def get_rate_limit_key(self, request: Request) -> str:
-        """Generate rate limiting key"""
-        client_ip = self.get_client_ip(request)
-        path = request.url.path
-        
-        # Different limits for different endpoints
-        if "/auth/" in path:
-            return f"auth:{client_ip}"
-        elif "/api/" in path:
-            return f"api:{client_ip}"
+        self.stats = {"allowed": 0, "rejected": 0}
+
+    def resolve(self, method: str, path: str, identity: str) -> Tuple[str, int]:
+        """Rate limiting key and token cost of a request"""
+        policy = self.policies.resolve(method, path)
+        return f"{policy.limit_class}:{identity}", policy.cost
+
+    async def check(self, key: str, cost: int = 1) -> RateLimitDecision:
+        """Consume cost tokens for key and report the outcome"""
+        # Determine rate limit based on key prefix
+        config = self.rate_limits.get(key.split(":")[0], self.rate_limits["default"])
+        decision = await self.backend.consume(key, config["tokens"], config["refill_rate"], cost)
+        if decision.allowed:
+            self.stats["allowed"] += 1
         else:
-            return f"default:{client_ip}"
-    
-    def get_bucket(self, key: str) -> TokenBucket:
-        """Get or create token bucket for key"""
-        if key not in self.buckets:
-            # Determine rate limit based on key prefix
-            key_type = key.split(":")[0]
-            config = self.rate_limits.get(key_type, self.rate_limits["default"])
-            
-            self.buckets[key] = TokenBucket(
-                tokens=config["tokens"],
-                refill_rate=config["refill_rate"]
-            )
-            
-            # Clean up old buckets periodically
-            if len(self.buckets) > 10000:  # Max 10k buckets
-                self.cleanup_old_buckets()
-                
-        return self.buckets[key]
-    
-    def cleanup_old_buckets(self):
-        """Clean up buckets that haven't been used recently"""
-        now = time.time()
-        keys_to_remove = []
-        
-        for key, bucket in self.buckets.items():
-            if now - bucket.last_refill > 3600:  # 1 hour
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del self.buckets[key]
-    
-    async def dispatch(self, request: Request, call_next):
-        """Process request with rate limiting"""
-        # Skip rate limiting for health checks and internal endpoints
-        if request.url.path in ["/health", "/gateway/health", "/nginx_status"]:
-            return await call_next(request)
-        
-        # Get rate limiting key and bucket
-        rate_limit_key = self.get_rate_limit_key(request)
-        bucket = self.get_bucket(rate_limit_key)
-        
-        # Check if request is allowed
-        if not bucket.consume():
-            logger.warning(f"Rate limit exceeded for {self.get_client_ip(request)} on {request.url.path}")
-            
-            # Calculate retry after
-            retry_after = int((1 - bucket.tokens) / bucket.refill_rate)
-            
-            return Response(
-                content='{"error":"Rate limit exceeded","message":"Too many requests. Please try again later."}',
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                headers={
-                    "Content-Type": "application/json",
-                    "Retry-After": str(retry_after),
-                    "X-RateLimit-Limit": str(bucket.capacity),
-                    "X-RateLimit-Remaining": str(int(bucket.tokens)),
-                    "X-RateLimit-Reset": str(int(time.time() + retry_after))
-                }
-            )
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Add rate limiting headers to response
-        response.headers["X-RateLimit-Limit"] = str(bucket.capacity)
-        response.headers["X-RateLimit-Remaining"] = str(int(bucket.tokens))
-        response.headers["X-RateLimit-Reset"] = str(int(time.time() + (bucket.capacity - bucket.tokens) / bucket.refill_rate))
-        
-        return response
\ No newline at end of file
+            self.stats["rejected"] += 1
+        return decision
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters of the limiter and its backend"""
+        return {**self.stats, **self.backend.get_stats()}
+
+
+# Process-wide rate limiter instance
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get or create the process-wide rate limiter (backend chosen by RATE_LIMIT_BACKEND)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        backend = None
+        if Config.RATE_LIMIT.BACKEND == "redis":
+            from gateway.middleware.redis_limiter import create_redis_backend
+            backend = create_redis_backend()
+        elif Config.RATE_LIMIT.BACKEND == "shared":
+            from gateway.middleware.shm_limiter import create_shared_memory_backend
+            backend = create_shared_memory_backend()
+        _rate_limiter = RateLimiter(backend)
+    return _rate_limiter
@@ -0,0 +1,163 @@
+"""
+Redis Rate Limiting Backend for Censudx API Gateway
+Token buckets shared by every worker and replica, one atomic script call per decision
+"""
+
+import logging
+import time
+from typing import Dict, Any, List, Optional
+
+from gateway.config import Config
+from gateway.middleware.rate_limiting import LocalRateLimitBackend, RateLimitDecision
+
+# Redis is optional: without it the gateway keeps the in-process limiter
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Refill, settle locally admitted debt, then try to take cost tokens, atomically.
+# KEYS[1] bucket hash; ARGV capacity, refill rate (tokens/s), now (s), cost, debt
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local debt = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+if now > ts then
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    ts = now
+end
+tokens = math.max(0, tokens - debt)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(ts))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisRateLimitBackend:
+    """
+    Token buckets stored in Redis
+    Keys clearly under their limit are admitted locally for a small share of their
+    capacity and the debt is settled on the next round trip; Redis errors fall back
+    to in-process buckets for a while
+    """
+
+    def __init__(
+        self,
+        redis_client: Any,
+        key_prefix: str = "gateway:ratelimit:",
+        local_fraction: float = 0.1,
+        sync_interval: float = 1.0,
+        retry_interval: float = 5.0,
+        max_shadow_keys: int = 10000
+    ):
+        self.redis = redis_client
+        self.script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.key_prefix = key_prefix
+        self.local_fraction = local_fraction
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.max_shadow_keys = max_shadow_keys
+        self.fallback = LocalRateLimitBackend(Config.RATE_LIMIT.MAX_KEYS)
+        # key -> [tokens last seen in Redis minus local admissions, unsettled debt, wall-clock sync time]
+        self.shadow: Dict[str, List[float]] = {}
+        # Wall-clock time until which Redis is skipped after an error
+        self.unavailable_until = 0.0
+        self.stats = {
+            "redis_decisions": 0,
+            "local_decisions": 0,
+            "fallback_decisions": 0,
+            "redis_errors": 0
+        }
+
+    def admit_locally(self, key: str, capacity: int, cost: int, now: float) -> Optional[List[float]]:
+        """Shadow state of key if it can be admitted without a round trip, else None"""
+        shadow = self.shadow.get(key)
+        if shadow is None or now - shadow[2] >= self.sync_interval:
+            return None
+        batch = capacity * self.local_fraction
+        # Stay well away from the limit: at most a batch of local debt, never below half capacity
+        if shadow[1] + cost > batch or shadow[0] - cost < capacity / 2:
+            return None
+        return shadow
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> RateLimitDecision:
+        """Consume cost tokens for key and report the outcome"""
+        now = time.time()
+        if now < self.unavailable_until:
+            self.stats["fallback_decisions"] += 1
+            return await self.fallback.consume(key, capacity, refill_rate, cost)
+
+        shadow = self.admit_locally(key, capacity, cost, now)
+        if shadow is not None:
+            shadow[0] -= cost
+            shadow[1] += cost
+            self.stats["local_decisions"] += 1
+            return RateLimitDecision(True, capacity, shadow[0], (capacity - shadow[0]) / refill_rate)
+
+        debt = self.shadow[key][1] if key in self.shadow else 0
+        try:
+            allowed, tokens = await self.script(
+                keys=[self.key_prefix + key],
+                args=[capacity, refill_rate, now, cost, debt]
+            )
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable, using in-process buckets: {e}")
+            self.stats["redis_errors"] += 1
+            self.stats["fallback_decisions"] += 1
+            self.unavailable_until = now + self.retry_interval
+            return await self.fallback.consume(key, capacity, refill_rate, cost)
+
+        tokens = float(tokens)
+        self.stats["redis_decisions"] += 1
+        if key not in self.shadow and len(self.shadow) >= self.max_shadow_keys:
+            self.shadow.clear()
+        self.shadow[key] = [tokens, 0, now]
+        if not int(allowed):
+            retry_after = (cost - tokens) / refill_rate
+            return RateLimitDecision(False, capacity, tokens, retry_after, retry_after)
+        return RateLimitDecision(True, capacity, tokens, (capacity - tokens) / refill_rate)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters, tracked keys and fallback state"""
+        return {
+            "backend": "redis",
+            **self.stats,
+            "keys": len(self.shadow),
+            "fallback_keys": len(self.fallback.store),
+            "redis_available": time.time() >= self.unavailable_until
+        }
+
+
+def create_redis_backend() -> Optional[RedisRateLimitBackend]:
+    """Build the Redis backend from Config (None, i.e. in-process, if Redis is not configured)"""
+    if not Config.REDIS.URL or aioredis is None:
+        logger.warning("RATE_LIMIT_BACKEND=redis but Redis is not configured; using in-process rate limiting")
+        return None
+    client = aioredis.from_url(
+        Config.REDIS.URL,
+        socket_timeout=Config.REDIS.SOCKET_TIMEOUT,
+        socket_connect_timeout=Config.REDIS.SOCKET_TIMEOUT
+    )
+    return RedisRateLimitBackend(
+        client,
+        key_prefix=Config.RATE_LIMIT.REDIS_KEY_PREFIX,
+        local_fraction=Config.RATE_LIMIT.LOCAL_FRACTION,
+        sync_interval=Config.RATE_LIMIT.SYNC_INTERVAL,
+        retry_interval=Config.RATE_LIMIT.REDIS_RETRY_INTERVAL
+    )
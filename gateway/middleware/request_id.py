@@ -1,34 +1,27 @@
 """
-Request ID Middleware for Censudx API Gateway
-Adds unique request ID to each request for tracing
+Request ID for Censudx API Gateway
+Assigns a unique request ID to each request for tracing
 """
 
 import uuid
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-import logging
+from typing import Any, Dict
 
-logger = logging.getLogger(__name__)
+REQUEST_ID_HEADER = b"x-request-id"
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next):
-        """Add request ID to request and response"""
-        # Check if request already has an ID (from load balancer, etc.)
-        request_id = request.headers.get("x-request-id")
-        
-        if not request_id:
-            request_id = str(uuid.uuid4())
-        
-        # Add request ID to request state for access in endpoints
-        request.state.request_id = request_id
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Add request ID to response headers
-        response.headers["x-request-id"] = request_id
-        
-        return response
\ No newline at end of file
+
+def assign_request_id(scope: Dict[str, Any]) -> str:
+    """
+    Get the request ID of an ASGI HTTP scope, generating one if missing
+
+    The ID is stored in the scope state so endpoints can read request.state.request_id.
+    """
+    request_id = None
+    # Check if request already has an ID (from load balancer, etc.)
+    for name, value in scope["headers"]:
+        if name == REQUEST_ID_HEADER:
+            request_id = value.decode("latin-1")
+            break
+    if not request_id:
+        request_id = str(uuid.uuid4())
+    scope.setdefault("state", {})["request_id"] = request_id
+    return request_id
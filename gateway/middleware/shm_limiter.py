@@ -0,0 +1,184 @@
+"""
+Shared-Memory Rate Limiting Backend for Censudx API Gateway
+GCRA state in a fixed-size shared-memory hash table used by every uvicorn worker on the host
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Any, Optional
+
+from gateway.config import Config
+from gateway.middleware.rate_limiting import EPSILON, RateLimitDecision
+
+logger = logging.getLogger(__name__)
+
+# Segment header: magic, number of slot groups
+HEADER = struct.Struct("<8sQ")
+MAGIC = b"GWRLSHM1"
+# Slot: key fingerprint (0 = empty), theoretical arrival time (wall-clock seconds)
+SLOT = struct.Struct("<Qd")
+# Slots probed per key; a group is scanned (and locked) as a unit
+GROUP_SLOTS = 8
+GROUP = struct.Struct("<" + "Qd" * GROUP_SLOTS)
+
+
+def key_fingerprint(key: str) -> int:
+    """Non-zero 64-bit fingerprint of a key"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+class SharedMemoryRateLimitBackend:
+    """
+    GCRA buckets in a fixed-size hash table mapped from /dev/shm
+    Each key hashes to a group of GROUP_SLOTS slots; updates take an fcntl byte-range
+    lock on the group's stripe of the segment file, so unrelated worker processes
+    (uvicorn spawns them) coordinate without a shared parent. A full group evicts its
+    idle or stalest slot, so memory is fixed at creation.
+    """
+
+    def __init__(
+        self,
+        name: str = "censudx_gateway_ratelimit",
+        directory: str = "/dev/shm",
+        max_keys: int = 100000,
+        lock_stripes: int = 1024
+    ):
+        self.groups = max(1, -(-max_keys // GROUP_SLOTS))
+        self.lock_stripes = lock_stripes
+        self.path = os.path.join(directory, name)
+        self.size = HEADER.size + self.groups * GROUP.size
+        # A plain mapped file rather than multiprocessing.shared_memory: its resource
+        # tracker would unlink the segment when the first worker exits
+        try:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+            os.ftruncate(self.fd, self.size)
+            self.owner = True
+        except FileExistsError:
+            self.fd = os.open(self.path, os.O_RDWR)
+            self.owner = False
+            self.wait_for_size()
+        self.mmap = mmap.mmap(self.fd, self.size)
+        self.buf = memoryview(self.mmap)
+        if self.owner:
+            HEADER.pack_into(self.buf, 0, MAGIC, self.groups)
+        else:
+            self.check_layout()
+        self.stats = {"evicted_idle": 0, "evicted_active": 0}
+
+    def wait_for_size(self) -> None:
+        """Wait for the creating worker to size the segment, then check it matches"""
+        size = os.fstat(self.fd).st_size
+        for _ in range(100):
+            if size:
+                break
+            time.sleep(0.01)
+            size = os.fstat(self.fd).st_size
+        if size != self.size:
+            os.close(self.fd)
+            raise ValueError(f"Shared memory segment {self.path} has a different layout; remove it or change its name")
+
+    def check_layout(self) -> None:
+        """Make sure an existing segment was created with the same table size"""
+        magic, groups = HEADER.unpack_from(self.buf, 0)
+        # Another worker may have created the segment but not yet written its header
+        for _ in range(100):
+            if magic != bytes(len(MAGIC)):
+                break
+            time.sleep(0.01)
+            magic, groups = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or groups != self.groups:
+            self.close()
+            raise ValueError(f"Shared memory segment {self.path} has a different layout; remove it or change its name")
+
+    def group_offset(self, fingerprint: int) -> int:
+        return HEADER.size + (fingerprint % self.groups) * GROUP.size
+
+    def consume_locked(self, offset: int, fingerprint: int, capacity: int, refill_rate: float, cost: int) -> RateLimitDecision:
+        """GCRA update of one key (caller holds the group's stripe lock)"""
+        now = time.time()
+        group = GROUP.unpack_from(self.buf, offset)
+        slot = None
+        free = None
+        # Replacement candidate: the slot whose bucket refilled first
+        oldest = 0
+        for i in range(GROUP_SLOTS):
+            slot_fingerprint = group[2 * i]
+            if slot_fingerprint == fingerprint:
+                slot = i
+                break
+            if slot_fingerprint == 0:
+                if free is None:
+                    free = i
+            elif group[2 * i + 1] < group[2 * oldest + 1]:
+                oldest = i
+        tat = 0.0
+        if slot is not None:
+            tat = group[2 * slot + 1]
+        elif free is not None:
+            slot = free
+        else:
+            slot = oldest
+            if group[2 * slot + 1] <= now:
+                self.stats["evicted_idle"] += 1
+            else:
+                self.stats["evicted_active"] += 1
+
+        interval = 1.0 / refill_rate
+        burst = capacity * interval
+        tat = max(tat, now)
+        new_tat = tat + cost * interval
+        if new_tat - now > burst + EPSILON:
+            retry_after = new_tat - now - burst
+            remaining = max(0.0, (burst - (tat - now)) / interval)
+            return RateLimitDecision(False, capacity, remaining, retry_after, retry_after)
+        SLOT.pack_into(self.buf, offset + slot * SLOT.size, fingerprint, new_tat)
+        remaining = int((burst - (new_tat - now)) / interval + EPSILON)
+        return RateLimitDecision(True, capacity, remaining, new_tat - now)
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> RateLimitDecision:
+        """Consume cost tokens for key and report the outcome"""
+        fingerprint = key_fingerprint(key)
+        offset = self.group_offset(fingerprint)
+        stripe = (fingerprint % self.groups) % self.lock_stripes
+        # fcntl locks exclude other processes; within a process the event loop runs
+        # this section without interleaving
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+        try:
+            return self.consume_locked(offset, fingerprint, capacity, refill_rate, cost)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+    def close(self, unlink: bool = False) -> None:
+        """Detach from the segment (and remove it when unlink is set)"""
+        self.buf.release()
+        self.mmap.close()
+        os.close(self.fd)
+        if unlink:
+            os.unlink(self.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Table size and this worker's evictions"""
+        return {
+            "backend": "shared_memory",
+            "max_keys": self.groups * GROUP_SLOTS,
+            "segment_bytes": self.size,
+            **self.stats
+        }
+
+
+def create_shared_memory_backend() -> Optional[SharedMemoryRateLimitBackend]:
+    """Build the shared-memory backend from Config (None, i.e. in-process, if unavailable)"""
+    try:
+        return SharedMemoryRateLimitBackend(
+            name=Config.RATE_LIMIT.SHM_NAME,
+            directory=Config.RATE_LIMIT.SHM_DIR,
+            max_keys=Config.RATE_LIMIT.MAX_KEYS
+        )
+    except (OSError, ValueError) as e:
+        logger.warning(f"Shared-memory rate limiting unavailable, using in-process rate limiting: {e}")
+        return None
@@ -0,0 +1,185 @@
+"""
+Traffic Analytics for Censudx API Gateway
+Fixed-memory sketches of the heaviest clients and routes and distinct clients per time window
+"""
+
+import hashlib
+import math
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from gateway.config import Config
+
+MASK64 = (1 << 64) - 1
+
+
+def key_hash(key: str) -> Tuple[int, int]:
+    """Two independent 64-bit hashes of a key (stable across workers, unlike hash())"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class CountMinSketch:
+    """
+    Count-min sketch: depth rows of width counters
+    Estimates never undercount; overcount is bounded by total / width with high probability
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("Q", bytes(8 * width)) for _ in range(depth)]
+
+    def add(self, h1: int, h2: int, count: int = 1) -> int:
+        """Add count for a hashed key and return its new estimate"""
+        estimate = MASK64
+        width = self.width
+        for i, row in enumerate(self.rows):
+            # Double hashing derives one column per row from two hashes
+            column = (h1 + i * h2) % width
+            value = row[column] + count
+            row[column] = value
+            if value < estimate:
+                estimate = value
+        return estimate
+
+
+class HeavyHitters:
+    """
+    Top-k keys by count-min estimate
+    Only the k tracked keys are stored; a new key displaces the smallest one once its
+    estimate is higher
+    """
+
+    def __init__(self, k: int = 20, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[str, int] = {}
+        # Lower bound of the smallest tracked estimate, so most keys skip the min() scan
+        self.floor = 0
+
+    def add(self, key: str, h1: int, h2: int) -> None:
+        estimate = self.sketch.add(h1, h2)
+        top = self.top
+        if key in top or len(top) < self.k:
+            top[key] = estimate
+            return
+        if estimate <= self.floor:
+            return
+        victim = min(top, key=top.get)
+        if top[victim] >= estimate:
+            self.floor = top[victim]
+            return
+        del top[victim]
+        top[key] = estimate
+
+    def most_common(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.top.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class HyperLogLog:
+    """Distinct count estimate in 2^precision one-byte registers (~1.6% error at precision 12)"""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, h: int) -> None:
+        rest_bits = 64 - self.precision
+        index = h >> rest_bits
+        rest = h & ((1 << rest_bits) - 1)
+        # Position of the leftmost 1 bit in the remaining bits
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TrafficWindow:
+    """Sketches of one time window"""
+
+    def __init__(self, started: float, top_k: int):
+        self.started = started
+        self.requests = 0
+        self.rejected = 0
+        self.clients = HeavyHitters(top_k)
+        self.routes = HeavyHitters(top_k)
+        self.distinct_clients = HyperLogLog()
+
+    def summary(self, n: int, duration: float) -> Dict[str, Any]:
+        return {
+            "duration_seconds": round(duration, 1),
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "distinct_clients": self.distinct_clients.count(),
+            "top_clients": [{"client": key, "requests": count} for key, count in self.clients.most_common(n)],
+            "top_routes": [{"route": key, "requests": count} for key, count in self.routes.most_common(n)]
+        }
+
+
+class TrafficAnalytics:
+    """
+    Tumbling windows of traffic sketches fed from the request pipeline
+    The current and previous windows are kept; memory does not grow with distinct clients
+    """
+
+    def __init__(self, window: float = 60.0, top_k: int = 20):
+        self.window = window
+        self.top_k = top_k
+        self.current = TrafficWindow(time.monotonic(), top_k)
+        self.previous: Optional[TrafficWindow] = None
+
+    def rotate(self, now: float) -> None:
+        """Start a new window if the current one has ended"""
+        if now - self.current.started >= self.window:
+            # A window with no traffic in between leaves nothing worth keeping
+            self.previous = self.current if now - self.current.started < 2 * self.window else None
+            self.current = TrafficWindow(now, self.top_k)
+
+    def record(self, client: str, method: str, path: str, rejected: bool = False) -> None:
+        """Count one request of client on method and path"""
+        self.rotate(time.monotonic())
+        window = self.current
+        window.requests += 1
+        if rejected:
+            window.rejected += 1
+        h1, h2 = key_hash(client)
+        window.clients.add(client, h1, h2)
+        window.distinct_clients.add(h1)
+        route = method + " " + path
+        h1, h2 = key_hash(route)
+        window.routes.add(route, h1, h2)
+
+    def snapshot(self, n: int = 10) -> Dict[str, Any]:
+        """Top n clients and routes and distinct clients of the current and previous window"""
+        now = time.monotonic()
+        self.rotate(now)
+        previous = self.previous
+        return {
+            "window_seconds": self.window,
+            "current": self.current.summary(n, now - self.current.started),
+            "previous": previous.summary(n, self.window) if previous is not None else None
+        }
+
+
+# Process-wide analytics instance
+_traffic_analytics: Optional[TrafficAnalytics] = None
+
+
+def get_traffic_analytics() -> TrafficAnalytics:
+    """Get or create the process-wide traffic analytics"""
+    global _traffic_analytics
+    if _traffic_analytics is None:
+        _traffic_analytics = TrafficAnalytics(Config.GATEWAY.TRAFFIC_WINDOW, Config.GATEWAY.TRAFFIC_TOP_K)
+    return _traffic_analytics
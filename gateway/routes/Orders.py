@@ -1,11 +1,12 @@
 import grpc
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
 from google.protobuf.json_format import MessageToDict
 from pb2 import order_pb2, order_pb2_grpc
 from fastapi.security import HTTPAuthorizationCredentials
 from fastapi import Depends
 from gateway.auth.authorize import authorize
+from gateway.upstream.calls import call_grpc
 
 # --------------------------- #
 #        MODELOS Pydantic     #
@@ -39,50 +40,51 @@ class CancelOrderPayload(BaseModel):
 # -------------------------------------- #
 #   Router principal que consume gRPC    #
 # -------------------------------------- #
-def create_orders_router(service_url: str) -> APIRouter:
+def create_orders_router(service_name: str = "orders") -> APIRouter:
 
     router = APIRouter()
-    
-    # Se obtiene solo el host y puerto removiendo http/https
-    grpc_target_url = service_url.replace("http://", "").replace("https://", "")
+
+    # Llamada gRPC sobre el canal compartido: el timeout sale del registro de servicios
+    # (acotado por el presupuesto del cliente) y se cancela si el cliente se desconecta
+    async def call(http_request: Request, method: str, request):
+        return await call_grpc(http_request, service_name, order_pb2_grpc.OrderServiceStub, method, request)
 
     # -----------------------------------------------------------
     # POST /orders → Crear una orden consumiendo el microservicio gRPC
     # -----------------------------------------------------------
     @router.post("/orders")
-    def create_order(order: CreateOrderPayload):
+    async def create_order(order: CreateOrderPayload, http_request: Request):
         """
         Crea una nueva orden enviando una solicitud gRPC al servicio OrderService.
         Convierte los ítems recibidos vía HTTP en objetos gRPC y envía la solicitud
         CreateOrderRequest. Devuelve la respuesta transformada a diccionario.
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
-
-                # Construcción de los items gRPC
-                grpc_items = []
-                for i in order.items:
-                    item = order_pb2.OrderItemRequest(
-                        product_id=i.productId,
-                        product_name=i.productName,
-                        quantity=i.quantity,
-                        unit_price=i.unitPrice
-                    )
-                    grpc_items.append(item)
-                
-                # Construcción de la solicitud gRPC
-                request = order_pb2.CreateOrderRequest(
-                    user_id=order.userId,
-                    user_name=order.userName,
-                    address=order.address,
-                    UserEmail=order.userEmail,
-                    items=grpc_items
+            # Construcción de los items gRPC
+            grpc_items = []
+            for i in order.items:
+                item = order_pb2.OrderItemRequest(
+                    product_id=i.productId,
+                    product_name=i.productName,
+                    quantity=i.quantity,
+                    unit_price=i.unitPrice
                 )
-
-                response = stub.CreateOrder(request, timeout=5) 
-                return MessageToDict(response)
+                grpc_items.append(item)
+
+            # Construcción de la solicitud gRPC
+            request = order_pb2.CreateOrderRequest(
+                user_id=order.userId,
+                user_name=order.userName,
+                address=order.address,
+                UserEmail=order.userEmail,
+                items=grpc_items
+            )
+
+            response = await call(http_request, "CreateOrder", request)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             # Error si el microservicio gRPC está caído o no responde
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
@@ -94,20 +96,20 @@ def create_orders_router(service_url: str) -> APIRouter:
     # GET /orders/{identifier} → Obtener el estado de una orden por ID
     # -------------------------------------------------------------------
     @router.get("/orders/{identifier}")
-    def get_order_status(identifier: str):
+    async def get_order_status(identifier: str, http_request: Request):
         """
         Consulta el estado de una orden mediante el método gRPC GetOrderStatus.
         El parámetro puede ser ID o número de orden según el servicio gRPC.
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
-                request = order_pb2.GetOrderStatusRequest(identifier=identifier)
+            request = order_pb2.GetOrderStatusRequest(identifier=identifier)
                 
-                response = stub.GetOrderStatus(request, timeout=5)
+            response = await call(http_request, "GetOrderStatus", request)
                 
-                return MessageToDict(response)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
         except Exception as e:
@@ -117,25 +119,24 @@ def create_orders_router(service_url: str) -> APIRouter:
     # PUT /orders/{identifier}/status → Cambiar estado de una orden (Admin)
     # --------------------------------------------------------------------------
     @router.put("/orders/{identifier}/status")
-    def change_order_state(identifier: str, data: ChangeOrderStatePayload, token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))):
+    async def change_order_state(identifier: str, data: ChangeOrderStatePayload, http_request: Request, token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))):
         """
         Cambia el estado de una orden (por ejemplo: 'Shipped', 'Delivered').
         También permite adjuntar el número de seguimiento si aplica.
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
+            request = order_pb2.ChangeOrderStateRequest(
+                identifier=identifier,
+                order_status=data.orderStatus,
+                tracking_number=data.trackingNumber,
+            )
                 
-                request = order_pb2.ChangeOrderStateRequest(
-                    identifier=identifier,
-                    order_status=data.orderStatus,
-                    tracking_number=data.trackingNumber,
-                )
-                
-                response = stub.ChangeOrderState(request, timeout=5)
+            response = await call(http_request, "ChangeOrderState", request)
 
-                return MessageToDict(response)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
         except Exception as e:
@@ -146,23 +147,22 @@ def create_orders_router(service_url: str) -> APIRouter:
     # PATCH /orders/{identifier} → Cancelar una orden
     # -------------------------------------------------------
     @router.patch("/orders/{identifier}")
-    def cancel_order(identifier: str, data: CancelOrderPayload):
+    async def cancel_order(identifier: str, data: CancelOrderPayload, http_request: Request):
         """
         Cancela una orden indicando una razón. Envía CancelOrderRequest al servicio.
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
+            request = order_pb2.CancelOrderRequest(
+                identifier=identifier,
+                reason=data.reason
+            )
                 
-                request = order_pb2.CancelOrderRequest(
-                    identifier=identifier,
-                    reason=data.reason
-                )
+            response = await call(http_request, "CancelOrder", request)
                 
-                response = stub.CancelOrder(request, timeout=5)
-                
-                return MessageToDict(response)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
         except Exception as e:
@@ -173,8 +173,9 @@ def create_orders_router(service_url: str) -> APIRouter:
     # GET /orders/user/{userId} → Obtener órdenes de un usuario con filtros
     # -------------------------------------------------------------------------
     @router.get("/orders/user/{userId}")
-    def get_user_orders(
+    async def get_user_orders(
         userId: str, 
+        http_request: Request,
         orderIdentifier: str | None = Query(None),
         initialDate: str | None = Query(None),
         finishDate: str | None = Query(None)
@@ -186,20 +187,19 @@ def create_orders_router(service_url: str) -> APIRouter:
         Llama al método gRPC GetUserOrders.
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
-                
-                request = order_pb2.GetUserOrdersRequest(
-                    user_id=userId,
-                    order_identifier=orderIdentifier,
-                    initial_date=initialDate,
-                    finish_date=finishDate
-                )
+            request = order_pb2.GetUserOrdersRequest(
+                user_id=userId,
+                order_identifier=orderIdentifier,
+                initial_date=initialDate,
+                finish_date=finishDate
+            )
                 
-                response = stub.GetUserOrders(request, timeout=5)
+            response = await call(http_request, "GetUserOrders", request)
                 
-                return MessageToDict(response)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
         except Exception as e:
@@ -210,7 +210,8 @@ def create_orders_router(service_url: str) -> APIRouter:
     # GET /orders → Consultar órdenes para admins con filtros
     # -------------------------------------------------------------------------
     @router.get("/orders")
-    def get_admin_orders(
+    async def get_admin_orders(
+        http_request: Request,
         userIdentifier: str | None = Query(None),
         orderIdentifier: str | None = Query(None),
         initialDate: str | None = Query(None),
@@ -225,20 +226,19 @@ def create_orders_router(service_url: str) -> APIRouter:
         - Rango de fechas
         """
         try:
-            with grpc.insecure_channel(grpc_target_url) as channel:
-                stub = order_pb2_grpc.OrderServiceStub(channel)
-                
-                request = order_pb2.GetAdminOrdersRequest(
-                    user_identifier=userIdentifier,
-                    order_identifier=orderIdentifier,
-                    initial_date=initialDate,
-                    finish_date=finishDate
-                )
+            request = order_pb2.GetAdminOrdersRequest(
+                user_identifier=userIdentifier,
+                order_identifier=orderIdentifier,
+                initial_date=initialDate,
+                finish_date=finishDate
+            )
                 
-                response = stub.GetAdminOrders(request, timeout=5)
+            response = await call(http_request, "GetAdminOrders", request)
                 
-                return MessageToDict(response)
+            return MessageToDict(response)
         
+        except HTTPException:
+            raise
         except grpc.RpcError as e:
             raise HTTPException(status_code=503, detail=f"Service error ({e.code()}): {e.details()}")
         except Exception as e:
@@ -1,11 +1,17 @@
 """
 Auth Router for API Gateway. It uses the Auth microservice to handle authentication-related operations.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+import grpc
 import httpx
+import pb2.user_pb2
+import pb2.user_pb2_grpc
 from models import requests
 from fastapi import Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from gateway.auth.revocation import revoke_token
+from gateway.auth.token_cache import get_token_cache
+from gateway.upstream.calls import call_grpc, call_http
 """
 Creates an authentication router for the API Gateway, given a service URL.
 """
@@ -13,73 +19,83 @@ def create_auth_router(service_url: str) -> APIRouter:
     router = APIRouter()
     auth_service_url = service_url
     """
-    Login function that validates user credentials with the client service and retrieves an auth token from the auth service.
+    Login function that validates user credentials with the client service (gRPC) and retrieves an auth token from the auth service.
     """
-    async def login(request: requests.LoginRequest):
-        # Creates an HTTP client to communicate with the auth service
-        async with httpx.AsyncClient() as client:
-            # Validate credentials with client service
-            authDTO = await client.post(f"http://localhost:8000/api/clients/validate-credentials", json={"username": request.username, "password": request.password})
-            # Check if the response is valid
-            authDTO.raise_for_status()
-            # If no valid authDTO is returned, raise an HTTPException
-            if not authDTO:
-                raise HTTPException(status_code=401, detail="Invalid credentials")
-            # Retrieve user info from authDTO
-            authDTO = authDTO.json()["user"]
-            # Request an auth token from the auth service
-            response = await client.post(f"{auth_service_url}/api/auth", json={"id": authDTO["id"], "roles": list(authDTO["roles"])})
-            # Ensure the response is successful
-            response.raise_for_status()
-            # Return the JSON response containing the auth token
-            return response.json()    
+    async def login(http_request: Request, request: requests.LoginRequest):
+        # Verify credentials directly on the shared async channel to the clients service
+        try:
+            authDTO = await call_grpc(
+                http_request,
+                "users",
+                pb2.user_pb2_grpc.UserServiceStub,
+                "VerifyCredentials",
+                pb2.user_pb2.VerifyCredentialsRequest(
+                    username=request.username,
+                    password=request.password
+                )
+            )
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+                raise HTTPException(status_code=400, detail={"message": "Credenciales inválidas"})
+            raise HTTPException(status_code=503, detail={"message": "Servicio de clientes no disponible", "details": e.details()})
+        # If no valid authDTO is returned, raise an HTTPException
+        if not authDTO or not authDTO.id:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        # Request an auth token from the auth service on the shared pooled client
+        response = await call_http(
+            http_request, "auth", "POST", f"{auth_service_url}/api/auth",
+            json={"id": authDTO.id, "roles": list(authDTO.roles)}
+        )
+        # Ensure the response is successful
+        response.raise_for_status()
+        # Return the JSON response containing the auth token
+        return response.json()    
     """
     Validate token function that checks the validity of an auth token with the auth service.
     """
-    async def validate_token(token):
-        # Creates an HTTP client to communicate with the auth service
-        async with httpx.AsyncClient() as client:  
-            # Set the authorization header with the provided token     
-            headers = {"Authorization": f"Bearer {token}"}
-            # Send a GET request to validate the token
-            try:
-                response = await client.get(f"{auth_service_url}/api/auth", headers=headers)
-                # Ensure the response is successful
-                response.raise_for_status()
-                # Return the JSON response containing token validation result
-                return response.json()
-            except httpx.HTTPError as e:
-                # Invalid token or expired
-                raise HTTPException(status_code=401, detail="Unauthorized") from e
+    async def validate_token(http_request: Request, token):
+        # Set the authorization header with the provided token     
+        headers = {"Authorization": f"Bearer {token}"}
+        # Send a GET request to validate the token
+        try:
+            response = await call_http(http_request, "auth", "GET", f"{auth_service_url}/api/auth", headers=headers)
+            # Ensure the response is successful
+            response.raise_for_status()
+            # Return the JSON response containing token validation result
+            return response.json()
+        except httpx.HTTPError as e:
+            # Invalid token or expired
+            raise HTTPException(status_code=401, detail="Unauthorized") from e
     """
     Logout function that invalidates an auth token with the auth service.
     """
-    async def logout(token):
-        # Creates an HTTP client to communicate with the auth service
-        async with httpx.AsyncClient() as client:       
-            # Set the authorization header with the provided token
-            headers = {"Authorization": f"Bearer {token}"}
-            try:
-                # Send a POST request to logout and invalidate the token
-                response = await client.post(f"{auth_service_url}/api/auth/logout", headers=headers)
-                # Ensure the response is successful
-                response.raise_for_status()
-                # Return the JSON response confirming logout
-                return response.json()
-            except httpx.HTTPError as e:
-                # Invalid token or expired
-                raise HTTPException(status_code=401, detail="Unauthorized") from e
+    async def logout(http_request: Request, token):
+        # Set the authorization header with the provided token
+        headers = {"Authorization": f"Bearer {token}"}
+        try:
+            # Send a POST request to logout and invalidate the token
+            response = await call_http(http_request, "auth", "POST", f"{auth_service_url}/api/auth/logout", headers=headers)
+            # Ensure the response is successful
+            response.raise_for_status()
+            # Return the JSON response confirming logout
+            return response.json()
+        except httpx.HTTPError as e:
+            # Invalid token or expired
+            raise HTTPException(status_code=401, detail="Unauthorized") from e
     """
     Login router endpoint that handles user login requests.
     """
     @router.post("/login")
-    async def auth_login(request: requests.LoginRequest):
+    async def auth_login(request: requests.LoginRequest, http_request: Request):
         # Call the login function and handle exceptions
         try:
             # Call the login function
-            AUTH_TOKEN_JSON = await login(request)
+            AUTH_TOKEN_JSON = await login(http_request, request)
             # Return the auth token JSON response
             return AUTH_TOKEN_JSON
+        # Errors already mapped to an HTTP response
+        except HTTPException:
+            raise
         # Handle HTTP status errors from the auth service
         except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
@@ -90,27 +106,32 @@ def create_auth_router(service_url: str) -> APIRouter:
     Token validation router endpoint that checks the validity of an auth token.
     """
     @router.get("/validate-token")
-    async def auth_validate_token(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    async def auth_validate_token(http_request: Request, credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
         # Extract the token from the credentials
         token = credentials.credentials
         # Call the validate_token function
-        result = await validate_token(token)
+        result = await validate_token(http_request, token)
         # Return the validation result
         return result
     """
     Logout router endpoint that invalidates an auth token.
     """
     @router.post("/logout")
-    async def auth_logout(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    async def auth_logout(http_request: Request, credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
         # Extract the token from the credentials
         token = credentials.credentials
         # Validate the token before logging out
-        token_response = await validate_token(token)
+        token_response = await validate_token(http_request, token)
         # If the token is invalid, raise an Unauthorized exception
         if token_response is None:
             raise HTTPException(status_code=401, detail="Unauthorized")
         # Call the logout function
-        result = await logout(token)
+        result = await logout(http_request, token)
+        # Revoke the token on every replica and drop it from the validation cache
+        revoke_token(token)
+        cache = get_token_cache()
+        if cache is not None:
+            await cache.invalidate(token)
         # Return the logout result
         return result
     # Return the configured router
@@ -7,151 +7,129 @@ import pb2.user_pb2
 import pb2.user_pb2_grpc
 from fastapi.security import HTTPAuthorizationCredentials
 from gateway.auth.authorize import authorize
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import Optional
 from fastapi import Query
 from models import requests
 from models.user import User as user
 from services.user_stub.rabbitmq import RabbitMQ
+from gateway.upstream.calls import call_grpc
 
 """
 Create the clients router with gRPC calls to the user service.
 """
-def create_clients_router(service_url: str) -> APIRouter:
+def create_clients_router(service_name: str = "users") -> APIRouter:
     # Initialize the APIRouter
     router = APIRouter()
     # Initialize RabbitMQ instance
     RabbitMQInstance = RabbitMQ()
-    # Set the user service URL
-    user_service_url = service_url 
     """
     Create a new client using gRPC with CreateUserRequest.
     """
-    def create(user: 'requests.CreateUserRequest'):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request
-            request = pb2.user_pb2.CreateUserRequest(
-                names=user.names,
-                lastnames=user.lastnames,
-                email=user.email,
-                username=user.username,
-                birthdate=user.birthdate,
-                address=user.address,
-                phonenumber=user.phonenumber,
-                password=user.password,
-            )
-            # Make the call
-            response = stub.Create(request)
-            # Return the response
-            return response
+    async def create(http_request: Request, user: 'requests.CreateUserRequest'):
+        # Create the request
+        request = pb2.user_pb2.CreateUserRequest(
+            names=user.names,
+            lastnames=user.lastnames,
+            email=user.email,
+            username=user.username,
+            birthdate=user.birthdate,
+            address=user.address,
+            phonenumber=user.phonenumber,
+            password=user.password,
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "Create", request)
+        # Return the response
+        return response
     """
     Get all clients with optional filters using gRPC.
     """
-    def getall(emailfilter, namefilter, statusfilter, usernamefilter):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request (the filters can be None)
-            request = pb2.user_pb2.GetAllRequest(
-                namefilter=namefilter,
-                emailfilter=emailfilter,
-                statusfilter=statusfilter,
-                usernamefilter=usernamefilter
-            )
-            # Make the call
-            response = stub.GetAll(request)
-            # Return the response
-            return response
+    async def getall(http_request: Request, emailfilter, namefilter, statusfilter, usernamefilter):
+        # Create the request (the filters can be None)
+        request = pb2.user_pb2.GetAllRequest(
+            namefilter=namefilter,
+            emailfilter=emailfilter,
+            statusfilter=statusfilter,
+            usernamefilter=usernamefilter
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "GetAll", request)
+        # Return the response
+        return response
     """
     Get a client by ID using gRPC.
     """
-    def getById(id: str):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request
-            request = pb2.user_pb2.GetUserByIdRequest(
-                id=id
-            )
-            # Make the call
-            response = stub.GetById(request)
-            # Return the response
-            return response
+    async def getById(http_request: Request, id: str):
+        # Create the request
+        request = pb2.user_pb2.GetUserByIdRequest(
+            id=id
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "GetById", request)
+        # Return the response
+        return response
     """
     Update a client using gRPC with UpdateUserRequest.
     """
-    def update(id, user: 'requests.UpdateUserRequest'):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request
-            request = pb2.user_pb2.UpdateUserRequest(
-                id=id,
-                names=user.names,
-                lastnames=user.lastnames,
-                email=user.email,
-                username=user.username,
-                birthdate=user.birthdate,
-                address=user.address,
-                phonenumber=user.phonenumber,
-                password=user.password,
-            )
-            # Make the call
-            response = stub.Update(request)
-            return response
+    async def update(http_request: Request, id, user: 'requests.UpdateUserRequest'):
+        # Create the request
+        request = pb2.user_pb2.UpdateUserRequest(
+            id=id,
+            names=user.names,
+            lastnames=user.lastnames,
+            email=user.email,
+            username=user.username,
+            birthdate=user.birthdate,
+            address=user.address,
+            phonenumber=user.phonenumber,
+            password=user.password,
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "Update", request)
+        return response
     """
     Delete a client by ID using gRPC. (Soft delete)
     """
-    def delete(id: str):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request
-            request = pb2.user_pb2.DeleteUserRequest(
-                id=id
-            )
-            # Make the call
-            response = stub.Delete(request)
-            # Return the response
-            return response
+    async def delete(http_request: Request, id: str):
+        # Create the request
+        request = pb2.user_pb2.DeleteUserRequest(
+            id=id
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "Delete", request)
+        # Return the response
+        return response
     """
     Validate client credentials using gRPC using VerifyCredentialsRequest.
     """
-    def validate_credentials(user: 'requests.LoginRequest'):
-        # Establish a gRPC channel
-        with grpc.insecure_channel(user_service_url) as channel:
-            # Create a stub (client)
-            stub = pb2.user_pb2_grpc.UserServiceStub(channel)
-            # Create the request by username and password
-            request = pb2.user_pb2.VerifyCredentialsRequest(
-                username=user.username,
-                password=user.password
-            )
-            # Make the call
-            response = stub.VerifyCredentials(request)
-            # Return the response
-            return response
+    async def validate_credentials(http_request: Request, user: 'requests.LoginRequest'):
+        # Create the request by username and password
+        request = pb2.user_pb2.VerifyCredentialsRequest(
+            username=user.username,
+            password=user.password
+        )
+        # Make the call
+        response = await call_grpc(http_request, service_name, pb2.user_pb2_grpc.UserServiceStub, "VerifyCredentials", request)
+        # Return the response
+        return response
     """
     Create clients route.
     """
     @router.post("/clients")
-    def create_client_endpoint(user: 'requests.CreateUserRequest'):
+    async def create_client_endpoint(user: 'requests.CreateUserRequest', http_request: Request):
         # Try to create the client and handle gRPC errors
         try:
-            response = create(user)
+            response = await create(http_request, user)
         # Handle gRPC exceptions
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.ALREADY_EXISTS:
                 raise HTTPException(status_code=409, detail={"message": "El cliente ya existe", "details": e.details()})
             elif e.code() == grpc.StatusCode.INVALID_ARGUMENT:
                 raise HTTPException(status_code=400, detail={"message": "Error de formato", "details": e.details()})
+        # Let deadline and disconnect errors through
+        except HTTPException:
+            raise
         # Handle other exceptions
         except Exception as e:
             raise HTTPException(status_code=500, detail={"message": "Error interno del servidor", "details": str(e)})
@@ -165,14 +143,15 @@ def create_clients_router(service_url: str) -> APIRouter:
     Get all clients with optional filters endpoint.
     """
     @router.get("/clients")
-    def get_all_clients_endpoint(
+    async def get_all_clients_endpoint(
+        http_request: Request,
         emailfilter: Optional[str] = Query(None),
         namefilter: Optional[str] = Query(None),
         statusfilter: Optional[str] = Query(None),
         usernamefilter: Optional[str] = Query(None)
     ):
         # Get all clients
-        response = getall(emailfilter, namefilter, statusfilter, usernamefilter)
+        response = await getall(http_request, emailfilter, namefilter, statusfilter, usernamefilter)
         # Handle no clients found
         if not response:
             raise HTTPException(status_code=404, detail="No clients found")
@@ -195,10 +174,10 @@ def create_clients_router(service_url: str) -> APIRouter:
     Get client by ID endpoint.
     """
     @router.get("/clients/{id}")
-    def get_client_by_id_endpoint(id: str):
+    async def get_client_by_id_endpoint(id: str, http_request: Request):
         # Try to update the client and handle gRPC errors
         try:
-            response = getById(id).User
+            response = (await getById(http_request, id)).User
             # Handle client not found
             if not response or response.id == "":
                 raise HTTPException(status_code=404, detail="Cliente no encontrado")
@@ -223,16 +202,19 @@ def create_clients_router(service_url: str) -> APIRouter:
     Update client endpoint.
     """
     @router.patch("/clients/{id}")
-    def update_client_endpoint(id: str, user: 'requests.UpdateUserRequest'):
+    async def update_client_endpoint(id: str, user: 'requests.UpdateUserRequest', http_request: Request):
         # Try to update the client and handle gRPC errors
         try:
-            response = update(id, user)
+            response = await update(http_request, id, user)
         # Handle gRPC exceptions
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
                 raise HTTPException(status_code=404, detail={"message": "Cliente no encontrado", "details": e.details()})
             elif e.code() == grpc.StatusCode.INVALID_ARGUMENT:
                 raise HTTPException(status_code=400, detail={"message": "Error de formato", "details": e.details()})
+        # Let deadline and disconnect errors through
+        except HTTPException:
+            raise
         # Handle other exceptions
         except Exception as e:
             raise HTTPException(status_code=500, detail={"message": "Error interno del servidor", "details": str(e)})
@@ -248,14 +230,17 @@ def create_clients_router(service_url: str) -> APIRouter:
     Authorization: Admin role required.
     """
     @router.delete("/clients/{id}")
-    async def delete_client_endpoint(id: str, token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))):
+    async def delete_client_endpoint(id: str, http_request: Request, token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))):
         # Try to delete the client and handle gRPC errors
         try:
-            response = delete(id)
+            response = await delete(http_request, id)
         # Handle gRPC exceptions
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND or e.code() == grpc.StatusCode.UNKNOWN:
                 raise HTTPException(status_code=404, detail={"message": "Cliente no encontrado", "details": e.details()})
+        # Let deadline and disconnect errors through
+        except HTTPException:
+            raise
         # Handle other exceptions
         except Exception as e:
             raise HTTPException(status_code=500, detail={"message": "Error interno del servidor", "details": str(e)})
@@ -270,10 +255,10 @@ def create_clients_router(service_url: str) -> APIRouter:
     Validate credentials endpoint.
     """
     @router.post("/clients/validate-credentials")
-    def validate_credentials_endpoint(user: 'requests.LoginRequest'):
+    async def validate_credentials_endpoint(user: 'requests.LoginRequest', http_request: Request):
         # Try to validate credentials and handle gRPC errors
         try:
-            response = validate_credentials(user)
+            response = await validate_credentials(http_request, user)
             # Returns id and roles if credentials are valid
             return {
                 "message": "Credenciales válidas",
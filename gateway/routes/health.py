@@ -2,9 +2,20 @@
 Health Check Routes for Censudx API Gateway
 """
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.security import HTTPAuthorizationCredentials
 from datetime import datetime
 
+from gateway.auth.authorize import authorize
+from gateway.auth.jwt_verifier import get_local_verifier
+from gateway.auth.revocation import get_revocation_list
+from gateway.auth.token_cache import get_token_cache
+from gateway.middleware.admission import get_admission_controller
+from gateway.middleware.concurrency import get_concurrency_limiter
+from gateway.middleware.ip_filter import get_ip_blocklist
+from gateway.middleware.rate_limiting import get_rate_limiter
+from gateway.middleware.traffic_analytics import get_traffic_analytics
+
 health_router = APIRouter()
 
 @health_router.get("/health-detailed", summary="Detailed Health Check")
@@ -19,4 +30,43 @@ async def detailed_health():
             "database": "healthy",
             "messaging": "healthy"
         }
-    }
\ No newline at end of file
+    }
+
+@health_router.get("/metrics", summary="Gateway Metrics")
+async def gateway_metrics():
+    """Runtime counters of gateway components"""
+    cache = get_token_cache()
+    verifier = get_local_verifier()
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "token_cache": cache.get_stats() if cache is not None else {"enabled": False},
+        "local_jwt_verification": verifier.stats if verifier is not None else {"enabled": False},
+        "token_revocations": get_revocation_list().get_stats(),
+        "rate_limiting": get_rate_limiter().get_stats(),
+        "concurrency_limiting": get_concurrency_limiter().get_stats(),
+        "admission_control": get_admission_controller().get_stats(),
+        "ip_blocklist": get_ip_blocklist().get_stats()
+    }
+
+@health_router.post("/ip-blocklist/reload", summary="Reload IP Blocklist")
+async def reload_ip_blocklist(token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))):
+    """
+    Re-read the blocklisted networks without restarting the gateway
+
+    Reloads this worker at once and reports any error in the file; the other workers
+    pick up file changes on their own within IP_BLOCKLIST_CHECK_INTERVAL seconds.
+    """
+    blocklist = get_ip_blocklist()
+    try:
+        blocklist.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Blocklist not reloaded: {e}")
+    return blocklist.get_stats()
+
+@health_router.get("/analytics/traffic", summary="Traffic Analytics")
+async def traffic_analytics(
+    top: int = Query(10, ge=1, le=100),
+    token: HTTPAuthorizationCredentials = Depends(authorize("Admin"))
+):
+    """Heaviest clients and routes and distinct clients of this worker's recent windows"""
+    return get_traffic_analytics().snapshot(top)
@@ -5,11 +5,13 @@ Handles routing requests to the Inventory Service via gRPC
 
 import logging
 import grpc
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer
 from typing import Optional, List
 from pydantic import BaseModel
 
+from gateway.upstream.calls import call_grpc
+
 # Import gRPC stubs (compiled in Docker build at /app/pb2)
 try:
     import pb2.inventory_pb2 as inventory_pb2
@@ -56,36 +58,15 @@ class InventoryUpdateRequest(BaseModel):
     location: Optional[str] = None
     reserved_quantity: Optional[int] = None
 
-# gRPC Channel Cache
-_grpc_channel = None
-
-def get_grpc_channel():
-    """Get or create gRPC channel to inventory service (insecure for local communication)"""
-    global _grpc_channel
-    if _grpc_channel is None:
-        logger.info("Creating gRPC channel to inventory:50051 (insecure)")
-        try:
-            _grpc_channel = grpc.aio.insecure_channel("inventory:50051")
-            logger.info("gRPC channel created successfully")
-        except Exception as e:
-            logger.error(f"Failed to create gRPC channel: {e}")
-            raise
-    return _grpc_channel
-
-async def get_inventory_stub():
-    """Get inventory service stub"""
+async def call_inventory(http_request: Request, method: str, message):
+    """Call an inventory RPC with the request deadline, cancelled on client disconnect"""
     if inventory_pb2_grpc is None:
         logger.error("inventory_pb2_grpc module not available")
         raise HTTPException(
             status_code=503,
             detail="gRPC stubs not available - proto compilation failed"
         )
-    try:
-        channel = get_grpc_channel()
-        return inventory_pb2_grpc.InventoryServiceStub(channel)
-    except Exception as e:
-        logger.error(f"Failed to get inventory stub: {e}")
-        raise HTTPException(status_code=503, detail="Failed to connect to inventory service")
+    return await call_grpc(http_request, "inventory", inventory_pb2_grpc.InventoryServiceStub, method, message)
 
 # ============================================================================
 # Inventory gRPC Endpoints
@@ -93,15 +74,15 @@ async def get_inventory_stub():
 
 @inventory_router.get("/", response_model=List[InventoryItemResponse], summary="List Inventory Items")
 async def list_inventory(
+    http_request: Request,
     limit: int = 10,
     offset: int = 0,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """List all inventory items via gRPC"""
     try:
-        stub = await get_inventory_stub()
         request = inventory_pb2.ListInventoryRequest(limit=limit, offset=offset)
-        response = await stub.ListInventory(request)
+        response = await call_inventory(http_request, "ListInventory", request)
         
         items = [
             InventoryItemResponse(
@@ -115,6 +96,8 @@ async def list_inventory(
         ]
         logger.info(f"gRPC: Listed {len(items)} inventory items")
         return items
+    except HTTPException:
+        raise
     except grpc.RpcError as e:
         logger.error(f"gRPC error listing inventory: {e.code()} {e.details()}")
         raise HTTPException(status_code=503, detail=f"Inventory service error: {e.details()}")
@@ -125,14 +108,14 @@ async def list_inventory(
 @inventory_router.get("/{item_id}", response_model=InventoryItemResponse, summary="Get Inventory Item")
 async def get_inventory_item(
     item_id: int,
+    http_request: Request,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """Get specific inventory item by ID via gRPC"""
     try:
         # Fetch all items and filter by ID (since proto doesn't have GetById by ID)
-        stub = await get_inventory_stub()
         request = inventory_pb2.ListInventoryRequest(limit=1000, offset=0)
-        response = await stub.ListInventory(request)
+        response = await call_inventory(http_request, "ListInventory", request)
         
         for item in response.items:
             if item.id == item_id:
@@ -157,18 +140,18 @@ async def get_inventory_item(
 @inventory_router.post("/", response_model=InventoryItemResponse, summary="Create Inventory Item")
 async def create_inventory(
     item: InventoryCreateRequest,
+    http_request: Request,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """Create new inventory item via gRPC"""
     try:
-        stub = await get_inventory_stub()
         request = inventory_pb2.CreateInventoryRequest(
             product_id=item.product_id,
             quantity=item.quantity,
             location=item.location,
             reserved_quantity=item.reserved_quantity
         )
-        response = await stub.CreateInventory(request)
+        response = await call_inventory(http_request, "CreateInventory", request)
         
         logger.info(f"gRPC: Created inventory item for {item.product_id}")
         return InventoryItemResponse(
@@ -178,6 +161,8 @@ async def create_inventory(
             location=response.location,
             reserved_quantity=response.reserved_quantity
         )
+    except HTTPException:
+        raise
     except grpc.RpcError as e:
         logger.error(f"gRPC error creating inventory: {e.code()} {e.details()}")
         raise HTTPException(status_code=503, detail=f"Inventory service error: {e.details()}")
@@ -189,12 +174,11 @@ async def create_inventory(
 async def update_inventory(
     item_id: int,
     item: InventoryUpdateRequest,
+    http_request: Request,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """Update inventory item via gRPC"""
     try:
-        stub = await get_inventory_stub()
-        
         # Build update request with provided fields
         request = inventory_pb2.UpdateInventoryRequest(id=item_id)
         if item.quantity is not None:
@@ -204,7 +188,7 @@ async def update_inventory(
         if item.reserved_quantity is not None:
             request.reserved_quantity = item.reserved_quantity
         
-        response = await stub.UpdateInventory(request)
+        response = await call_inventory(http_request, "UpdateInventory", request)
         
         logger.info(f"gRPC: Updated inventory item {item_id}")
         return InventoryItemResponse(
@@ -228,13 +212,13 @@ async def update_inventory(
 @inventory_router.delete("/{item_id}", summary="Delete Inventory Item")
 async def delete_inventory(
     item_id: int,
+    http_request: Request,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """Delete inventory item via gRPC"""
     try:
-        stub = await get_inventory_stub()
         request = inventory_pb2.DeleteInventoryRequest(id=item_id)
-        await stub.DeleteInventory(request)
+        await call_inventory(http_request, "DeleteInventory", request)
         
         logger.info(f"gRPC: Deleted inventory item {item_id}")
         return {"message": f"Item {item_id} deleted successfully"}
@@ -252,16 +236,16 @@ async def delete_inventory(
 @inventory_router.post("/check-stock", response_model=StockCheckResponse, summary="Check Stock Availability")
 async def check_stock_grpc(
     request: StockCheckRequest,
+    http_request: Request,
     credentials: Optional[HTTPBearer] = Depends(security)
 ):
     """Check stock availability via gRPC"""
     try:
-        stub = await get_inventory_stub()
         grpc_request = inventory_pb2.StockCheckRequest(
             product_id=request.product_id,
             requested_quantity=request.requested_quantity
         )
-        grpc_response = await stub.CheckStock(grpc_request)
+        grpc_response = await call_inventory(http_request, "CheckStock", grpc_request)
         
         logger.info(f"gRPC: Checked stock for {request.product_id}")
         return StockCheckResponse(
@@ -270,6 +254,8 @@ async def check_stock_grpc(
             available_stock=grpc_response.available_stock,
             requested_quantity=grpc_response.requested_quantity
         )
+    except HTTPException:
+        raise
     except grpc.RpcError as e:
         logger.error(f"gRPC error checking stock: {e.code()} {e.details()}")
         raise HTTPException(status_code=503, detail=f"Inventory service error: {e.details()}")
@@ -0,0 +1,178 @@
+"""
+Adaptive Upstream Concurrency for Censudx API Gateway
+Per-upstream in-flight limits that follow measured latency (gradient algorithm)
+"""
+
+import asyncio
+import collections
+import logging
+import math
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from gateway.config import SERVICE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Limit settings used when a registry entry does not declare its own
+DEFAULT_INITIAL_LIMIT = 20
+DEFAULT_MIN_LIMIT = 2
+DEFAULT_MAX_LIMIT = 200
+DEFAULT_QUEUE_TIMEOUT = 0.1
+# Latency growth tolerated before the limit shrinks (1.5 = 50% over the baseline)
+DEFAULT_TOLERANCE = 1.5
+
+# EWMA weights of the recent (about 10 calls) and baseline (about 600 calls) latency
+SHORT_ALPHA = 2 / 11
+LONG_ALPHA = 2 / 601
+# Weight of each new limit estimate, to keep the limit from jumping on one sample
+SMOOTHING = 0.2
+# Multiplicative decrease when a call fails (timeout, UNAVAILABLE, 5xx)
+BACKOFF_RATIO = 0.9
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    In-flight limit of one upstream
+    The limit tracks limit * (tolerance * baseline latency / recent latency) plus a
+    sqrt(limit) allowance: it grows while latency stays at the baseline and shrinks as
+    soon as queueing shows up in the upstream. Calls over the limit wait briefly for a
+    slot, then are shed with 503
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = DEFAULT_INITIAL_LIMIT,
+        min_limit: int = DEFAULT_MIN_LIMIT,
+        max_limit: int = DEFAULT_MAX_LIMIT,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        tolerance: float = DEFAULT_TOLERANCE
+    ):
+        self.name = name
+        self.limit = float(max(min_limit, min(max_limit, initial_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.short_rtt: Optional[float] = None
+        self.long_rtt: Optional[float] = None
+        self.waiters: Deque[asyncio.Future] = collections.deque()
+        self.stats = {"queued": 0, "shed": 0}
+
+    async def acquire(self) -> None:
+        """
+        Take an in-flight slot, waiting up to queue_timeout for one
+
+        Raises:
+            HTTPException: 503 with Retry-After when no slot frees up in time
+        """
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return
+        if self.queue_timeout <= 0 or len(self.waiters) >= int(self.limit):
+            self.shed()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the caller went away
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        if not waiter.done():
+            self.waiters.remove(waiter)
+            waiter.cancel()
+            self.shed()
+
+    def shed(self) -> None:
+        self.stats["shed"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service {self.name} is at its concurrency limit",
+            headers={"Retry-After": "1"}
+        )
+
+    def release(self, latency: Optional[float] = None, failed: bool = False) -> None:
+        """Give back a slot, updating the limit from the call's latency (None if cancelled)"""
+        self.in_flight -= 1
+        if failed:
+            self.limit = max(self.min_limit, self.limit * BACKOFF_RATIO)
+        elif latency is not None:
+            self.update(latency)
+        # Hand freed slots straight to queued calls (in_flight carries over)
+        while self.waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.waiters.popleft().set_result(None)
+
+    def update(self, latency: float) -> None:
+        """Gradient step of the limit from one successful call"""
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = latency
+            return
+        self.short_rtt += (latency - self.short_rtt) * SHORT_ALPHA
+        self.long_rtt += (latency - self.long_rtt) * LONG_ALPHA
+        # The baseline was set during a slow spell: let it come back down quickly
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        estimate = self.limit * gradient + math.sqrt(self.limit)
+        if estimate > self.limit and self.in_flight * 2 < self.limit:
+            # Not using half the limit: no evidence the upstream can take more
+            return
+        limit = self.limit * (1 - SMOOTHING) + estimate * SMOOTHING
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue": len(self.waiters),
+            "recent_latency": round(self.short_rtt, 4) if self.short_rtt is not None else None,
+            "baseline_latency": round(self.long_rtt, 4) if self.long_rtt is not None else None,
+            **self.stats
+        }
+
+
+class AdaptiveConcurrencyRegistry:
+    """Adaptive limits keyed by service name, configured from the service registry"""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.limits: Dict[str, AdaptiveConcurrencyLimit] = {}
+
+    def get(self, service_name: str) -> AdaptiveConcurrencyLimit:
+        """Get the limit of a service (created on first use)"""
+        limit = self.limits.get(service_name)
+        if limit is None:
+            config = self.registry.get(service_name, {})
+            limit = AdaptiveConcurrencyLimit(
+                service_name,
+                initial_limit=config.get("concurrency_initial", DEFAULT_INITIAL_LIMIT),
+                min_limit=config.get("concurrency_min", DEFAULT_MIN_LIMIT),
+                # Never more calls in flight than the upstream's connection pool allows
+                max_limit=config.get("concurrency_max", config.get("max_connections", DEFAULT_MAX_LIMIT)),
+                queue_timeout=config.get("concurrency_queue_timeout", DEFAULT_QUEUE_TIMEOUT),
+                tolerance=config.get("concurrency_tolerance", DEFAULT_TOLERANCE)
+            )
+            self.limits[service_name] = limit
+        return limit
+
+
+# Process-wide adaptive limit registry instance
+_adaptive_limits: Optional[AdaptiveConcurrencyRegistry] = None
+
+
+def get_adaptive_limits() -> AdaptiveConcurrencyRegistry:
+    """Get or create the process-wide adaptive concurrency registry"""
+    global _adaptive_limits
+    if _adaptive_limits is None:
+        _adaptive_limits = AdaptiveConcurrencyRegistry(SERVICE_REGISTRY)
+    return _adaptive_limits
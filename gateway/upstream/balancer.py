@@ -0,0 +1,214 @@
+"""
+Client-Side Load Balancing for Censudx API Gateway
+Spreads calls over the weighted endpoints of each upstream with power-of-two-choices
+"""
+
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from gateway.config import SERVICE_REGISTRY
+from gateway.upstream.circuit_breaker import is_upstream_failure
+from gateway.upstream.grpc_channels import get_grpc_target
+from gateway.upstream.http_pool import get_http_base_url
+
+logger = logging.getLogger(__name__)
+
+# Ejection settings used when a registry entry does not declare its own
+DEFAULT_EJECT_AFTER = 5
+DEFAULT_EJECT_DURATION = 30.0
+
+# Weight of each new latency in an endpoint's moving average
+LATENCY_ALPHA = 0.3
+
+
+class Endpoint:
+    """One replica of an upstream and the load and health the gateway sees on it"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.url = config["url"]
+        self.grpc_target = get_grpc_target(config)
+        self.http_base_url = get_http_base_url(config)
+        self.weight = max(float(config.get("weight", 1)), 0.001)
+        self.in_flight = 0
+        # Moving average of successful call latencies (None until the first one)
+        self.latency: Optional[float] = None
+        # Verdict of the last health probe
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.stats = {"calls": 0, "failures": 0, "ejections": 0}
+
+    def is_available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+    def cost(self, default_latency: float) -> float:
+        """Expected wait on this endpoint: latency times queue depth, per unit of weight"""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.in_flight + 1) / self.weight
+
+    def get_stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "healthy": self.healthy,
+            "ejected": now < self.ejected_until,
+            **self.stats
+        }
+
+
+class LoadBalancer:
+    """
+    Weighted power-of-two-choices over the endpoints of one upstream
+    Two endpoints are drawn in proportion to their weight and the one with the lower
+    latency * (in-flight + 1) cost gets the call. Endpoints failing their health probe,
+    or failing eject_after calls in a row (ejected for eject_duration), are skipped;
+    if every endpoint is out, all of them are used rather than none
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoints: List[Dict[str, Any]],
+        base_url: Optional[str] = None,
+        eject_after: int = DEFAULT_EJECT_AFTER,
+        eject_duration: float = DEFAULT_EJECT_DURATION
+    ):
+        self.name = name
+        self.endpoints = [Endpoint(config) for config in endpoints]
+        # HTTP base URL callers address the service by (its registry url)
+        self.base_url = base_url
+        self.eject_after = eject_after
+        self.eject_duration = eject_duration
+
+    def pick(self) -> Endpoint:
+        """Endpoint for the next call"""
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.is_available(now)]
+        if not candidates:
+            candidates = self.endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        weights = [endpoint.weight for endpoint in candidates]
+        first, second = random.choices(candidates, weights, k=2)
+        if first is second:
+            # Draw the second choice from the other endpoints
+            others = [endpoint for endpoint in candidates if endpoint is not first]
+            second = random.choices(others, [endpoint.weight for endpoint in others])[0]
+        known = [endpoint.latency for endpoint in candidates if endpoint.latency is not None]
+        # Endpoints without samples are costed at the average, not as free
+        default_latency = sum(known) / len(known) if known else 1.0
+        return min(first, second, key=lambda endpoint: endpoint.cost(default_latency))
+
+    def endpoint_url(self, url: str, endpoint: Endpoint) -> str:
+        """Point a URL aimed at the service's base URL (or relative to it) at one endpoint"""
+        if endpoint.http_base_url is None:
+            return url
+        if self.base_url and url.startswith(self.base_url):
+            return endpoint.http_base_url + url[len(self.base_url):]
+        if not url.startswith(("http://", "https://")):
+            return endpoint.http_base_url + url
+        return url
+
+    def record(self, endpoint: Endpoint, latency: Optional[float], failed: bool) -> None:
+        """Outcome of a call sent to endpoint (latency None if it was cancelled)"""
+        endpoint.in_flight -= 1
+        if latency is None:
+            return
+        endpoint.stats["calls"] += 1
+        if not failed:
+            endpoint.consecutive_failures = 0
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += (latency - endpoint.latency) * LATENCY_ALPHA
+            return
+        endpoint.stats["failures"] += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.eject_after and len(self.endpoints) > 1:
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = time.monotonic() + self.eject_duration
+            endpoint.stats["ejections"] += 1
+            logger.warning(f"Ejected {endpoint.url} from {self.name} for {self.eject_duration}s after repeated failures")
+
+    async def call(
+        self,
+        run: Callable[[Endpoint], Awaitable[Any]],
+        is_failed_result: Optional[Callable[[Any], bool]] = None,
+        is_budget_timeout: Optional[Callable[[BaseException], bool]] = None
+    ) -> Any:
+        """
+        Run one call on the endpoint picked for it, recording its outcome
+
+        Timeouts set by the caller's own budget (is_budget_timeout) are recorded
+        without an outcome, so short client deadlines cannot eject healthy endpoints.
+        """
+        endpoint = self.pick()
+        endpoint.in_flight += 1
+        started = time.monotonic()
+        try:
+            result = await run(endpoint)
+        except Exception as e:
+            if is_budget_timeout is not None and is_budget_timeout(e):
+                self.record(endpoint, None, False)
+            else:
+                self.record(endpoint, time.monotonic() - started, is_upstream_failure(e))
+            raise
+        except BaseException:
+            self.record(endpoint, None, False)
+            raise
+        failed = is_failed_result is not None and is_failed_result(result)
+        self.record(endpoint, time.monotonic() - started, failed)
+        return result
+
+    def set_health(self, url: str, healthy: bool) -> None:
+        """Apply the health probe verdict of an endpoint"""
+        for endpoint in self.endpoints:
+            if endpoint.url == url:
+                if endpoint.healthy != healthy:
+                    logger.warning(f"Endpoint {url} of {self.name} is now {'healthy' if healthy else 'unhealthy'}")
+                endpoint.healthy = healthy
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Load and health of every endpoint"""
+        now = time.monotonic()
+        return {endpoint.url: endpoint.get_stats(now) for endpoint in self.endpoints}
+
+
+class LoadBalancerRegistry:
+    """Load balancers keyed by service name, configured from the service registry"""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.balancers: Dict[str, LoadBalancer] = {}
+
+    def get(self, service_name: str) -> Optional[LoadBalancer]:
+        """Get the balancer of a service (None unless it declares endpoints)"""
+        balancer = self.balancers.get(service_name)
+        if balancer is None:
+            config = self.registry.get(service_name, {})
+            if not config.get("endpoints"):
+                return None
+            balancer = LoadBalancer(
+                service_name,
+                config["endpoints"],
+                base_url=get_http_base_url(config),
+                eject_after=config.get("eject_after", DEFAULT_EJECT_AFTER),
+                eject_duration=config.get("eject_duration", DEFAULT_EJECT_DURATION)
+            )
+            self.balancers[service_name] = balancer
+        return balancer
+
+
+# Process-wide load balancer registry instance
+_load_balancers: Optional[LoadBalancerRegistry] = None
+
+
+def get_load_balancers() -> LoadBalancerRegistry:
+    """Get or create the process-wide load balancer registry"""
+    global _load_balancers
+    if _load_balancers is None:
+        _load_balancers = LoadBalancerRegistry(SERVICE_REGISTRY)
+    return _load_balancers
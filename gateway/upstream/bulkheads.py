@@ -0,0 +1,105 @@
+"""
+Upstream Bulkheads for Censudx API Gateway
+Fixed compartment of in-progress requests per upstream, so one hung service cannot hold the whole gateway
+"""
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from gateway.config import SERVICE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Requests that may wait on one upstream at once when a registry entry does not declare
+# its own; well below RATE_LIMIT_MAX_IN_FLIGHT so a hung upstream leaves room for the rest
+DEFAULT_MAX_CONCURRENT = 100
+
+
+class Bulkhead:
+    """
+    In-progress requests of one upstream, counting the whole call (retries, hedges,
+    backoff sleeps and concurrency queueing included)
+    A full compartment rejects at once with 503 instead of queueing
+    """
+
+    def __init__(self, name: str, max_concurrent: int = DEFAULT_MAX_CONCURRENT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        # When the compartment last filled up (None while it has room)
+        self.full_since: Optional[float] = None
+        self.saturated_time = 0.0
+        self.stats = {"admitted": 0, "rejected": 0, "peak_in_flight": 0}
+
+    def acquire(self) -> None:
+        """
+        Take a place in the compartment
+
+        Raises:
+            HTTPException: 503 with Retry-After when the compartment is full
+        """
+        if self.in_flight >= self.max_concurrent:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Service {self.name} has too many requests in progress",
+                headers={"Retry-After": "1"}
+            )
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        if self.in_flight > self.stats["peak_in_flight"]:
+            self.stats["peak_in_flight"] = self.in_flight
+        if self.in_flight >= self.max_concurrent:
+            self.full_since = time.monotonic()
+            logger.warning(f"Bulkhead of {self.name} is full ({self.max_concurrent} requests in progress)")
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self.full_since is not None:
+            self.saturated_time += time.monotonic() - self.full_since
+            self.full_since = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Occupancy, counters and total time spent full"""
+        saturated_time = self.saturated_time
+        if self.full_since is not None:
+            saturated_time += time.monotonic() - self.full_since
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "saturation": round(self.in_flight / self.max_concurrent, 3) if self.max_concurrent else 1.0,
+            "saturated_seconds": round(saturated_time, 3),
+            **self.stats
+        }
+
+
+class BulkheadRegistry:
+    """Bulkheads keyed by service name, configured from the service registry"""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.bulkheads: Dict[str, Bulkhead] = {}
+
+    def get(self, service_name: str) -> Bulkhead:
+        """Get the bulkhead of a service (created on first use)"""
+        bulkhead = self.bulkheads.get(service_name)
+        if bulkhead is None:
+            config = self.registry.get(service_name, {})
+            bulkhead = Bulkhead(service_name, config.get("bulkhead_max_concurrent", DEFAULT_MAX_CONCURRENT))
+            self.bulkheads[service_name] = bulkhead
+        return bulkhead
+
+
+# Process-wide bulkhead registry instance
+_bulkheads: Optional[BulkheadRegistry] = None
+
+
+def get_bulkheads() -> BulkheadRegistry:
+    """Get or create the process-wide bulkhead registry"""
+    global _bulkheads
+    if _bulkheads is None:
+        _bulkheads = BulkheadRegistry(SERVICE_REGISTRY)
+    return _bulkheads
@@ -0,0 +1,221 @@
+"""
+Upstream Calls for Censudx API Gateway
+Single entry point for gateway -> upstream gRPC and HTTP calls
+"""
+
+import asyncio
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
+
+import grpc
+import httpx
+from fastapi import HTTPException, Request
+
+from gateway.upstream.adaptive_concurrency import get_adaptive_limits
+from gateway.upstream.balancer import get_load_balancers
+from gateway.upstream.bulkheads import get_bulkheads
+from gateway.upstream.circuit_breaker import get_circuit_breakers, is_upstream_failure
+from gateway.upstream.deadlines import get_timeout, run_with_cancellation
+from gateway.upstream.grpc_channels import get_channel_manager
+from gateway.upstream.hedging import call_hedged, get_hedging
+from gateway.upstream.http_pool import get_http_pool
+from gateway.upstream.retries import call_with_retries, get_retry_budgets
+from gateway.upstream.stale_cache import call_with_stale, get_stale_cache
+from gateway.upstream.timeouts import get_adaptive_timeouts
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Whether an upstream call failed by running out of time"""
+    if isinstance(error, grpc.RpcError):
+        return error.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    return isinstance(error, httpx.TimeoutException)
+
+
+async def run_upstream_call(
+    request: Optional[Request],
+    service_name: str,
+    make_call: Callable[[float, Callable[[BaseException], bool]], Awaitable[Any]],
+    is_failed_result: Optional[Callable[[Any], bool]] = None,
+    method_name: Optional[str] = None
+) -> Any:
+    """
+    Run one upstream call under the service's deadline, circuit breaker and
+    adaptive concurrency limit
+
+    Args:
+        request: Incoming HTTP request (None outside a request)
+        service_name: Registry key of the upstream
+        make_call: Starts the call with the given timeout (seconds) and the check of
+            whether an error is a timeout set by the client budget
+        is_failed_result: Whether a returned result still counts as an upstream failure
+        method_name: Operation whose observed latency sets the timeout (the
+            registry timeout is used when None)
+
+    Raises:
+        HTTPException: 503 while the service's circuit is open or its concurrency
+            limit stays full, 504/499 from the deadline
+    """
+    breaker = get_circuit_breakers().get(service_name)
+    trial = breaker.before_call()
+    limit = get_adaptive_limits().get(service_name)
+    try:
+        await limit.acquire()
+    except BaseException:
+        breaker.release(trial)
+        raise
+    timeouts = get_adaptive_timeouts()
+    learned = timeouts.get(service_name, method_name) if method_name is not None else None
+    # Timeout the call gets when the client budget does not cut it shorter
+    full_timeout = learned if learned is not None else get_timeout(None, service_name)
+    started = time.monotonic()
+
+    def is_budget_timeout(error: BaseException) -> bool:
+        # Cut off by the client's own budget: says nothing about the upstream
+        return timeout < full_timeout and is_timeout(error)
+
+    try:
+        # After any wait for a slot, so queueing counts against the request budget
+        timeout = get_timeout(request, service_name, learned)
+        result = await run_with_cancellation(request, make_call(timeout, is_budget_timeout))
+    except (HTTPException, asyncio.CancelledError):
+        # Budget spent or the client went away: says nothing about the upstream
+        breaker.release(trial)
+        limit.release()
+        raise
+    except Exception as e:
+        duration = time.monotonic() - started
+        if is_budget_timeout(e):
+            breaker.release(trial)
+            limit.release()
+            raise
+        failed = is_upstream_failure(e)
+        breaker.record(duration, failed, trial)
+        limit.release(duration, failed)
+        if learned is not None and is_timeout(e):
+            # Cut off by the learned timeout (not the client budget): at least this slow
+            timeouts.record(service_name, method_name, duration)
+        raise
+    duration = time.monotonic() - started
+    failed = is_failed_result is not None and is_failed_result(result)
+    breaker.record(duration, failed, trial)
+    limit.release(duration, failed)
+    if method_name is not None:
+        timeouts.record(service_name, method_name, duration)
+    return result
+
+
+async def call_grpc(
+    request: Optional[Request],
+    service_name: str,
+    stub_class: type,
+    method_name: str,
+    message: Any
+) -> Any:
+    """
+    Make a unary gRPC call on the shared channel of a service
+
+    The call gets a timeout learned from the RPC's recent latency (capped by the
+    request budget), is cancelled if the HTTP client disconnects and fails fast while the service's circuit is open or
+    its bulkhead is full.
+    RPCs listed in the service's idempotent_rpcs are retried on UNAVAILABLE
+    within its retry budget; those in hedged_rpcs are hedged once they run
+    past the RPC's observed p95. RPCs in stale_rpcs fall back to their last
+    good answer while the upstream is failing.
+
+    Args:
+        request: Incoming HTTP request (None outside a request)
+        service_name: Registry key of the upstream
+        stub_class: Generated stub class (e.g. UserServiceStub)
+        method_name: RPC name (e.g. 'GetById')
+        message: Request message
+    """
+    balancer = get_load_balancers().get(service_name)
+
+    def make_call(timeout: float, is_budget_timeout: Callable[[BaseException], bool]) -> Any:
+        # A fresh stub per attempt, so retries and hedges go out on the next pooled
+        # channel (and, for multi-endpoint services, to the endpoint picked for them)
+        if balancer is None:
+            stub = get_channel_manager().get_stub(service_name, stub_class)
+            return getattr(stub, method_name)(message, timeout=timeout)
+        return balancer.call(
+            lambda endpoint: getattr(
+                get_channel_manager().get_stub(service_name, stub_class, endpoint.grpc_target),
+                method_name
+            )(message, timeout=timeout),
+            is_budget_timeout=is_budget_timeout
+        )
+
+    def attempt() -> Awaitable[Any]:
+        return run_upstream_call(request, service_name, make_call, method_name=method_name)
+
+    call = attempt
+    hedging = get_hedging()
+    if hedging.is_hedged(service_name, method_name):
+        call = partial(call_hedged, service_name, method_name, attempt, hedging)
+
+    async def call_isolated() -> Any:
+        bulkhead = get_bulkheads().get(service_name)
+        bulkhead.acquire()
+        try:
+            retries = get_retry_budgets()
+            if not retries.is_idempotent(service_name, method_name):
+                return await call()
+            return await call_with_retries(request, service_name, call, retries)
+        finally:
+            bulkhead.release()
+
+    stale = get_stale_cache().get(service_name, method_name)
+    if stale is None:
+        return await call_isolated()
+    return await call_with_stale(request, service_name, message, call_isolated, stale)
+
+
+async def call_http(
+    request: Optional[Request],
+    service_name: str,
+    method: str,
+    url: str,
+    **kwargs: Any
+) -> httpx.Response:
+    """
+    Make an HTTP call on the pooled client of a service
+
+    For services with several endpoints, URLs aimed at the service's url (or
+    relative to it) are sent to the endpoint picked by its load balancer.
+
+    Args:
+        request: Incoming HTTP request (None outside a request)
+        service_name: Registry key of the upstream
+        method: HTTP method
+        url: Absolute URL or path relative to the service base URL
+        **kwargs: Passed to httpx (json, headers, ...)
+    """
+    client = get_http_pool().get(service_name)
+    balancer = get_load_balancers().get(service_name)
+
+    def is_failed_response(response: httpx.Response) -> bool:
+        # 5xx answers count against the breaker; the response is still returned
+        return response.status_code >= 500
+
+    def make_call(timeout: float, is_budget_timeout: Callable[[BaseException], bool]) -> Awaitable[httpx.Response]:
+        if balancer is None:
+            return client.request(method, url, timeout=timeout, **kwargs)
+        return balancer.call(
+            lambda endpoint: client.request(method, balancer.endpoint_url(url, endpoint), timeout=timeout, **kwargs),
+            is_failed_response,
+            is_budget_timeout
+        )
+
+    bulkhead = get_bulkheads().get(service_name)
+    bulkhead.acquire()
+    try:
+        return await run_upstream_call(
+            request,
+            service_name,
+            make_call,
+            is_failed_response,
+            f"{method.upper()} {httpx.URL(url).path}"
+        )
+    finally:
+        bulkhead.release()
@@ -0,0 +1,228 @@
+"""
+Circuit Breakers for Censudx API Gateway
+One breaker per upstream service; an unhealthy upstream is failed fast instead of waited on
+"""
+
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import grpc
+import httpx
+from fastapi import HTTPException
+
+from gateway.config import SERVICE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Breaker settings used when a registry entry does not declare its own
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_SLOW_CALL_RATE = 0.8
+DEFAULT_MIN_CALLS = 10
+DEFAULT_WINDOW = 10
+DEFAULT_OPEN_DURATION = 15.0
+DEFAULT_HALF_OPEN_CALLS = 3
+
+# gRPC codes that mean the upstream (not the request) is at fault
+GRPC_FAILURE_CODES = frozenset({
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.DATA_LOSS,
+})
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether an exception raised by an upstream call counts against its breaker"""
+    if isinstance(error, grpc.RpcError):
+        return error.code() in GRPC_FAILURE_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a rolling window of one-second buckets
+    Trips when the failure or slow-call rate crosses its threshold (after min_calls
+    calls in the window), fails fast for open_duration, then lets half_open_calls
+    trial calls through: all must succeed to close again
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = DEFAULT_FAILURE_RATE,
+        slow_call_rate: float = DEFAULT_SLOW_CALL_RATE,
+        slow_call_duration: float = 15.0,
+        min_calls: int = DEFAULT_MIN_CALLS,
+        window: int = DEFAULT_WINDOW,
+        open_duration: float = DEFAULT_OPEN_DURATION,
+        half_open_calls: int = DEFAULT_HALF_OPEN_CALLS
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.min_calls = min_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+        self.half_open_successes = 0
+        # Bucket: [second, calls, failures, slow calls]
+        self.buckets: List[List[int]] = [[-1, 0, 0, 0] for _ in range(window)]
+        self.stats = {"rejected": 0, "opened": 0}
+
+    def window_totals(self, now: float) -> List[int]:
+        """[calls, failures, slow calls] over the last window seconds"""
+        second = int(now)
+        totals = [0, 0, 0]
+        for bucket in self.buckets:
+            if second - bucket[0] < self.window:
+                totals[0] += bucket[1]
+                totals[1] += bucket[2]
+                totals[2] += bucket[3]
+        return totals
+
+    def before_call(self) -> bool:
+        """
+        Admit a call
+
+        Returns:
+            True if the call is a half-open trial
+
+        Raises:
+            HTTPException: 503 with Retry-After while the breaker is open
+        """
+        if self.state == CLOSED:
+            return False
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.open_duration:
+            self.state = HALF_OPEN
+            self.half_open_in_flight = 0
+            self.half_open_successes = 0
+            logger.info(f"Circuit for {self.name} half-open: sending trial calls")
+        if self.state == HALF_OPEN and self.half_open_in_flight < self.half_open_calls:
+            self.half_open_in_flight += 1
+            return True
+        self.stats["rejected"] += 1
+        retry_after = max(1, math.ceil(self.opened_at + self.open_duration - now))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service {self.name} is unavailable (circuit open)",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def record(self, duration: float, failed: bool, trial: bool) -> None:
+        """Record the outcome of an admitted call"""
+        slow = duration >= self.slow_call_duration
+        if trial:
+            if self.state != HALF_OPEN:
+                return
+            self.half_open_in_flight -= 1
+            if failed or slow:
+                self.trip(time.monotonic())
+                return
+            self.half_open_successes += 1
+            if self.half_open_successes >= self.half_open_calls:
+                self.close()
+            return
+        if self.state != CLOSED:
+            # Started before the breaker opened; the trial calls decide now
+            return
+
+        now = time.monotonic()
+        second = int(now)
+        bucket = self.buckets[second % self.window]
+        if bucket[0] != second:
+            bucket[:] = [second, 0, 0, 0]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+        if not (failed or slow):
+            return
+        calls, failures, slow_calls = self.window_totals(now)
+        if calls >= self.min_calls and (
+            failures >= calls * self.failure_rate or slow_calls >= calls * self.slow_call_rate
+        ):
+            self.trip(now)
+
+    def release(self, trial: bool) -> None:
+        """Give back a half-open permit of a call that ended without an outcome (cancelled)"""
+        if trial and self.state == HALF_OPEN:
+            self.half_open_in_flight -= 1
+
+    def trip(self, now: float) -> None:
+        if self.state != OPEN:
+            logger.warning(f"Circuit for {self.name} opened: failing fast for {self.open_duration}s")
+            self.stats["opened"] += 1
+        self.state = OPEN
+        self.opened_at = now
+
+    def close(self) -> None:
+        logger.info(f"Circuit for {self.name} closed")
+        self.state = CLOSED
+        for bucket in self.buckets:
+            bucket[:] = [-1, 0, 0, 0]
+
+    def get_state(self) -> Dict[str, Any]:
+        """Current state and window counts"""
+        now = time.monotonic()
+        calls, failures, slow_calls = self.window_totals(now)
+        state = {
+            "state": self.state,
+            "window_calls": calls,
+            "window_failures": failures,
+            "window_slow_calls": slow_calls,
+            **self.stats
+        }
+        if self.state == OPEN:
+            state["retry_after"] = round(max(0.0, self.opened_at + self.open_duration - now), 1)
+        return state
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers keyed by service name, configured from the service registry"""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, service_name: str) -> CircuitBreaker:
+        """Get the breaker of a service (created on first use)"""
+        breaker = self.breakers.get(service_name)
+        if breaker is None:
+            config = self.registry.get(service_name, {})
+            breaker = CircuitBreaker(
+                service_name,
+                failure_rate=config.get("breaker_failure_rate", DEFAULT_FAILURE_RATE),
+                slow_call_rate=config.get("breaker_slow_call_rate", DEFAULT_SLOW_CALL_RATE),
+                # Calls taking half the service timeout count as slow unless configured
+                slow_call_duration=config.get("breaker_slow_call_duration", config.get("timeout", 30) / 2),
+                min_calls=config.get("breaker_min_calls", DEFAULT_MIN_CALLS),
+                window=config.get("breaker_window", DEFAULT_WINDOW),
+                open_duration=config.get("breaker_open_duration", DEFAULT_OPEN_DURATION),
+                half_open_calls=config.get("breaker_half_open_calls", DEFAULT_HALF_OPEN_CALLS)
+            )
+            self.breakers[service_name] = breaker
+        return breaker
+
+
+# Process-wide breaker registry instance
+_circuit_breakers: Optional[CircuitBreakerRegistry] = None
+
+
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    """Get or create the process-wide circuit breaker registry"""
+    global _circuit_breakers
+    if _circuit_breakers is None:
+        _circuit_breakers = CircuitBreakerRegistry(SERVICE_REGISTRY)
+    return _circuit_breakers
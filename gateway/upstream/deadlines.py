@@ -0,0 +1,92 @@
+"""
+Request Deadlines for Censudx API Gateway
+Derives per-call timeouts from the service registry and the client's own budget,
+and cancels upstream work when the HTTP client goes away
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Optional
+
+from fastapi import HTTPException, Request
+
+from gateway.config import SERVICE_REGISTRY, Config
+
+# Used when a registry entry does not declare a timeout
+DEFAULT_TIMEOUT = 30.0
+
+
+def get_request_deadline(request: Optional[Request]) -> Optional[float]:
+    """
+    Monotonic deadline of the whole request, taken from the client timeout header
+
+    The header value (seconds) is read once and stored on request.state so every
+    upstream call of the request draws from the same budget.
+    """
+    if request is None:
+        return None
+    if hasattr(request.state, "deadline"):
+        return request.state.deadline
+    deadline = None
+    header = request.headers.get(Config.GATEWAY.DEADLINE_HEADER)
+    if header:
+        try:
+            budget = min(float(header), Config.GATEWAY.MAX_REQUEST_TIMEOUT)
+            if budget > 0:
+                deadline = time.monotonic() + budget
+        except ValueError:
+            pass
+    request.state.deadline = deadline
+    return deadline
+
+
+def get_timeout(request: Optional[Request], service_name: str, timeout: Optional[float] = None) -> float:
+    """
+    Timeout for one upstream call: the given timeout (the service's registry timeout
+    by default), capped by what is left of the request budget
+
+    Raises:
+        HTTPException: 504 if the request budget is already spent
+    """
+    if timeout is None:
+        timeout = float(SERVICE_REGISTRY.get(service_name, {}).get("timeout", DEFAULT_TIMEOUT))
+    deadline = get_request_deadline(request)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        timeout = min(timeout, remaining)
+    return timeout
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Return once the HTTP client has disconnected"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_with_cancellation(request: Optional[Request], awaitable: Awaitable[Any]) -> Any:
+    """
+    Await an upstream call, cancelling it if the HTTP client disconnects first
+
+    Raises:
+        HTTPException: 499 when the client went away (the response is never delivered)
+    """
+    if request is None:
+        return await awaitable
+    call = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({call, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        call.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if call.done():
+        return call.result()
+    # Client disconnected: stop the upstream work instead of finishing it for nobody
+    call.cancel()
+    raise HTTPException(status_code=499, detail="Client closed request")
@@ -0,0 +1,146 @@
+"""
+gRPC Channel Manager for Censudx API Gateway
+Keeps long-lived grpc.aio channels to upstream services built from the service registry
+"""
+
+import itertools
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import grpc
+
+from gateway.config import SERVICE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Channel settings used when a registry entry does not declare its own
+DEFAULT_KEEPALIVE_TIME_MS = 30000
+DEFAULT_KEEPALIVE_TIMEOUT_MS = 10000
+DEFAULT_MAX_MESSAGE_LENGTH = 4 * 1024 * 1024
+
+COMPRESSION = {
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def get_grpc_target(config: Dict[str, Any]) -> str:
+    """Return host:port of a registry entry (scheme removed)"""
+    return config["url"].replace("http://", "").replace("https://", "")
+
+
+def build_channel_options(config: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """Translate registry settings into gRPC channel arguments"""
+    max_message_length = config.get("max_message_length", DEFAULT_MAX_MESSAGE_LENGTH)
+    return [
+        ("grpc.keepalive_time_ms", config.get("keepalive_time_ms", DEFAULT_KEEPALIVE_TIME_MS)),
+        ("grpc.keepalive_timeout_ms", config.get("keepalive_timeout_ms", DEFAULT_KEEPALIVE_TIMEOUT_MS)),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.max_send_message_length", max_message_length),
+        ("grpc.max_receive_message_length", max_message_length),
+    ]
+
+
+class ChannelPool:
+    """
+    N channels to one upstream, handed out round-robin
+    Each channel gets its own subchannel pool so it opens a separate HTTP/2 connection
+    """
+
+    def __init__(self, target: str, size: int, options: List[Tuple[str, Any]], compression: Optional[grpc.Compression]):
+        self.target = target
+        self.channels: List[grpc.aio.Channel] = []
+        for _ in range(max(size, 1)):
+            channel_options = list(options)
+            if size > 1:
+                channel_options.append(("grpc.use_local_subchannel_pool", 1))
+            self.channels.append(
+                grpc.aio.insecure_channel(target, options=channel_options, compression=compression)
+            )
+        self._next = itertools.cycle(range(len(self.channels)))
+        # Generated stubs cached per (stub class, channel index)
+        self.stubs: Dict[Tuple[type, int], Any] = {}
+
+    def get(self) -> grpc.aio.Channel:
+        """Next channel in round-robin order"""
+        return self.channels[next(self._next)]
+
+    def get_stub(self, stub_class: type) -> Any:
+        """Stub of the given class on the next channel in round-robin order"""
+        index = next(self._next)
+        stub = self.stubs.get((stub_class, index))
+        if stub is None:
+            stub = stub_class(self.channels[index])
+            self.stubs[(stub_class, index)] = stub
+        return stub
+
+    async def close(self) -> None:
+        """Close every channel in the pool"""
+        for channel in self.channels:
+            await channel.close()
+
+
+class GrpcChannelManager:
+    """
+    Shared grpc.aio channels keyed by service name and endpoint
+    Per-service keepalive, max message size, compression and pool size come from the registry
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.pools: Dict[Tuple[str, str], ChannelPool] = {}
+
+    def get_pool(self, service_name: str, target: Optional[str] = None) -> ChannelPool:
+        """
+        Get the channel pool of a service endpoint (created on first use)
+
+        Args:
+            service_name: Registry key (e.g. 'users', 'orders', 'inventory')
+            target: host:port of one of the service's endpoints (its url by default)
+        """
+        config = self.registry[service_name]
+        if target is None:
+            target = get_grpc_target(config)
+        pool = self.pools.get((service_name, target))
+        if pool is None:
+            size = config.get("channel_pool_size", 1)
+            logger.info(f"Creating gRPC channel pool to {service_name} at {target} (size={size})")
+            pool = ChannelPool(
+                target,
+                size,
+                build_channel_options(config),
+                COMPRESSION.get(config.get("compression", ""))
+            )
+            self.pools[(service_name, target)] = pool
+        return pool
+
+    def get_channel(self, service_name: str, target: Optional[str] = None) -> grpc.aio.Channel:
+        """Get a shared channel for a service (endpoint)"""
+        return self.get_pool(service_name, target).get()
+
+    def get_stub(self, service_name: str, stub_class: type, target: Optional[str] = None) -> Any:
+        """Get a cached stub on a shared channel of a service (endpoint)"""
+        return self.get_pool(service_name, target).get_stub(stub_class)
+
+    async def close(self) -> None:
+        """Close every channel"""
+        for (service_name, _), pool in list(self.pools.items()):
+            try:
+                await pool.close()
+            except Exception as e:
+                logger.error(f"Error closing gRPC channels for {service_name}: {e}")
+        self.pools.clear()
+        logger.info("gRPC channels closed")
+
+
+# Process-wide channel manager instance
+_channel_manager: Optional[GrpcChannelManager] = None
+
+
+def get_channel_manager() -> GrpcChannelManager:
+    """Get or create the process-wide gRPC channel manager"""
+    global _channel_manager
+    if _channel_manager is None:
+        _channel_manager = GrpcChannelManager(SERVICE_REGISTRY)
+    return _channel_manager
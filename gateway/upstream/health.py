@@ -0,0 +1,219 @@
+"""
+Upstream Health Prober for Censudx API Gateway
+Probes every registered service concurrently in the background and caches the results
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import grpc
+
+from gateway.config import Config, SERVICE_REGISTRY
+from gateway.upstream.balancer import LoadBalancerRegistry, get_load_balancers
+from gateway.upstream.grpc_channels import GrpcChannelManager, get_channel_manager, get_grpc_target
+from gateway.upstream.http_pool import HTTPClientPool, get_http_base_url, get_http_pool
+
+logger = logging.getLogger(__name__)
+
+# grpc.health.v1.Health/Check; messages are encoded by hand so the gateway does not
+# need grpcio-health-checking. An empty HealthCheckRequest asks for the whole server.
+GRPC_HEALTH_METHOD = "/grpc.health.v1.Health/Check"
+GRPC_HEALTH_REQUEST = b""
+# HealthCheckResponse.status (field 1, varint)
+GRPC_SERVING_STATUS = {0: "UNKNOWN", 1: "SERVING", 2: "NOT_SERVING", 3: "SERVICE_UNKNOWN"}
+
+
+def parse_health_status(response: bytes) -> str:
+    """Serving status name of a serialized HealthCheckResponse"""
+    # Default enum values are not serialized, so an empty message means UNKNOWN
+    if len(response) >= 2 and response[0] == 0x08:
+        return GRPC_SERVING_STATUS.get(response[1], "UNKNOWN")
+    return "UNKNOWN"
+
+
+def get_health_check_type(config: Dict[str, Any]) -> str:
+    """'grpc' or 'http', from the registry entry ('health_check' overrides the guess)"""
+    if config.get("health_check"):
+        return config["health_check"]
+    if config.get("grpc") or get_http_base_url(config) is None:
+        return "grpc"
+    return "http"
+
+
+class HealthProber:
+    """
+    Background health checks of every registered service
+    All services are probed at once every interval; requests only read the cached results
+    """
+
+    def __init__(
+        self,
+        registry: Dict[str, Dict[str, Any]],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        required_services: Optional[List[str]] = None,
+        channel_manager: Optional[GrpcChannelManager] = None,
+        http_pool: Optional[HTTPClientPool] = None,
+        load_balancers: Optional[LoadBalancerRegistry] = None
+    ):
+        self.registry = registry
+        self.interval = interval
+        self.timeout = timeout
+        self.required_services = required_services or []
+        self.channel_manager = channel_manager
+        self.http_pool = http_pool
+        self.load_balancers = load_balancers
+        self.results: Dict[str, Dict[str, Any]] = {}
+        # Monotonic time of the last completed probe round (None before the first one)
+        self.last_round: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def probe_grpc(self, service_name: str, endpoint: Dict[str, Any]) -> Dict[str, Any]:
+        """Standard gRPC health check on the shared channel of a service endpoint"""
+        channel_manager = self.channel_manager or get_channel_manager()
+        channel = channel_manager.get_channel(service_name, get_grpc_target(endpoint))
+        check = channel.unary_unary(GRPC_HEALTH_METHOD)
+        try:
+            response = await check(GRPC_HEALTH_REQUEST, timeout=self.timeout)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                # The server answered but has no health service: reachable is the best we know
+                return {"status": "healthy", "check": "connectivity"}
+            return {"status": "unhealthy", "check": "grpc_health", "error": e.code().name}
+        serving = parse_health_status(response)
+        return {
+            "status": "healthy" if serving == "SERVING" else "unhealthy",
+            "check": "grpc_health",
+            "serving_status": serving
+        }
+
+    async def probe_http(self, service_name: str, endpoint: Dict[str, Any]) -> Dict[str, Any]:
+        """GET the health endpoint of a service endpoint on the service's shared client"""
+        http_pool = self.http_pool or get_http_pool()
+        health_endpoint = self.registry[service_name].get("health_endpoint", "/health")
+        health_url = f"{get_http_base_url(endpoint)}{health_endpoint}"
+        response = await http_pool.get(service_name).get(health_url, timeout=self.timeout)
+        return {
+            "status": "healthy" if 200 <= response.status_code < 400 else "unhealthy",
+            "check": "http",
+            "status_code": response.status_code
+        }
+
+    async def probe_endpoint(self, service_name: str, endpoint: Dict[str, Any]) -> Dict[str, Any]:
+        """Probe one endpoint (url and http_url) of a service; never raises"""
+        check_type = get_health_check_type(self.registry[service_name])
+        started = time.perf_counter()
+        try:
+            probe = self.probe_grpc if check_type == "grpc" else self.probe_http
+            # Bounds name resolution and connection setup too
+            result = await asyncio.wait_for(probe(service_name, endpoint), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": "unhealthy", "error": "Health check timed out"}
+        except Exception as e:
+            result = {"status": "unhealthy", "error": str(e) or type(e).__name__}
+        result.update({
+            "url": endpoint["url"],
+            "type": "gRPC" if check_type == "grpc" else "HTTP",
+            "response_time": round(time.perf_counter() - started, 4),
+            "last_check": datetime.utcnow().isoformat()
+        })
+        return result
+
+    async def probe(self, service_name: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Probe one service; never raises
+
+        Services with several endpoints have each one probed: the verdicts take
+        unhealthy endpoints out of load balancing, and the service is healthy while
+        any endpoint is.
+        """
+        endpoints = config.get("endpoints")
+        if not endpoints:
+            return await self.probe_endpoint(service_name, config)
+        results = await asyncio.gather(*(self.probe_endpoint(service_name, endpoint) for endpoint in endpoints))
+        balancer = (self.load_balancers or get_load_balancers()).get(service_name)
+        for endpoint, result in zip(endpoints, results):
+            balancer.set_health(endpoint["url"], result["status"] == "healthy")
+        healthy = sum(result["status"] == "healthy" for result in results)
+        return {
+            "status": "healthy" if healthy else "unhealthy",
+            "url": config["url"],
+            "healthy_endpoints": healthy,
+            "endpoints": {endpoint["url"]: result for endpoint, result in zip(endpoints, results)},
+            "last_check": datetime.utcnow().isoformat()
+        }
+
+    async def probe_all(self) -> Dict[str, Dict[str, Any]]:
+        """Probe every service concurrently and replace the cached results"""
+        names = list(self.registry)
+        results = await asyncio.gather(*(self.probe(name, self.registry[name]) for name in names))
+        for name, result in zip(names, results):
+            previous = self.results.get(name)
+            if previous is not None and previous["status"] != result["status"]:
+                logger.warning(f"Service {name} is now {result['status']}")
+        self.results = dict(zip(names, results))
+        self.last_round = time.monotonic()
+        return self.results
+
+    async def run(self) -> None:
+        """Probe forever, every interval"""
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Health probe round failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start the background probe loop (once)"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+            logger.info(f"Health prober started for {len(self.registry)} services (every {self.interval}s)")
+
+    async def stop(self) -> None:
+        """Stop the background probe loop"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def is_fresh(self) -> bool:
+        """Whether results are recent (no more than three missed rounds)"""
+        return self.last_round is not None and time.monotonic() - self.last_round <= 3 * self.interval + self.timeout
+
+    def readiness(self) -> Dict[str, Any]:
+        """Readiness from cached results: probed recently and required services healthy"""
+        unhealthy = [
+            name for name in self.required_services
+            if self.results.get(name, {}).get("status") != "healthy"
+        ]
+        return {
+            "ready": self.is_fresh() and not unhealthy,
+            "probed": self.last_round is not None,
+            "fresh": self.is_fresh(),
+            "unhealthy_required_services": unhealthy
+        }
+
+
+# Process-wide prober instance
+_health_prober: Optional[HealthProber] = None
+
+
+def get_health_prober() -> HealthProber:
+    """Get or create the process-wide health prober"""
+    global _health_prober
+    if _health_prober is None:
+        required = [name.strip() for name in Config.GATEWAY.HEALTH_REQUIRED_SERVICES.split(",") if name.strip()]
+        _health_prober = HealthProber(
+            SERVICE_REGISTRY,
+            interval=Config.GATEWAY.HEALTH_CHECK_INTERVAL,
+            timeout=Config.GATEWAY.HEALTH_CHECK_TIMEOUT,
+            required_services=required
+        )
+    return _health_prober
@@ -0,0 +1,145 @@
+"""
+Hedged Requests for Censudx API Gateway
+Sends a second copy of a slow idempotent read and keeps whichever answer comes first
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from gateway.config import SERVICE_REGISTRY
+from gateway.upstream.latency import LatencyWindow
+from gateway.upstream.retries import RetryBudget
+
+logger = logging.getLogger(__name__)
+
+# Hedging settings used when a registry entry does not declare its own
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_DELAY = 0.01
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_BUDGET_RATIO = 0.1
+DEFAULT_HEDGE_BUDGET_MAX = 10
+
+
+class HedgeRegistry:
+    """
+    Hedging state keyed by service (hedge budget) and RPC (latency window)
+    RPCs opt in through the service's hedged_rpcs registry entry
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+        self.budgets: Dict[str, RetryBudget] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def is_hedged(self, service_name: str, method_name: str) -> bool:
+        return method_name in self.registry.get(service_name, {}).get("hedged_rpcs", ())
+
+    def get_latency(self, service_name: str, method_name: str) -> LatencyWindow:
+        latency = self.latencies.get((service_name, method_name))
+        if latency is None:
+            latency = LatencyWindow()
+            self.latencies[(service_name, method_name)] = latency
+        return latency
+
+    def get_budget(self, service_name: str) -> RetryBudget:
+        """Token budget capping hedges to a fraction of the service's hedgeable calls"""
+        budget = self.budgets.get(service_name)
+        if budget is None:
+            config = self.registry.get(service_name, {})
+            budget = RetryBudget(
+                config.get("hedge_budget_ratio", DEFAULT_HEDGE_BUDGET_RATIO),
+                config.get("hedge_budget_max", DEFAULT_HEDGE_BUDGET_MAX)
+            )
+            self.budgets[service_name] = budget
+            self.stats[service_name] = {"calls": 0, "hedged": 0, "hedge_wins": 0, "capped": 0}
+        return budget
+
+    def get_delay(self, service_name: str, method_name: str) -> Optional[float]:
+        """How long to wait before hedging (None until enough latencies are known)"""
+        config = self.registry.get(service_name, {})
+        latency = self.get_latency(service_name, method_name)
+        if latency.count < config.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES):
+            return None
+        delay = latency.quantile(config.get("hedge_quantile", DEFAULT_HEDGE_QUANTILE))
+        return max(delay, config.get("hedge_min_delay", DEFAULT_HEDGE_MIN_DELAY))
+
+    def get_stats(self, service_name: str) -> Dict[str, Any]:
+        """Hedge counters, budget and current delay per hedged RPC of a service"""
+        budget = self.get_budget(service_name)
+        return {
+            **self.stats[service_name],
+            "tokens": round(budget.tokens, 2),
+            "delays": {
+                method_name: self.get_delay(service_name, method_name)
+                for method_name in self.registry.get(service_name, {}).get("hedged_rpcs", ())
+            }
+        }
+
+
+async def call_hedged(
+    service_name: str,
+    method_name: str,
+    attempt: Callable[[], Awaitable[Any]],
+    hedging: HedgeRegistry
+) -> Any:
+    """
+    Run attempt(); if it is still running after the RPC's hedge delay, start a
+    second attempt (another pooled channel) and return the first success, cancelling
+    the other
+
+    Raises:
+        The primary attempt's error if every attempt fails
+    """
+    latency = hedging.get_latency(service_name, method_name)
+    budget = hedging.get_budget(service_name)
+    stats = hedging.stats[service_name]
+    stats["calls"] += 1
+    budget.deposit()
+    delay = hedging.get_delay(service_name, method_name)
+
+    started = time.monotonic()
+    primary = asyncio.ensure_future(attempt())
+    tasks = [primary]
+    try:
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+        if not primary.done():
+            if delay is not None and budget.withdraw():
+                stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(attempt()))
+            elif delay is not None:
+                stats["capped"] += 1
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if primary in done and primary.exception() is None:
+                latency.add(time.monotonic() - started)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        stats["hedge_wins"] += 1
+                    return task.result()
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                if task is primary:
+                    # Lost to the hedge: at least this slow, which keeps the delay honest
+                    latency.add(time.monotonic() - started)
+                task.cancel()
+
+
+# Process-wide hedge registry instance
+_hedging: Optional[HedgeRegistry] = None
+
+
+def get_hedging() -> HedgeRegistry:
+    """Get or create the process-wide hedge registry"""
+    global _hedging
+    if _hedging is None:
+        _hedging = HedgeRegistry(SERVICE_REGISTRY)
+    return _hedging
@@ -0,0 +1,103 @@
+"""
+HTTP Client Pool for Censudx API Gateway
+Keeps one long-lived httpx.AsyncClient per upstream service so connections are reused
+"""
+
+import logging
+from typing import Dict, Any, Optional
+
+import httpx
+
+from gateway.config import SERVICE_REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Limits used when a registry entry does not declare its own
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+
+def get_http_base_url(config: Dict[str, Any]) -> Optional[str]:
+    """Return the HTTP base URL of a registry entry, or None for pure gRPC services"""
+    if config.get("http_url"):
+        return config["http_url"]
+    url = config.get("url", "")
+    if url.startswith("http://") or url.startswith("https://"):
+        return url
+    return None
+
+
+class HTTPClientPool:
+    """
+    Shared httpx.AsyncClient instances keyed by service name
+    Connection limits and keep-alive settings come from the service registry
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        # Client for calls that do not target a registered service
+        self.default_client: Optional[httpx.AsyncClient] = None
+
+    def _build_client(self, config: Dict[str, Any], base_url: str = "") -> httpx.AsyncClient:
+        """Create a client with the pool limits declared in the registry entry"""
+        limits = httpx.Limits(
+            max_connections=config.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+            max_keepalive_connections=config.get(
+                "max_keepalive_connections", DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            keepalive_expiry=config.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY),
+        )
+        return httpx.AsyncClient(base_url=base_url, limits=limits)
+
+    async def startup(self) -> None:
+        """Create clients for every registered HTTP upstream"""
+        for service_name, config in self.registry.items():
+            if get_http_base_url(config):
+                self.get(service_name)
+        logger.info(f"HTTP client pool ready for {len(self.clients)} upstream services")
+
+    def get(self, service_name: Optional[str] = None) -> httpx.AsyncClient:
+        """
+        Get the shared client for a service (created lazily if startup has not run)
+
+        Args:
+            service_name: Registry key; None returns the default client
+        """
+        if service_name is None or service_name not in self.registry:
+            if self.default_client is None or self.default_client.is_closed:
+                self.default_client = self._build_client({})
+            return self.default_client
+
+        client = self.clients.get(service_name)
+        if client is None or client.is_closed:
+            config = self.registry[service_name]
+            client = self._build_client(config, get_http_base_url(config) or "")
+            self.clients[service_name] = client
+        return client
+
+    async def close(self) -> None:
+        """Close every client and release pooled connections"""
+        for service_name, client in list(self.clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing HTTP client for {service_name}: {e}")
+        self.clients.clear()
+        if self.default_client is not None:
+            await self.default_client.aclose()
+            self.default_client = None
+        logger.info("HTTP client pool closed")
+
+
+# Process-wide pool instance
+_http_pool: Optional[HTTPClientPool] = None
+
+
+def get_http_pool() -> HTTPClientPool:
+    """Get or create the process-wide HTTP client pool"""
+    global _http_pool
+    if _http_pool is None:
+        _http_pool = HTTPClientPool(SERVICE_REGISTRY)
+    return _http_pool
@@ -0,0 +1,40 @@
+"""
+Upstream Latency Tracking for Censudx API Gateway
+Rolling windows of recent call latencies with cheap quantile lookups
+"""
+
+from array import array
+from typing import Optional
+
+
+class LatencyWindow:
+    """
+    The most recent `size` latencies (seconds) of one upstream call type
+    Quantiles come from a sorted copy refreshed every `refresh_every` samples, so a
+    lookup on the request path is a list index
+    """
+
+    def __init__(self, size: int = 256, refresh_every: int = 16):
+        self.size = size
+        self.refresh_every = refresh_every
+        self.samples = array("d", bytes(8 * size))
+        self.count = 0
+        self.sorted: Optional[list] = None
+        self.since_refresh = 0
+
+    def add(self, latency: float) -> None:
+        self.samples[self.count % self.size] = latency
+        self.count += 1
+        self.since_refresh += 1
+        if self.since_refresh >= self.refresh_every:
+            self.sorted = None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Latency below which a fraction q of the window falls (None without samples)"""
+        filled = min(self.count, self.size)
+        if not filled:
+            return None
+        if self.sorted is None or len(self.sorted) != filled:
+            self.sorted = sorted(self.samples[:filled])
+            self.since_refresh = 0
+        return self.sorted[min(filled - 1, int(q * filled))]
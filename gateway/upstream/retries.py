@@ -0,0 +1,141 @@
+"""
+Upstream Retries for Censudx API Gateway
+Retries idempotent RPCs on transient errors, bounded by a token budget per upstream
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import grpc
+from fastapi import Request
+
+from gateway.config import SERVICE_REGISTRY
+from gateway.upstream.deadlines import get_request_deadline, run_with_cancellation
+
+logger = logging.getLogger(__name__)
+
+# Retry settings used when a registry entry does not declare its own
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BUDGET_MAX = 10
+DEFAULT_BACKOFF_BASE = 0.05
+DEFAULT_BACKOFF_MAX = 1.0
+
+# Only errors where the upstream never processed the call are retried
+RETRYABLE_CODES = frozenset({grpc.StatusCode.UNAVAILABLE})
+
+
+class RetryBudget:
+    """
+    Token budget for retries of one upstream
+    Every first attempt deposits ratio tokens (up to max_tokens) and every retry spends
+    one, so retries stay below ratio of the traffic plus a small reserve
+    """
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO, max_tokens: float = DEFAULT_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.stats = {"calls": 0, "retries": 0, "exhausted": 0}
+
+    def deposit(self) -> None:
+        self.stats["calls"] += 1
+        # Rounded so ten deposits of 0.1 make a whole token
+        self.tokens = min(self.max_tokens, round(self.tokens + self.ratio, 6))
+
+    def withdraw(self) -> bool:
+        """Take a token for one retry (False when the budget is spent)"""
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.stats["retries"] += 1
+            return True
+        self.stats["exhausted"] += 1
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"tokens": round(self.tokens, 2), **self.stats}
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff before retry number attempt (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, grpc.RpcError) and error.code() in RETRYABLE_CODES
+
+
+class RetryBudgetRegistry:
+    """Retry budgets keyed by service name, configured from the service registry"""
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.budgets: Dict[str, RetryBudget] = {}
+
+    def get(self, service_name: str) -> RetryBudget:
+        """Get the budget of a service (created on first use)"""
+        budget = self.budgets.get(service_name)
+        if budget is None:
+            config = self.registry.get(service_name, {})
+            budget = RetryBudget(
+                config.get("retry_budget_ratio", DEFAULT_BUDGET_RATIO),
+                config.get("retry_budget_max", DEFAULT_BUDGET_MAX)
+            )
+            self.budgets[service_name] = budget
+        return budget
+
+    def is_idempotent(self, service_name: str, method_name: str) -> bool:
+        """Whether the registry declares an RPC of a service safe to repeat"""
+        return method_name in self.registry.get(service_name, {}).get("idempotent_rpcs", ())
+
+
+async def call_with_retries(
+    request: Optional[Request],
+    service_name: str,
+    attempt: Callable[[], Awaitable[Any]],
+    budgets: RetryBudgetRegistry
+) -> Any:
+    """
+    Run attempt(), retrying transient failures with jittered backoff
+
+    A retry needs a budget token and must fit in the request deadline; otherwise the
+    last error is raised.
+    """
+    config = budgets.registry.get(service_name, {})
+    max_attempts = config.get("retry_max_attempts", DEFAULT_MAX_ATTEMPTS)
+    budget = budgets.get(service_name)
+    budget.deposit()
+    for attempt_number in range(1, max_attempts + 1):
+        try:
+            return await attempt()
+        except Exception as e:
+            if attempt_number == max_attempts or not is_retryable(e):
+                raise
+            delay = backoff_delay(
+                attempt_number,
+                config.get("retry_backoff_base", DEFAULT_BACKOFF_BASE),
+                config.get("retry_backoff_max", DEFAULT_BACKOFF_MAX)
+            )
+            deadline = get_request_deadline(request)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            if not budget.withdraw():
+                logger.warning(f"Retry budget of {service_name} exhausted; not retrying")
+                raise
+            logger.info(f"Retrying {service_name} call in {delay:.3f}s (attempt {attempt_number + 1}): {e.code().name}")
+            await run_with_cancellation(request, asyncio.sleep(delay))
+
+
+# Process-wide retry budget registry instance
+_retry_budgets: Optional[RetryBudgetRegistry] = None
+
+
+def get_retry_budgets() -> RetryBudgetRegistry:
+    """Get or create the process-wide retry budget registry"""
+    global _retry_budgets
+    if _retry_budgets is None:
+        _retry_budgets = RetryBudgetRegistry(SERVICE_REGISTRY)
+    return _retry_budgets
@@ -0,0 +1,165 @@
+"""
+Stale-If-Error Cache for Censudx API Gateway
+Keeps the last good answer of idempotent reads and serves it while the upstream is failing
+"""
+
+import collections
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, OrderedDict, Tuple
+
+from fastapi import HTTPException, Request
+
+from gateway.config import SERVICE_REGISTRY
+from gateway.upstream.circuit_breaker import is_upstream_failure
+
+logger = logging.getLogger(__name__)
+
+# Stale settings used when a stale_rpcs entry does not declare its own
+DEFAULT_MAX_STALE = 300.0
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+# RFC 7234 warning attached to responses built from a stale answer
+STALE_WARNING = b'110 - "Response is Stale"'
+
+
+def is_stale_servable(error: BaseException) -> bool:
+    """Whether an upstream call error may be answered from the stale cache"""
+    if isinstance(error, HTTPException):
+        # Circuit open, bulkhead or concurrency limit full (503), request budget spent (504)
+        return error.status_code in (503, 504)
+    return is_upstream_failure(error)
+
+
+def stale_headers(scope: Dict[str, Any]) -> List[Tuple[bytes, bytes]]:
+    """Warning and Age headers for a response that used a stale answer (none otherwise)"""
+    age = scope.get("state", {}).get("stale_age")
+    if age is None:
+        return []
+    return [(b"warning", STALE_WARNING), (b"age", str(int(age)).encode())]
+
+
+class StaleStore:
+    """
+    Last good responses of one RPC keyed by the serialized request message
+    Bounded by total message size (oldest stored first out) and by max_stale: older
+    answers are dropped instead of served
+    """
+
+    def __init__(self, max_stale: float = DEFAULT_MAX_STALE, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_stale = max_stale
+        self.max_bytes = max_bytes
+        # key -> (response, size, stored at)
+        self.entries: OrderedDict[bytes, Tuple[Any, int, float]] = collections.OrderedDict()
+        self.bytes = 0
+        self.stats = {"stored": 0, "served": 0, "misses": 0, "evicted": 0}
+
+    def put(self, key: bytes, response: Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (response, size, time.monotonic())
+        self.bytes += size
+        self.stats["stored"] += 1
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats["evicted"] += 1
+
+    def pop(self, key: bytes) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def get(self, key: bytes) -> Optional[Tuple[Any, float]]:
+        """Stored response and its age in seconds (None if missing or too old)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        age = time.monotonic() - entry[2]
+        if age > self.max_stale:
+            self.pop(key)
+            self.stats["misses"] += 1
+            return None
+        self.stats["served"] += 1
+        return entry[0], age
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes, **self.stats}
+
+
+class StaleCache:
+    """
+    Stale stores keyed by (service, RPC), configured from the service registry
+    RPCs opt in through the service's stale_rpcs entry (RPC name -> max_stale, max_bytes)
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.stores: Dict[Tuple[str, str], StaleStore] = {}
+
+    def get(self, service_name: str, method_name: str) -> Optional[StaleStore]:
+        """Store of an RPC (None if the RPC does not opt in)"""
+        store = self.stores.get((service_name, method_name))
+        if store is None:
+            config = self.registry.get(service_name, {}).get("stale_rpcs", {}).get(method_name)
+            if config is None:
+                return None
+            store = StaleStore(
+                config.get("max_stale", DEFAULT_MAX_STALE),
+                config.get("max_bytes", DEFAULT_MAX_BYTES)
+            )
+            self.stores[(service_name, method_name)] = store
+        return store
+
+    def get_stats(self, service_name: str) -> Dict[str, Any]:
+        return {
+            method_name: store.get_stats()
+            for (name, method_name), store in self.stores.items()
+            if name == service_name
+        }
+
+
+async def call_with_stale(
+    request: Optional[Request],
+    service_name: str,
+    message: Any,
+    call: Callable[[], Awaitable[Any]],
+    store: StaleStore
+) -> Any:
+    """
+    Run call(), keeping a good response for message and falling back to the last
+    one when the upstream fails, times out or is shed
+
+    The age of a stale answer is left in request.state.stale_age for the pipeline
+    to send as Warning and Age headers.
+    """
+    key = message.SerializeToString(deterministic=True)
+    try:
+        response = await call()
+    except Exception as e:
+        if not is_stale_servable(e):
+            raise
+        hit = store.get(key)
+        if hit is None:
+            raise
+        response, age = hit
+        logger.warning(f"Serving {service_name} answer {age:.1f}s stale after upstream error: {e}")
+        if request is not None:
+            request.state.stale_age = max(age, getattr(request.state, "stale_age", 0.0))
+        return response
+    store.put(key, response, response.ByteSize())
+    return response
+
+
+# Process-wide stale cache instance
+_stale_cache: Optional[StaleCache] = None
+
+
+def get_stale_cache() -> StaleCache:
+    """Get or create the process-wide stale cache"""
+    global _stale_cache
+    if _stale_cache is None:
+        _stale_cache = StaleCache(SERVICE_REGISTRY)
+    return _stale_cache
@@ -0,0 +1,84 @@
+"""
+Adaptive Upstream Timeouts for Censudx API Gateway
+Per-call timeouts learned from each upstream method's recent latency quantiles
+"""
+
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from gateway.config import SERVICE_REGISTRY
+from gateway.upstream.latency import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+# Adaptive timeout settings used when a registry entry does not declare its own
+DEFAULT_TIMEOUT_QUANTILE = 0.99
+DEFAULT_TIMEOUT_MULTIPLIER = 3.0
+DEFAULT_TIMEOUT_MIN = 0.5
+DEFAULT_TIMEOUT_MIN_SAMPLES = 50
+# Used when a registry entry declares neither timeout_max nor timeout
+DEFAULT_TIMEOUT_MAX = 30.0
+
+
+class AdaptiveTimeouts:
+    """
+    Latency windows keyed by (service, method) and the timeouts derived from them
+    A method's timeout is timeout_multiplier * its timeout_quantile latency, kept between
+    timeout_min and timeout_max (the registry timeout by default). Until
+    timeout_min_samples calls have been seen the ceiling itself is used, so slow methods
+    keep their long timeout and only fast ones are cut short
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.registry = registry
+        self.latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+
+    def get_latency(self, service_name: str, method_name: str) -> LatencyWindow:
+        latency = self.latencies.get((service_name, method_name))
+        if latency is None:
+            latency = LatencyWindow()
+            self.latencies[(service_name, method_name)] = latency
+        return latency
+
+    def record(self, service_name: str, method_name: str, latency: float) -> None:
+        """
+        Add one call's latency; timed-out calls add the time they were allowed, so a
+        slowing upstream raises its own timeout instead of being cut off forever
+        """
+        self.get_latency(service_name, method_name).add(latency)
+
+    def get(self, service_name: str, method_name: str) -> float:
+        """Timeout (seconds) for the next call of a method"""
+        config = self.registry.get(service_name, {})
+        ceiling = float(config.get("timeout_max", config.get("timeout", DEFAULT_TIMEOUT_MAX)))
+        latency = self.latencies.get((service_name, method_name))
+        if latency is None or latency.count < config.get("timeout_min_samples", DEFAULT_TIMEOUT_MIN_SAMPLES):
+            return ceiling
+        quantile = latency.quantile(config.get("timeout_quantile", DEFAULT_TIMEOUT_QUANTILE))
+        timeout = quantile * config.get("timeout_multiplier", DEFAULT_TIMEOUT_MULTIPLIER)
+        return min(ceiling, max(float(config.get("timeout_min", DEFAULT_TIMEOUT_MIN)), timeout))
+
+    def get_stats(self, service_name: str) -> Dict[str, Any]:
+        """Current timeout and latency quantiles of each method seen for a service"""
+        return {
+            method_name: {
+                "samples": latency.count,
+                "p50": latency.quantile(0.5),
+                "p99": latency.quantile(0.99),
+                "timeout": round(self.get(service_name, method_name), 3)
+            }
+            for (name, method_name), latency in self.latencies.items()
+            if name == service_name
+        }
+
+
+# Process-wide adaptive timeout instance
+_adaptive_timeouts: Optional[AdaptiveTimeouts] = None
+
+
+def get_adaptive_timeouts() -> AdaptiveTimeouts:
+    """Get or create the process-wide adaptive timeouts"""
+    global _adaptive_timeouts
+    if _adaptive_timeouts is None:
+        _adaptive_timeouts = AdaptiveTimeouts(SERVICE_REGISTRY)
+    return _adaptive_timeouts
@@ -117,6 +117,25 @@ class MessageSchema:
                 "reservation_id": reservation_id
             }
         }
+    
+    @staticmethod
+    def token_revoked(
+        token_hash: str,
+        expires_at: Optional[float] = None,
+        service: str = "api-gateway"
+    ) -> Dict[str, Any]:
+        """Schema for token revocation events (published on logout)"""
+        return {
+            "event_id": f"token_revoked_{token_hash[:16]}_{datetime.utcnow().timestamp()}",
+            "event_type": "token_revoked",
+            "timestamp": datetime.utcnow().isoformat(),
+            "service": service,
+            "version": "1.0.0",
+            "payload": {
+                "token_hash": token_hash,  # SHA-256 hex digest of the raw token
+                "expires_at": expires_at   # Unix timestamp of the token's exp claim
+            }
+        }
 
 
 class RabbitMQService:
@@ -150,6 +169,14 @@ class RabbitMQService:
             "durable": True,
             "exchange": "inventory_events",
             "routing_key": "inventory.reserved"
+        },
+        # Broadcast: every consumer gets its own exclusive, server-named queue
+        "token_revocations": {
+            "name": "",
+            "durable": False,
+            "broadcast": True,
+            "exchange": "auth_events",
+            "routing_key": "auth.token.revoked"
         }
     }
     
@@ -164,6 +191,8 @@ class RabbitMQService:
         self.connection: Optional[BlockingConnection] = None
         self.channel: Optional[BlockingChannel] = None
         self.consumers: Dict[str, Callable] = {}
+        # Server-generated names of broadcast queues declared by this connection
+        self.queue_names: Dict[str, str] = {}
         self.max_retries = 5
         self.retry_delay = 2  # seconds
     
@@ -198,15 +227,18 @@ class RabbitMQService:
                 self.connection = pika.BlockingConnection(parameters)
                 self.channel = self.connection.channel()
                 
-                # Declare exchange
-                self.channel.exchange_declare(
-                    exchange='inventory_events',
-                    exchange_type='topic',
-                    durable=True
-                )
+                # Declare exchanges
+                for exchange in {queue_config['exchange'] for queue_config in self.QUEUES.values()}:
+                    self.channel.exchange_declare(
+                        exchange=exchange,
+                        exchange_type='topic',
+                        durable=True
+                    )
                 
-                # Declare all queues
+                # Declare all shared queues (broadcast queues are declared per consumer)
                 for queue_config in self.QUEUES.values():
+                    if queue_config.get('broadcast'):
+                        continue
                     self.channel.queue_declare(
                         queue=queue_config['name'],
                         durable=queue_config['durable']
@@ -240,6 +272,27 @@ class RabbitMQService:
         except Exception as e:
             logger.error(f"Error disconnecting from RabbitMQ: {e}")
     
+    def declare_broadcast_queue(self, queue_name: str) -> str:
+        """
+        Declare an exclusive, auto-deleted queue bound to a broadcast routing key
+        
+        Args:
+            queue_name: Key of a broadcast entry in QUEUES
+        
+        Returns:
+            str: Server-generated queue name
+        """
+        queue_config = self.QUEUES[queue_name]
+        result = self.channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+        generated_name = result.method.queue
+        self.channel.queue_bind(
+            exchange=queue_config['exchange'],
+            queue=generated_name,
+            routing_key=queue_config['routing_key']
+        )
+        self.queue_names[queue_name] = generated_name
+        return generated_name
+    
     def publish_message(
         self,
         queue_name: str,
@@ -346,6 +399,15 @@ class RabbitMQService:
         )
         return self.publish_message("stock_reserved", message)
     
+    def publish_token_revoked(
+        self,
+        token_hash: str,
+        expires_at: Optional[float] = None
+    ) -> bool:
+        """Publish token revocation event to every gateway replica"""
+        message = MessageSchema.token_revoked(token_hash, expires_at)
+        return self.publish_message("token_revocations", message)
+    
     def register_consumer(
         self,
         queue_name: str,
@@ -397,8 +459,11 @@ class RabbitMQService:
         for queue_name in self.consumers:
             queue_config = self.QUEUES.get(queue_name)
             if queue_config:
+                queue = queue_config['name']
+                if queue_config.get('broadcast'):
+                    queue = self.declare_broadcast_queue(queue_name)
                 self.channel.basic_consume(
-                    queue=queue_config['name'],
+                    queue=queue,
                     on_message_callback=message_callback,
                     auto_ack=False
                 )
@@ -0,0 +1,110 @@
+"""
+Rate limit key store benchmark
+Feeds 1M distinct client keys (an IP spray) to the in-process limiter and reports time and memory
+
+Usage: python stress_tests/middleware/rate_limit_keys.py [keys] [max_keys]
+"""
+
+import asyncio
+import sys
+import os
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from gateway.middleware.rate_limiting import LocalRateLimitBackend
+
+
+class TokenBucket:
+    """Former per-key bucket object (before)"""
+
+    def __init__(self, tokens: int, refill_rate: float):
+        self.capacity = tokens
+        self.tokens = tokens
+        self.refill_rate = refill_rate
+        self.last_refill = time.time()
+
+    def consume(self, tokens: int = 1) -> bool:
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class DictBucketStore:
+    """Former dict of TokenBucket with a full scan past 10k keys (before)"""
+
+    def __init__(self):
+        self.buckets = {}
+
+    def consume(self, key: str) -> bool:
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(100, 1.67)
+            if len(self.buckets) > 10000:
+                now = time.time()
+                for old_key in [k for k, b in self.buckets.items() if now - b.last_refill > 3600]:
+                    del self.buckets[old_key]
+        return self.buckets[key].consume()
+
+
+def spray_keys(count: int):
+    """Distinct api:<ip> keys"""
+    return [f"api:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(count)]
+
+
+def measure(label: str, run, count: int) -> None:
+    """Time run() and report the memory still held by what it returns"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<52} {elapsed / count * 1e6:8.2f} us/key {current / 2 ** 20:8.1f} MiB held")
+    return result
+
+
+def main(count: int, max_keys: int) -> None:
+    keys = spray_keys(count)
+    loop = asyncio.new_event_loop()
+
+    def dict_store(limit, scan):
+        store = DictBucketStore()
+        if not scan:
+            # Memory only: skip the cleanup scan, which is quadratic past 10k keys
+            store.buckets = {key: TokenBucket(100, 1.67) for key in keys[:limit]}
+        else:
+            for key in keys[:limit]:
+                store.consume(key)
+        return store
+
+    def gcra(limit):
+        backend = LocalRateLimitBackend(limit)
+        consume = backend.consume
+
+        async def spray():
+            for key in keys:
+                await consume(key, 100, 1.67)
+
+        loop.run_until_complete(spray())
+        return backend
+
+    print(f"distinct keys: {count}")
+    scan_keys = min(count, 20000)
+    measure(f"before: dict of TokenBucket, {scan_keys} keys", lambda: dict_store(scan_keys, True), scan_keys)
+    measure(f"before: dict of TokenBucket, {count} keys (no scan)", lambda: dict_store(count, False), count)
+    measure(f"after: GCRA store, max_keys={count}", lambda: gcra(count), count)
+    backend = measure(f"after: GCRA store, max_keys={max_keys}", lambda: gcra(max_keys), count)
+    print(f"evictions at max_keys={max_keys}: {backend.store.stats}")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    )
@@ -0,0 +1,60 @@
+"""
+Shared-memory rate limiter throughput
+Runs N worker processes against one shared segment (as uvicorn --workers N would) and
+reports admissions on a shared key and decisions per second
+
+Usage: python stress_tests/middleware/shared_memory_limiter.py [processes] [requests]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+SEGMENT = "censudx_gateway_ratelimit_bench"
+DIRECTORY = "/dev/shm"
+CAPACITY = 500
+
+
+def worker(requests: int, results) -> None:
+    from gateway.middleware.shm_limiter import SharedMemoryRateLimitBackend
+
+    async def run():
+        backend = SharedMemoryRateLimitBackend(name=SEGMENT, directory=DIRECTORY, max_keys=100000)
+        admitted = 0
+        start = time.perf_counter()
+        for i in range(requests):
+            if (await backend.consume("api:shared", CAPACITY, 0.001)).allowed:
+                admitted += 1
+            await backend.consume(f"api:{os.getpid()}:{i}", 10, 1.0)
+        elapsed = time.perf_counter() - start
+        backend.close()
+        return admitted, 2 * requests / elapsed
+
+    results.put(asyncio.run(run()))
+
+
+def main(processes: int, requests: int) -> None:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(requests, results)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    outcomes = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    os.unlink(os.path.join(DIRECTORY, SEGMENT))
+    rates = [rate for _, rate in outcomes]
+    print(f"processes: {processes}, requests/process: {requests}")
+    print(f"admitted on shared key: {sum(a for a, _ in outcomes)} (capacity {CAPACITY})")
+    print(f"decisions/s per process: min {min(rates):,.0f} max {max(rates):,.0f}, total {sum(rates):,.0f}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    )
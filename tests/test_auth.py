@@ -0,0 +1,293 @@
+"""
+Tests for gateway-side token validation
+Tests the token cache and the authorize dependency
+"""
+
+import time
+import pytest
+import jwt
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from gateway.auth import authorize as authorize_module
+from gateway.auth.token_cache import TokenCache, hash_token
+
+
+class FakeRedis:
+    """Minimal async Redis stand-in backed by a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def make_token(expires_in: int) -> str:
+    """Build an HS256 JWT with an exp claim"""
+    return jwt.encode({"sub": "user-1", "exp": int(time.time()) + expires_in}, "secret", algorithm="HS256")
+
+
+class TestTokenCache:
+    """Test the two-tier token cache"""
+
+    async def test_local_hit_after_store(self):
+        """Test that a stored token is served from the in-process tier"""
+        cache = TokenCache(default_ttl=60)
+        token = make_token(300)
+        assert await cache.get(token) is None
+        await cache.set(token, ["Admin"])
+        assert await cache.get(token) == ["Admin"]
+        stats = cache.get_stats()
+        assert stats["local_hits"] == 1
+        assert stats["misses"] == 1
+
+    async def test_ttl_capped_by_token_expiry(self):
+        """Test that TTL never exceeds the token's own expiry"""
+        cache = TokenCache(default_ttl=600)
+        assert cache.ttl_for(make_token(30)) <= 30
+        assert cache.ttl_for("opaque-token") == 600
+
+    async def test_expired_token_not_cached(self):
+        """Test that already-expired tokens are not stored"""
+        cache = TokenCache(default_ttl=60)
+        token = make_token(-10)
+        await cache.set(token, ["Admin"])
+        assert await cache.get(token) is None
+
+    async def test_lru_eviction(self):
+        """Test that the in-process tier stays within max_entries"""
+        cache = TokenCache(max_entries=2, default_ttl=60)
+        for i in range(3):
+            await cache.set(f"token-{i}", ["Client"])
+        assert len(cache.entries) == 2
+        assert await cache.get("token-0") is None
+
+    async def test_redis_tier_shared(self):
+        """Test that a second process-level cache is populated from Redis"""
+        redis = FakeRedis()
+        first = TokenCache(redis_client=redis)
+        second = TokenCache(redis_client=redis)
+        await first.set("shared-token", ["Admin"])
+        assert await second.get("shared-token") == ["Admin"]
+        assert second.get_stats()["redis_hits"] == 1
+        # Promoted into the local tier
+        assert await second.get("shared-token") == ["Admin"]
+        assert second.get_stats()["local_hits"] == 1
+
+    async def test_peek_is_local_and_stats_free(self):
+        """Test that peek reads only the in-process tier and leaves the stats alone"""
+        redis = FakeRedis()
+        await TokenCache(redis_client=redis).set("shared-token", ["Admin"])
+        cache = TokenCache(redis_client=redis)
+        assert cache.peek("shared-token") is None
+        await cache.set("local-token", ["Client"])
+        assert cache.peek("local-token") == ["Client"]
+        stats = cache.get_stats()
+        assert stats["local_hits"] == stats["redis_hits"] == stats["misses"] == 0
+
+    async def test_invalidate(self):
+        """Test that invalidation clears both tiers"""
+        redis = FakeRedis()
+        cache = TokenCache(redis_client=redis)
+        await cache.set("token", ["Admin"])
+        await cache.invalidate("token")
+        assert await cache.get("token") is None
+        assert redis.data == {}
+
+
+class TestResolveUserRoles:
+    """Test role resolution used by the authorize dependency"""
+
+    async def test_remote_called_once(self, monkeypatch):
+        """Test that repeat lookups do not reach the auth service"""
+        calls = []
+
+        async def fake_get_user_roles(token, request=None):
+            calls.append(token)
+            return ["Admin"]
+
+        monkeypatch.setattr(authorize_module, "get_user_roles", fake_get_user_roles)
+        monkeypatch.setattr(authorize_module, "get_token_cache", lambda: cache)
+        cache = TokenCache()
+
+        token = make_token(300)
+        assert await authorize_module.resolve_user_roles(token) == ["Admin"]
+        assert await authorize_module.resolve_user_roles(token) == ["Admin"]
+        assert calls == [token]
+
+    async def test_memoized_per_request(self, monkeypatch):
+        """Test that stacked dependencies reuse the request memo"""
+        class State:
+            pass
+
+        class FakeRequest:
+            state = State()
+
+        async def fake_get_user_roles(token, request=None):
+            return ["Admin"]
+
+        monkeypatch.setattr(authorize_module, "get_user_roles", fake_get_user_roles)
+        monkeypatch.setattr(authorize_module, "get_token_cache", lambda: None)
+
+        request = FakeRequest()
+        await authorize_module.resolve_user_roles("token", request)
+        assert request.state.auth_roles == {hash_token("token"): ["Admin"]}
+
+
+class TestLocalTokenVerifier:
+    """Test local JWT verification against cached signing keys"""
+
+    def make_verifier(self, **store_kwargs):
+        from gateway.auth.jwt_verifier import LocalTokenVerifier, SigningKeyStore
+        return LocalTokenVerifier(SigningKeyStore(**store_kwargs), algorithms=["HS256"])
+
+    async def test_static_secret(self):
+        """Test verification with the shared signing secret"""
+        verifier = self.make_verifier(static_secret="secret")
+        assert await verifier.verify(make_token(300)) == []
+        token = jwt.encode({"role": "Admin", "exp": int(time.time()) + 60}, "secret", algorithm="HS256")
+        assert await verifier.verify(token) == ["Admin"]
+
+    async def test_bad_signature_rejected(self):
+        """Test that a token signed with another secret is rejected"""
+        from fastapi import HTTPException
+        verifier = self.make_verifier(static_secret="other-secret")
+        with pytest.raises(HTTPException) as exc:
+            await verifier.verify(make_token(300))
+        assert exc.value.status_code == 401
+
+    async def test_expired_rejected(self):
+        """Test that expired tokens are rejected locally"""
+        from fastapi import HTTPException
+        verifier = self.make_verifier(static_secret="secret")
+        with pytest.raises(HTTPException):
+            await verifier.verify(make_token(-60))
+
+    async def test_rotated_key_from_jwks(self):
+        """Test that keys from a JWKS document are used by key id"""
+        from gateway.auth.jwt_verifier import UnknownSigningKey
+        verifier = self.make_verifier()
+        token = jwt.encode(
+            {"roles": ["Admin", "Client"], "exp": int(time.time()) + 60},
+            "rotated-secret", algorithm="HS256", headers={"kid": "k2"}
+        )
+        with pytest.raises(UnknownSigningKey):
+            await verifier.verify(token)
+
+        # "cm90YXRlZC1zZWNyZXQ" is base64url("rotated-secret")
+        verifier.key_store.load_jwks({"keys": [{"kty": "oct", "kid": "k2", "k": "cm90YXRlZC1zZWNyZXQ", "alg": "HS256"}]})
+        assert await verifier.verify(token) == ["Admin", "Client"]
+
+    async def test_unknown_key_falls_back_to_remote(self, monkeypatch):
+        """Test that unknown signing keys are resolved by the auth service"""
+        calls = []
+
+        async def fake_get_user_roles(token, request=None):
+            calls.append(token)
+            return ["Client"]
+
+        verifier = self.make_verifier()
+        monkeypatch.setattr(authorize_module, "get_user_roles", fake_get_user_roles)
+        monkeypatch.setattr(authorize_module, "get_token_cache", lambda: None)
+        monkeypatch.setattr(authorize_module, "get_local_verifier", lambda: verifier)
+
+        token = make_token(300)
+        assert await authorize_module.resolve_user_roles(token) == ["Client"]
+        assert calls == [token]
+
+
+class TestRevocationList:
+    """Test the token revocation list"""
+
+    def test_revoke_and_check(self):
+        """Test that revoked hashes are reported until expiry"""
+        from gateway.auth.revocation import RevocationList
+        revocations = RevocationList()
+        token_hash = hash_token("token")
+        assert not revocations.is_revoked(token_hash)
+        revocations.revoke(token_hash, time.time() + 60)
+        assert revocations.is_revoked(token_hash)
+
+    def test_expired_entries_pruned(self):
+        """Test that entries are dropped once the token has expired"""
+        from gateway.auth.revocation import RevocationList
+        revocations = RevocationList()
+        revocations.revoke(hash_token("a"), time.time() + 0.01)
+        revocations.revoke(hash_token("b"), time.time() - 1)
+        assert len(revocations.entries) == 1
+        time.sleep(0.02)
+        revocations.prune()
+        assert revocations.entries == {}
+
+    def test_max_entries(self):
+        """Test the hard cap on revoked entries"""
+        from gateway.auth.revocation import RevocationList
+        revocations = RevocationList(max_entries=10)
+        for i in range(50):
+            revocations.revoke(hash_token(f"token-{i}"), time.time() + 60 + i)
+        assert len(revocations.entries) == 10
+        assert revocations.is_revoked(hash_token("token-49"))
+        assert revocations.get_stats()["evicted"] == 40
+        assert revocations.is_saturated()
+
+    def test_process_broadcast_message(self):
+        """Test that revocations published by another replica are applied"""
+        from gateway.auth.revocation import RevocationList
+        from services.messaging import MessageSchema
+        revocations = RevocationList()
+        message = MessageSchema.token_revoked(hash_token("token"), time.time() + 60)
+        assert message["event_type"] == "token_revoked"
+        revocations.process_message(message)
+        assert revocations.is_revoked(hash_token("token"))
+        assert revocations.get_stats()["received"] == 1
+
+    async def test_revoked_token_rejected_from_cache(self, monkeypatch):
+        """Test that a cached token is rejected after revocation"""
+        from fastapi import HTTPException
+        from gateway.auth.revocation import RevocationList
+
+        cache = TokenCache()
+        revocations = RevocationList()
+        monkeypatch.setattr(authorize_module, "get_token_cache", lambda: cache)
+        monkeypatch.setattr(authorize_module, "get_revocation_list", lambda: revocations)
+
+        token = make_token(300)
+        await cache.set(token, ["Admin"])
+        assert await authorize_module.resolve_user_roles(token) == ["Admin"]
+
+        revocations.revoke(hash_token(token))
+        with pytest.raises(HTTPException) as exc:
+            await authorize_module.resolve_user_roles(token)
+        assert exc.value.status_code == 401
+
+    async def test_saturated_list_skips_cache(self, monkeypatch):
+        """Test that tokens go to the auth service while evicted revocations may be live"""
+        from gateway.auth.revocation import RevocationList
+
+        calls = []
+
+        async def fake_get_user_roles(token, request=None):
+            calls.append(token)
+            return ["Client"]
+
+        cache = TokenCache()
+        revocations = RevocationList(max_entries=1)
+        monkeypatch.setattr(authorize_module, "get_user_roles", fake_get_user_roles)
+        monkeypatch.setattr(authorize_module, "get_token_cache", lambda: cache)
+        monkeypatch.setattr(authorize_module, "get_revocation_list", lambda: revocations)
+
+        token = make_token(300)
+        await cache.set(token, ["Admin"])
+        revocations.revoke(hash_token("evicted"), time.time() + 60)
+        revocations.revoke(hash_token("kept"), time.time() + 120)
+        assert await authorize_module.resolve_user_roles(token) == ["Client"]
+        assert calls == [token]
@@ -0,0 +1,712 @@
+"""
+Tests for the gateway middleware pipeline
+Tests request IDs, rate limit admission and header injection
+"""
+
+import asyncio
+
+import pytest
+import httpx
+from fastapi import FastAPI, Request
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from gateway.middleware.pipeline import GatewayPipelineMiddleware, get_client_ip
+from gateway.middleware.rate_limiting import RateLimiter
+
+
+def make_app(limiter, concurrency=None, analytics=None, admission=None):
+    """App behind the pipeline that counts routed requests"""
+    app = FastAPI()
+    app.state.routed = 0
+    app.state.gate = asyncio.Event()
+
+    @app.get("/api/slow")
+    async def slow():
+        await app.state.gate.wait()
+        return {"status": "done"}
+
+    @app.get("/api/items")
+    async def items(request: Request):
+        app.state.routed += 1
+        return {"request_id": request.state.request_id}
+
+    @app.post("/api/login")
+    async def login():
+        return {"status": "ok"}
+
+    @app.get("/gateway/health")
+    async def health():
+        return {"status": "healthy"}
+
+    app.add_middleware(
+        GatewayPipelineMiddleware,
+        limiter=limiter,
+        concurrency=concurrency,
+        analytics=analytics,
+        admission=admission
+    )
+    return app
+
+
+@pytest.fixture
+def limiter():
+    limiter = RateLimiter()
+    limiter.rate_limits["api"] = {"tokens": 2, "refill_rate": 0.001}
+    return limiter
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    """In-process token cache standing in for the auth service's validations"""
+    from gateway.auth.token_cache import TokenCache
+    cache = TokenCache()
+    monkeypatch.setattr("gateway.middleware.pipeline.get_local_verifier", lambda: None)
+    monkeypatch.setattr("gateway.middleware.pipeline.get_token_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def api_keys(monkeypatch):
+    """Configure key-1 and key-2 as issued API keys"""
+    from gateway.middleware.pipeline import hash_api_key
+    keys = frozenset(hash_api_key(key) for key in (b"key-1", b"key-2"))
+    monkeypatch.setattr("gateway.middleware.pipeline.API_KEY_IDENTITIES", keys)
+    return keys
+
+
+@pytest.fixture
+async def client(limiter):
+    app = make_app(limiter)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+        client.app = app
+        yield client
+
+
+class TestGatewayPipeline:
+    """Test the fused request ID and rate limiting stage"""
+
+    async def test_request_id_and_rate_limit_headers(self, client):
+        """Test that admitted responses carry request ID and rate limit headers"""
+        response = await client.get("/api/items", headers={"x-request-id": "abc-123"})
+        assert response.status_code == 200
+        assert response.headers["x-request-id"] == "abc-123"
+        assert response.json() == {"request_id": "abc-123"}
+        assert response.headers["x-ratelimit-limit"] == "2"
+        assert response.headers["x-ratelimit-remaining"] == "1"
+        assert "x-ratelimit-reset" in response.headers
+
+    async def test_generated_request_id(self, client):
+        """Test that a request ID is generated when the client sends none"""
+        response = await client.get("/api/items")
+        assert len(response.headers["x-request-id"]) == 36
+        assert response.json()["request_id"] == response.headers["x-request-id"]
+
+    async def test_over_limit_rejected_before_routing(self, client, limiter):
+        """Test that over-limit requests get 429 without reaching the app"""
+        for _ in range(2):
+            assert (await client.get("/api/items")).status_code == 200
+        response = await client.get("/api/items")
+        assert response.status_code == 429
+        assert response.json()["error"] == "Rate limit exceeded"
+        assert "retry-after" in response.headers
+        assert "x-request-id" in response.headers
+        assert client.app.state.routed == 2
+        assert limiter.get_stats()["rejected"] == 1
+
+    async def test_health_not_rate_limited(self, client, limiter):
+        """Test that health checks skip rate limiting"""
+        for _ in range(5):
+            response = await client.get("/gateway/health")
+            assert response.status_code == 200
+            assert "x-request-id" in response.headers
+            assert "x-ratelimit-limit" not in response.headers
+        assert limiter.get_stats()["keys"] == 0
+
+    def test_client_ip_resolution(self):
+        """Test that only the (already resolved) peer address is used"""
+        scope = {"headers": [(b"x-forwarded-for", b"10.0.0.1")], "client": ("127.0.0.1", 1)}
+        assert get_client_ip(scope) == "127.0.0.1"
+        assert get_client_ip({"headers": [(b"x-real-ip", b"10.0.0.3")]}) == "unknown"
+
+    async def test_limits_keyed_on_subject(self, client, limiter, token_cache, api_keys):
+        """Test that only verified subjects and configured keys get their own bucket"""
+        import jwt
+        alice = jwt.encode({"sub": "alice"}, "secret", algorithm="HS256")
+        await token_cache.set(alice, ["user"])
+        for _ in range(2):
+            assert (await client.get("/api/items", headers={"Authorization": f"Bearer {alice}"})).status_code == 200
+        assert (await client.get("/api/items", headers={"Authorization": f"Bearer {alice}"})).status_code == 429
+        assert (await client.get("/api/items", headers={"x-api-key": "key-1"})).status_code == 200
+
+        # Made-up tokens and keys all share the caller's IP bucket
+        forged = [
+            {"Authorization": f"Bearer {jwt.encode({'sub': 'mallory-1'}, 'guess', algorithm='HS256')}"},
+            {"x-api-key": "made-up"},
+        ]
+        for headers in forged:
+            assert (await client.get("/api/items", headers=headers)).status_code == 200
+        for headers in [{"Authorization": f"Bearer {jwt.encode({'sub': 'mallory-2'}, 'guess', algorithm='HS256')}"}, {}]:
+            assert (await client.get("/api/items", headers=headers)).status_code == 429
+
+    async def test_auth_routes_charge_client_ip(self, client, limiter, token_cache):
+        """Test that verified subjects on login routes also draw on the IP bucket"""
+        import jwt
+        limiter.rate_limits["auth"] = {"tokens": 2, "refill_rate": 0.001}
+        for name in ("alice", "bob"):
+            token = jwt.encode({"sub": name}, "secret", algorithm="HS256")
+            await token_cache.set(token, ["user"])
+            assert (await client.post("/api/login", headers={"Authorization": f"Bearer {token}"})).status_code == 200
+        carol = jwt.encode({"sub": "carol"}, "secret", algorithm="HS256")
+        await token_cache.set(carol, ["user"])
+        assert (await client.post("/api/login", headers={"Authorization": f"Bearer {carol}"})).status_code == 429
+        assert (await client.post("/api/login")).status_code == 429
+
+    async def test_identity_resolution(self, token_cache, api_keys):
+        """Test configured API key, verified subject and anonymous identities"""
+        import jwt
+        from gateway.middleware.pipeline import get_rate_limit_identity
+        token = jwt.encode({"sub": "user-1"}, "secret", algorithm="HS256")
+        bearer = {"headers": [(b"authorization", f"Bearer {token}".encode())]}
+        assert await get_rate_limit_identity(bearer) is None
+        await token_cache.set(token, ["user"])
+        assert await get_rate_limit_identity(bearer) == "sub:user-1"
+        assert (await get_rate_limit_identity({"headers": [(b"x-api-key", b"key-1")]})).startswith("key:")
+        assert await get_rate_limit_identity({"headers": [(b"x-api-key", b"unknown")]}) is None
+        assert await get_rate_limit_identity({"headers": [(b"authorization", b"Bearer opaque")]}) is None
+        assert await get_rate_limit_identity({"headers": []}) is None
+
+    async def test_identity_needs_valid_signature(self, monkeypatch):
+        """Test that the local verifier decides whether a subject is trusted"""
+        import jwt
+        from gateway.auth.jwt_verifier import LocalTokenVerifier, SigningKeyStore
+        from gateway.middleware.pipeline import get_rate_limit_identity
+        verifier = LocalTokenVerifier(SigningKeyStore(static_secret="secret"), algorithms=["HS256"])
+        monkeypatch.setattr("gateway.middleware.pipeline.get_local_verifier", lambda: verifier)
+        monkeypatch.setattr("gateway.middleware.pipeline.get_token_cache", lambda: None)
+        claims = {"sub": "user-1", "exp": 4102444800}
+        good = jwt.encode(claims, "secret", algorithm="HS256")
+        forged = jwt.encode(claims, "not-the-secret", algorithm="HS256")
+        assert await get_rate_limit_identity({"headers": [(b"authorization", f"Bearer {good}".encode())]}) == "sub:user-1"
+        assert await get_rate_limit_identity({"headers": [(b"authorization", f"Bearer {forged}".encode())]}) is None
+
+
+class TestIPFilter:
+    """Test trusted-proxy client IP resolution and the IP blocklist"""
+
+    def test_cidr_trie(self):
+        """Test longest-prefix membership for IPv4 and IPv6"""
+        from gateway.middleware.ip_filter import CIDRTrie
+        trie = CIDRTrie(["10.0.0.0/8", "192.168.1.7", "2001:db8::/32"])
+        assert trie.contains("10.255.1.1")
+        assert trie.contains("192.168.1.7")
+        assert not trie.contains("192.168.1.8")
+        assert not trie.contains("11.0.0.1")
+        assert trie.contains("2001:db8::1")
+        assert not trie.contains("2001:db9::1")
+        assert trie.contains("::ffff:10.1.2.3")
+        assert not trie.contains("not-an-ip")
+        assert CIDRTrie(["0.0.0.0/0"]).contains("8.8.8.8")
+
+    def test_forwarded_headers_need_trusted_peer(self):
+        """Test that X-Forwarded-For is only honoured from trusted proxies"""
+        from gateway.middleware.ip_filter import CIDRTrie, resolve_client_ip
+        trusted = CIDRTrie(["172.25.0.0/16"])
+        spoofed = {"headers": [(b"x-forwarded-for", b"1.2.3.4")], "client": ("203.0.113.9", 1)}
+        assert resolve_client_ip(spoofed, trusted) == "203.0.113.9"
+        # Walked right to left: a client-supplied leftmost entry is ignored
+        chained = {"headers": [(b"x-forwarded-for", b"1.2.3.4, 198.51.100.7, 172.25.0.3")], "client": ("172.25.0.2", 1)}
+        assert resolve_client_ip(chained, trusted) == "198.51.100.7"
+        real_ip = {"headers": [(b"x-real-ip", b"198.51.100.8")], "client": ("172.25.0.2", 1)}
+        assert resolve_client_ip(real_ip, trusted) == "198.51.100.8"
+        assert resolve_client_ip({"headers": [], "client": ("172.25.0.2", 1)}, trusted) == "172.25.0.2"
+
+    async def test_blocklisted_client_rejected_before_pipeline(self, limiter, tmp_path):
+        """Test 403 for blocklisted clients, runtime reload and resolved IP in later stages"""
+        from gateway.middleware.ip_filter import CIDRTrie, IPBlocklist, IPFilterMiddleware
+        blocklist_file = tmp_path / "blocklist.txt"
+        blocklist_file.write_text("# abusive ranges\n198.51.100.0/24\n")
+        blocklist = IPBlocklist("", str(blocklist_file))
+        app = make_app(limiter)
+
+        @app.get("/api/whoami")
+        async def whoami(request: Request):
+            return {"ip": request.client.host}
+
+        app.add_middleware(IPFilterMiddleware, trusted_proxies=CIDRTrie(["127.0.0.1/32"]), blocklist=blocklist)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            response = await client.get("/api/items", headers={"X-Forwarded-For": "198.51.100.20"})
+            assert response.status_code == 403
+            assert "x-request-id" not in response.headers
+            assert app.state.routed == 0
+
+            response = await client.get("/api/whoami", headers={"X-Forwarded-For": "203.0.113.5"})
+            assert response.json() == {"ip": "203.0.113.5"}
+
+            blocklist_file.write_text("203.0.113.0/24\n")
+            assert blocklist.reload() == 1
+            assert (await client.get("/api/items", headers={"X-Forwarded-For": "203.0.113.5"})).status_code == 403
+            assert (await client.get("/api/items", headers={"X-Forwarded-For": "198.51.100.20"})).status_code == 200
+        assert blocklist.get_stats()["blocked"] == 2
+
+    def test_every_worker_picks_up_file_changes(self, tmp_path):
+        """Test that each worker's blocklist reloads when the shared file changes"""
+        from gateway.middleware.ip_filter import IPBlocklist
+        blocklist_file = tmp_path / "blocklist.txt"
+        blocklist_file.write_text("10.0.0.0/8\n")
+        workers = [IPBlocklist("", str(blocklist_file), check_interval=0) for _ in range(2)]
+        blocklist_file.write_text("10.0.0.0/8\n203.0.113.0/24\n")
+        for blocklist in workers:
+            blocklist.check_file()
+            assert blocklist.is_blocked("203.0.113.5")
+
+        blocklist_file.write_text("10.0.0.0/8\nbogus\n")
+        workers[0].check_file()
+        workers[0].check_file()
+        assert workers[0].is_blocked("203.0.113.5")
+        assert workers[0].get_stats()["reload_errors"] == 1
+
+    def test_malformed_reload_keeps_blocklist(self, tmp_path):
+        """Test that a bad entry leaves the current blocklist in place"""
+        from gateway.middleware.ip_filter import IPBlocklist
+        blocklist_file = tmp_path / "blocklist.txt"
+        blocklist_file.write_text("10.0.0.0/8\n")
+        blocklist = IPBlocklist("192.0.2.1", str(blocklist_file))
+        blocklist_file.write_text("10.0.0.0/8\nbogus\n")
+        with pytest.raises(ValueError):
+            blocklist.reload()
+        assert blocklist.is_blocked("10.1.1.1")
+        assert blocklist.is_blocked("192.0.2.1")
+
+
+class TestTrafficAnalytics:
+    """Test heavy-hitter and distinct-client sketches"""
+
+    def test_distinct_clients_estimate(self):
+        """Test HyperLogLog accuracy with fixed register memory"""
+        from gateway.middleware.traffic_analytics import HyperLogLog, key_hash
+        hll = HyperLogLog()
+        for i in range(50000):
+            hll.add(key_hash(f"10.0.{i >> 8}.{i & 255}")[0])
+        assert abs(hll.count() - 50000) < 50000 * 0.05
+        assert len(hll.registers) == 4096
+        small = HyperLogLog()
+        for i in range(100):
+            small.add(key_hash(f"client-{i}")[0])
+            small.add(key_hash(f"client-{i}")[0])
+        assert abs(small.count() - 100) <= 3
+
+    def test_heavy_hitters_among_spray(self):
+        """Test that the heaviest keys are found among many one-off keys"""
+        from gateway.middleware.traffic_analytics import HeavyHitters, key_hash
+        hitters = HeavyHitters(k=5)
+        for i in range(20000):
+            for key in (f"spray-{i}", "heavy-a", "heavy-b" if i % 2 else f"other-{i}"):
+                hitters.add(key, *key_hash(key))
+        top = hitters.most_common(2)
+        assert [key for key, _ in top] == ["heavy-a", "heavy-b"]
+        # Count-min never undercounts
+        assert top[0][1] >= 20000 and top[1][1] >= 10000
+        assert len(hitters.top) == 5
+
+    async def test_pipeline_feeds_analytics(self, limiter):
+        """Test that admitted and rejected requests are recorded per client and route"""
+        from gateway.middleware.traffic_analytics import TrafficAnalytics
+        analytics = TrafficAnalytics(window=60, top_k=10)
+        transport = httpx.ASGITransport(app=make_app(limiter, analytics=analytics))
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            for _ in range(3):
+                await client.get("/api/items")
+            await client.get("/gateway/health")
+        current = analytics.snapshot()["current"]
+        assert current["requests"] == 3
+        assert current["rejected"] == 1
+        assert current["distinct_clients"] == 1
+        assert current["top_clients"] == [{"client": "127.0.0.1", "requests": 3}]
+        assert current["top_routes"] == [{"route": "GET /api/items", "requests": 3}]
+
+    def test_window_rotation(self):
+        """Test that a finished window becomes the previous one"""
+        from gateway.middleware.traffic_analytics import TrafficAnalytics
+        analytics = TrafficAnalytics(window=60)
+        analytics.record("client-1", "GET", "/api/items")
+        analytics.current.started -= 61
+        analytics.record("client-2", "GET", "/api/items")
+        snapshot = analytics.snapshot()
+        assert snapshot["previous"]["top_clients"] == [{"client": "client-1", "requests": 1}]
+        assert snapshot["current"]["top_clients"] == [{"client": "client-2", "requests": 1}]
+
+
+class TestRateLimitPolicies:
+    """Test the compiled route policy table"""
+
+    def test_route_costs(self):
+        """Test that expensive routes cost more tokens than cheap ones"""
+        limiter = RateLimiter()
+        assert limiter.resolve("GET", "/api/clients", "1.2.3.4") == ("api:1.2.3.4", 10)
+        assert limiter.resolve("GET", "/api/orders/abc", "1.2.3.4") == ("api:1.2.3.4", 1)
+        assert limiter.resolve("GET", "/api/orders/user/u1", "1.2.3.4") == ("api:1.2.3.4", 3)
+        assert limiter.resolve("GET", "/api/v1/inventory/", "1.2.3.4") == ("api:1.2.3.4", 2)
+        assert limiter.resolve("POST", "/api/login", "1.2.3.4") == ("auth:1.2.3.4", 1)
+        assert limiter.resolve("GET", "/docs", "1.2.3.4") == ("default:1.2.3.4", 1)
+
+    async def test_cost_charged(self):
+        """Test that a request takes its route cost from the bucket"""
+        limiter = RateLimiter(policies=[{"method": "GET", "path": "/api/{name}", "class": "api", "cost": 40}])
+        key, cost = limiter.resolve("GET", "/api/clients", "1.2.3.4")
+        assert (await limiter.check(key, cost)).remaining == 60
+        assert (await limiter.check(key, cost)).remaining == 20
+        assert not (await limiter.check(key, cost)).allowed
+
+    def test_unknown_class_rejected(self):
+        """Test that a policy with an undefined class fails at compile time"""
+        with pytest.raises(ValueError):
+            RateLimiter(policies=[{"method": "GET", "path": "/api/x", "class": "premium"}])
+
+    def test_cost_over_capacity_rejected(self):
+        """Test that a route costing more than its class's bucket fails at compile time"""
+        classes = {"default": {"tokens": 60, "refill_rate": 1.0}, "auth": {"tokens": 10, "refill_rate": 0.17}}
+        with pytest.raises(ValueError):
+            RateLimiter(policies=[{"method": "GET", "path": "/api/x", "class": "auth", "cost": 11}], rate_limits=classes)
+        limiter = RateLimiter(policies=[{"method": "GET", "path": "/api/x", "class": "auth", "cost": 10}], rate_limits=classes)
+        assert limiter.resolve("GET", "/api/x", "1.2.3.4") == ("auth:1.2.3.4", 10)
+
+
+class TestConcurrencyLimiting:
+    """Test per-client and gateway-wide in-flight limits"""
+
+    @pytest.fixture
+    def concurrency(self):
+        from gateway.middleware.concurrency import ConcurrencyLimiter
+        return ConcurrencyLimiter({"default": {}, "api": {"max_in_flight": 1}}, max_in_flight=2)
+
+    @pytest.fixture
+    async def slow_client(self, concurrency):
+        limiter = RateLimiter()
+        app = make_app(limiter, concurrency)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            client.app = app
+            yield client
+
+    async def test_client_limit_and_release(self, slow_client, concurrency):
+        """Test that a client's second in-flight request gets 429 until the first completes"""
+        first = asyncio.create_task(slow_client.get("/api/slow"))
+        await asyncio.sleep(0.05)
+        rejected = await slow_client.get("/api/slow")
+        assert rejected.status_code == 429
+        assert rejected.headers["x-concurrency-limit"] == "1"
+        assert rejected.headers["retry-after"] == "1"
+        slow_client.app.state.gate.set()
+        assert (await first).status_code == 200
+        assert concurrency.get_stats()["in_flight"] == 0
+        assert (await slow_client.get("/api/items")).headers["x-concurrency-remaining"] == "0"
+
+    async def test_gateway_overload(self, slow_client, concurrency, api_keys):
+        """Test that the process-wide cap answers 503 to every client"""
+        tasks = [
+            asyncio.create_task(slow_client.get("/api/slow", headers={"x-api-key": f"key-{i}"}))
+            for i in (1, 2)
+        ]
+        await asyncio.sleep(0.05)
+        response = await slow_client.get("/api/slow")
+        assert response.status_code == 503
+        assert concurrency.stats["rejected_overload"] == 1
+        slow_client.app.state.gate.set()
+        await asyncio.gather(*tasks)
+
+    async def test_made_up_identities_share_ip_slots(self, slow_client, concurrency, token_cache):
+        """Test that forged tokens and unknown API keys from one IP share its in-flight slots"""
+        import jwt
+        forged = jwt.encode({"sub": "mallory-1"}, "guess", algorithm="HS256")
+        first = asyncio.create_task(slow_client.get("/api/slow", headers={"Authorization": f"Bearer {forged}"}))
+        await asyncio.sleep(0.05)
+        for headers in [
+            {"Authorization": f"Bearer {jwt.encode({'sub': 'mallory-2'}, 'guess', algorithm='HS256')}"},
+            {"x-api-key": "made-up"},
+            {},
+        ]:
+            response = await slow_client.get("/api/slow", headers=headers)
+            assert response.status_code == 429
+        assert concurrency.in_flight == {"api:127.0.0.1": 1}
+        slow_client.app.state.gate.set()
+        assert (await first).status_code == 200
+
+    async def test_released_on_cancellation(self, slow_client, concurrency):
+        """Test that a cancelled request frees its slot"""
+        task = asyncio.create_task(slow_client.get("/api/slow"))
+        await asyncio.sleep(0.05)
+        assert concurrency.get_stats()["in_flight"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert concurrency.get_stats()["in_flight"] == 0
+        assert concurrency.in_flight == {}
+
+
+class TestAdmissionControl:
+    """Test priority admission queueing and load shedding"""
+
+    PRIORITIES = {
+        "critical": {"queue_timeout": 1.0},
+        "normal": {"queue_timeout": 0.05},
+        "low": {"queue_timeout": 0, "max_utilization": 0.5},
+    }
+
+    def test_route_priorities(self):
+        """Test that logins and order creation outrank bulk listings"""
+        from gateway.middleware.admission import AdmissionController
+        controller = AdmissionController(100)
+        assert controller.priority_of("POST", "/api/login") == "critical"
+        assert controller.priority_of("POST", "/api/orders") == "critical"
+        assert controller.priority_of("PUT", "/api/orders/o1/status") == "high"
+        assert controller.priority_of("GET", "/api/orders/o1") == "normal"
+        assert controller.priority_of("GET", "/api/clients/") == "low"
+        assert controller.priority_of("GET", "/api/v1/notifications/by-product/p1") == "low"
+
+    def test_unknown_priority_rejected(self):
+        """Test that a route with an undefined priority fails at startup"""
+        from gateway.middleware.admission import AdmissionController
+        with pytest.raises(ValueError):
+            AdmissionController(10, routes=[{"method": "GET", "path": "/api/x", "priority": "urgent"}])
+
+    async def test_low_priority_shed_first(self):
+        """Test that low priority stops being admitted while higher ones still are"""
+        from gateway.middleware.admission import AdmissionController
+        controller = AdmissionController(4, self.PRIORITIES, routes=[])
+        assert await controller.acquire("low")
+        assert await controller.acquire("low")
+        assert not await controller.acquire("low")
+        assert await controller.acquire("normal")
+        assert await controller.acquire("critical")
+        assert controller.get_stats()["priorities"]["low"]["shed"] == 1
+
+    async def test_freed_slots_go_to_highest_priority(self):
+        """Test that a queued critical request is admitted before an earlier normal one"""
+        from gateway.middleware.admission import AdmissionController
+        controller = AdmissionController(1, {**self.PRIORITIES, "normal": {"queue_timeout": 1.0}}, routes=[])
+        assert await controller.acquire("normal")
+        normal = asyncio.create_task(controller.acquire("normal"))
+        await asyncio.sleep(0)
+        critical = asyncio.create_task(controller.acquire("critical"))
+        await asyncio.sleep(0)
+        controller.release()
+        assert await critical
+        assert not normal.done()
+        controller.release()
+        assert await normal
+        assert controller.in_flight == 1
+
+    async def test_queue_timeout_and_cancellation(self):
+        """Test that a queued request is shed after its timeout and leaves no state when cancelled"""
+        from gateway.middleware.admission import AdmissionController
+        controller = AdmissionController(1, self.PRIORITIES, routes=[])
+        assert await controller.acquire("critical")
+        assert not await controller.acquire("normal")
+        task = asyncio.create_task(controller.acquire("critical"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        stats = controller.get_stats()
+        assert stats["in_flight"] == 1
+        assert stats["priorities"]["normal"]["shed"] == 1
+        assert stats["priorities"]["critical"]["queue"] == 0
+
+    async def test_pipeline_sheds_low_priority(self):
+        """Test that the pipeline answers 503 to a shed request and frees its client slot"""
+        from gateway.middleware.admission import AdmissionController
+        from gateway.middleware.concurrency import ConcurrencyLimiter
+        controller = AdmissionController(
+            2, self.PRIORITIES, routes=[{"method": "GET", "path": "/api/items", "priority": "low"}]
+        )
+        concurrency = ConcurrencyLimiter()
+        app = make_app(RateLimiter(), concurrency, admission=controller)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            slow = asyncio.create_task(client.get("/api/slow"))
+            await asyncio.sleep(0.05)
+            response = await client.get("/api/items", headers={"x-api-key": "bulk"})
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "1"
+            assert app.state.routed == 0
+            assert concurrency.get_stats()["in_flight"] == 1
+            app.state.gate.set()
+            assert (await slow).status_code == 200
+            assert (await client.get("/api/items")).status_code == 200
+        assert controller.in_flight == 0
+
+
+class TestLocalRateLimitBackend:
+    """Test in-process GCRA limiting and its bounded key store"""
+
+    async def test_burst_then_refill(self, monkeypatch):
+        """Test that a key gets its burst, is rejected, then admitted after one interval"""
+        from gateway.middleware import rate_limiting
+        from gateway.middleware.rate_limiting import LocalRateLimitBackend
+        now = [1000.0]
+        monkeypatch.setattr(rate_limiting.time, "monotonic", lambda: now[0])
+        backend = LocalRateLimitBackend()
+        decisions = [await backend.consume("api:1.2.3.4", 3, 1.0) for _ in range(4)]
+        assert [d.allowed for d in decisions] == [True, True, True, False]
+        assert [d.remaining for d in decisions[:3]] == [2, 1, 0]
+        assert decisions[3].retry_after == pytest.approx(1.0)
+        now[0] += 1.0
+        assert (await backend.consume("api:1.2.3.4", 3, 1.0)).allowed
+
+    def test_store_capped_idle_keys_evicted_first(self):
+        """Test that a full store evicts idle keys before active ones"""
+        from gateway.middleware.rate_limiting import GCRAKeyStore
+        store = GCRAKeyStore(max_keys=3)
+        store.set("active-1", 200.0, now=100.0)
+        store.set("idle", 50.0, now=100.0)
+        store.set("active-2", 200.0, now=100.0)
+        store.set("new", 200.0, now=100.0)
+        assert len(store) == 3
+        assert store.get("idle") == 0.0
+        assert store.get("active-1") == 200.0
+        assert store.stats == {"evicted_idle": 1, "evicted_active": 0}
+        # With no idle key left, the CLOCK hand evicts an active one
+        store.set("another", 200.0, now=100.0)
+        assert len(store) == 3
+        assert store.stats["evicted_active"] == 1
+
+
+class FailingRedis:
+    """Redis stand-in whose scripts always fail"""
+
+    def register_script(self, script):
+        async def run(keys=None, args=None):
+            raise ConnectionError("redis down")
+        return run
+
+
+class TestRedisRateLimitBackend:
+    """Test the shared Redis limiter backend"""
+
+    @pytest.fixture
+    def redis_client(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        return fakeredis.aioredis.FakeRedis()
+
+    async def test_quota_shared_between_replicas(self, redis_client):
+        """Test that two replicas draw from a single bucket"""
+        from gateway.middleware.redis_limiter import RedisRateLimitBackend
+        replicas = [RedisRateLimitBackend(redis_client, local_fraction=0) for _ in range(2)]
+        results = [(await replicas[i % 2].consume("api:1.2.3.4", 4, 0.001)).allowed for i in range(6)]
+        assert results == [True, True, True, True, False, False]
+        assert replicas[0].stats["redis_decisions"] == 3
+
+    async def test_local_short_circuit_settles_debt(self, redis_client):
+        """Test that locally admitted requests are charged on the next round trip"""
+        from gateway.middleware.redis_limiter import RedisRateLimitBackend
+        backend = RedisRateLimitBackend(redis_client, local_fraction=0.1)
+        results = [(await backend.consume("api:1.2.3.4", 100, 0.001)).allowed for _ in range(12)]
+        assert all(results)
+        # First call and every 11th go to Redis; the ten in between are local
+        assert backend.stats["local_decisions"] == 10
+        assert backend.stats["redis_decisions"] == 2
+        tokens = float(await redis_client.hget("gateway:ratelimit:api:1.2.3.4", "tokens"))
+        assert 87.9 < tokens <= 88.1
+
+    async def test_fallback_when_redis_unreachable(self):
+        """Test that Redis errors fall back to in-process buckets"""
+        from gateway.middleware.redis_limiter import RedisRateLimitBackend
+        backend = RedisRateLimitBackend(FailingRedis(), retry_interval=60)
+        assert (await backend.consume("api:1.2.3.4", 1, 0.001)).allowed
+        assert not (await backend.consume("api:1.2.3.4", 1, 0.001)).allowed
+        stats = backend.get_stats()
+        assert stats["redis_errors"] == 1
+        assert stats["fallback_decisions"] == 2
+        assert not stats["redis_available"]
+
+
+def shared_memory_worker(name, directory, requests, results):
+    """Worker process: spend requests against one shared key and report admissions"""
+    import asyncio
+    import time
+    from gateway.middleware.shm_limiter import SharedMemoryRateLimitBackend
+
+    async def run():
+        backend = SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=1024)
+        admitted = 0
+        start = time.perf_counter()
+        for i in range(requests):
+            if (await backend.consume("api:shared", 500, 0.001)).allowed:
+                admitted += 1
+            # Unique keys exercise the other groups and stripes
+            await backend.consume(f"api:{os.getpid()}:{i}", 10, 1.0)
+        elapsed = time.perf_counter() - start
+        backend.close()
+        return admitted, 2 * requests / elapsed
+
+    results.put(asyncio.run(run()))
+
+
+class TestSharedMemoryRateLimitBackend:
+    """Test the host-local shared-memory limiter backend"""
+
+    @pytest.fixture
+    def segment(self, tmp_path):
+        return "test_ratelimit", str(tmp_path)
+
+    async def test_shared_between_instances(self, segment):
+        """Test that two attachments of one segment share bucket state"""
+        from gateway.middleware.shm_limiter import SharedMemoryRateLimitBackend
+        name, directory = segment
+        first = SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=64)
+        second = SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=64)
+        assert first.owner and not second.owner
+        assert (await first.consume("api:1.2.3.4", 2, 0.001)).allowed
+        assert (await second.consume("api:1.2.3.4", 2, 0.001)).allowed
+        assert not (await first.consume("api:1.2.3.4", 2, 0.001)).allowed
+        second.close()
+        first.close(unlink=True)
+
+    async def test_layout_mismatch_rejected(self, segment):
+        """Test that a segment created with another size is not reused"""
+        from gateway.middleware.shm_limiter import SharedMemoryRateLimitBackend
+        name, directory = segment
+        first = SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=64)
+        with pytest.raises(ValueError):
+            SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=128)
+        first.close(unlink=True)
+
+    def test_full_group_evicts(self, segment):
+        """Test that the table stays fixed-size when more keys than slots arrive"""
+        import asyncio
+        from gateway.middleware.shm_limiter import SharedMemoryRateLimitBackend
+        name, directory = segment
+        backend = SharedMemoryRateLimitBackend(name=name, directory=directory, max_keys=8)
+
+        async def spray():
+            for i in range(100):
+                assert (await backend.consume(f"api:{i}", 5, 1.0)).allowed
+
+        asyncio.run(spray())
+        assert backend.stats["evicted_idle"] + backend.stats["evicted_active"] == 92
+        backend.close(unlink=True)
+
+    def test_multi_process_limit_and_throughput(self, segment):
+        """Test that four worker processes together admit exactly the key's capacity"""
+        import multiprocessing
+        name, directory = segment
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        workers = [
+            context.Process(target=shared_memory_worker, args=(name, directory, 400, results))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=10)
+        assert sum(admitted for admitted, _ in outcomes) == 500
+        # Decisions per second per process (lock + table update, no network hop)
+        assert min(rate for _, rate in outcomes) > 1000
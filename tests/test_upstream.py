@@ -0,0 +1,1128 @@
+"""
+Tests for upstream connection management
+Tests pooled HTTP clients built from the service registry
+"""
+
+import pytest
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pb2.user_pb2_grpc
+from gateway.upstream.http_pool import HTTPClientPool, get_http_base_url
+
+
+REGISTRY = {
+    "auth": {
+        "url": "http://auth-service:5001",
+        "timeout": 10,
+        "max_connections": 7,
+        "max_keepalive_connections": 3,
+        "keepalive_expiry": 12
+    },
+    "users": {
+        "url": "clients-service:5002",
+        "timeout": 30
+    },
+    "inventory": {
+        "url": "inventory:50051",
+        "grpc": True,
+        "http_url": "http://inventory:8000",
+        "timeout": 30
+    }
+}
+
+
+class TestHTTPClientPool:
+    """Test the shared HTTP client pool"""
+
+    def test_http_base_url(self):
+        """Test base URL resolution for HTTP and gRPC entries"""
+        assert get_http_base_url(REGISTRY["auth"]) == "http://auth-service:5001"
+        assert get_http_base_url(REGISTRY["inventory"]) == "http://inventory:8000"
+        assert get_http_base_url(REGISTRY["users"]) is None
+
+    async def test_client_reused_per_service(self):
+        """Test that the same client is returned for repeated lookups"""
+        pool = HTTPClientPool(REGISTRY)
+        await pool.startup()
+        assert set(pool.clients) == {"auth", "inventory"}
+        assert pool.get("auth") is pool.get("auth")
+        assert pool.get() is pool.get("unknown")
+        assert str(pool.get("auth").base_url) == "http://auth-service:5001"
+        await pool.close()
+        assert pool.clients == {}
+
+    async def test_client_limits_from_registry(self):
+        """Test that pool limits come from the registry entry"""
+        pool = HTTPClientPool(REGISTRY)
+        client = pool.get("auth")
+        pool_limits = client._transport._pool
+        assert pool_limits._max_connections == 7
+        assert pool_limits._max_keepalive_connections == 3
+        assert pool_limits._keepalive_expiry == 12
+        await pool.close()
+
+    async def test_closed_client_recreated(self):
+        """Test that a client closed at shutdown is rebuilt on next use"""
+        pool = HTTPClientPool(REGISTRY)
+        first = pool.get("auth")
+        await pool.close()
+        assert first.is_closed
+        second = pool.get("auth")
+        assert second is not first
+        assert not second.is_closed
+        await pool.close()
+
+
+class FakeUserService(pb2.user_pb2_grpc.UserServiceServicer):
+    """In-process UserService answering VerifyCredentials"""
+
+    async def VerifyCredentials(self, request, context):
+        import grpc
+        import pb2.user_pb2
+        if request.password != "secret":
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "bad credentials")
+        return pb2.user_pb2.VerifyCredentialsResponse(id="user-1", roles=["Admin"])
+
+
+class TestLoginPath:
+    """Test that login verifies credentials over gRPC without an HTTP loopback"""
+
+    @pytest.fixture
+    async def user_server(self):
+        import grpc
+        server = grpc.aio.server()
+        pb2.user_pb2_grpc.add_UserServiceServicer_to_server(FakeUserService(), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        yield f"127.0.0.1:{port}"
+        await server.stop(None)
+
+    @pytest.fixture
+    def auth_app(self, user_server, monkeypatch):
+        import httpx
+        from fastapi import FastAPI
+        from gateway.routes import auth
+        from gateway.upstream import calls
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+
+        token_requests = []
+
+        def auth_service(request):
+            token_requests.append(request)
+            return httpx.Response(200, json={"token": "jwt-token"})
+
+        class FakePool:
+            def get(self, service_name=None):
+                return httpx.AsyncClient(transport=httpx.MockTransport(auth_service))
+
+        channels = GrpcChannelManager({"users": {"url": user_server}})
+        monkeypatch.setattr(calls, "get_channel_manager", lambda: channels)
+        monkeypatch.setattr(calls, "get_http_pool", lambda: FakePool())
+
+        app = FastAPI()
+        app.include_router(auth.create_auth_router("http://auth-service:5001"), prefix="/api")
+        app.state.token_requests = token_requests
+        yield app
+
+    async def test_login_success(self, auth_app):
+        """Test that valid credentials return the auth service token"""
+        import httpx
+        transport = httpx.ASGITransport(app=auth_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            response = await client.post("/api/login", json={"username": "admin", "password": "secret"})
+        assert response.status_code == 200
+        assert response.json() == {"token": "jwt-token"}
+        (token_request,) = auth_app.state.token_requests
+        assert str(token_request.url) == "http://auth-service:5001/api/auth"
+
+    async def test_login_invalid_credentials(self, auth_app):
+        """Test that rejected credentials map to 400 without requesting a token"""
+        import httpx
+        transport = httpx.ASGITransport(app=auth_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            response = await client.post("/api/login", json={"username": "admin", "password": "wrong"})
+        assert response.status_code == 400
+        assert auth_app.state.token_requests == []
+
+
+class TestGrpcChannelManager:
+    """Test shared gRPC channels built from the service registry"""
+
+    def test_channel_options_from_registry(self):
+        """Test keepalive and message size options"""
+        from gateway.upstream.grpc_channels import build_channel_options
+        options = dict(build_channel_options({"keepalive_time_ms": 5000, "max_message_length": 1024}))
+        assert options["grpc.keepalive_time_ms"] == 5000
+        assert options["grpc.max_send_message_length"] == 1024
+        assert options["grpc.max_receive_message_length"] == 1024
+
+    async def test_channel_reused(self):
+        """Test that a single-channel service always returns the same channel"""
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        manager = GrpcChannelManager({"orders": {"url": "http://localhost:5207"}})
+        channel = manager.get_channel("orders")
+        assert manager.get_channel("orders") is channel
+        assert manager.pools[("orders", "localhost:5207")].target == "localhost:5207"
+        await manager.close()
+        assert manager.pools == {}
+
+    async def test_channel_pool_round_robin(self):
+        """Test that pooled services rotate over their channels"""
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        manager = GrpcChannelManager({"users": {"url": "localhost:5002", "channel_pool_size": 3}})
+        channels = [manager.get_channel("users") for _ in range(6)]
+        assert len({id(c) for c in channels}) == 3
+        assert channels[0] is channels[3]
+        await manager.close()
+
+
+def make_request(headers=None, receive=None):
+    """Build a bare Starlette request for deadline tests"""
+    from starlette.requests import Request
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    if receive is None:
+        return Request(scope)
+    return Request(scope, receive)
+
+
+class TestDeadlines:
+    """Test request deadlines and cancellation of upstream calls"""
+
+    def test_timeout_from_registry(self):
+        """Test that calls without a client budget use the registry timeout"""
+        from gateway.upstream.deadlines import get_timeout
+        assert get_timeout(make_request(), "auth") == 10
+        assert get_timeout(None, "orders") == 30
+
+    def test_timeout_capped_by_budget(self):
+        """Test that the client budget header caps the registry timeout"""
+        from gateway.upstream.deadlines import get_timeout
+        request = make_request({"X-Request-Timeout": "2"})
+        assert 1.5 < get_timeout(request, "auth") <= 2
+        # Invalid values are ignored
+        assert get_timeout(make_request({"X-Request-Timeout": "soon"}), "auth") == 10
+
+    def test_spent_budget_rejected(self):
+        """Test that a spent budget fails fast with 504"""
+        from fastapi import HTTPException
+        from gateway.upstream.deadlines import get_timeout
+        request = make_request()
+        request.state.deadline = 0.0
+        with pytest.raises(HTTPException) as exc:
+            get_timeout(request, "auth")
+        assert exc.value.status_code == 504
+
+    async def test_call_completes(self):
+        """Test that a finished call returns its result"""
+        from gateway.upstream.deadlines import run_with_cancellation
+        import asyncio
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def call():
+            return "ok"
+
+        assert await run_with_cancellation(make_request(receive=receive), call()) == "ok"
+
+    async def test_call_cancelled_on_disconnect(self):
+        """Test that the upstream call is cancelled when the client goes away"""
+        import asyncio
+        from fastapi import HTTPException
+        from gateway.upstream.deadlines import run_with_cancellation
+
+        cancelled = asyncio.Event()
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with pytest.raises(HTTPException) as exc:
+            await run_with_cancellation(make_request(receive=receive), call())
+        assert exc.value.status_code == 499
+        await asyncio.sleep(0)
+        assert cancelled.is_set()
+
+
+class TestHealthProber:
+    """Test the background upstream health prober"""
+
+    @pytest.fixture
+    async def health_servers(self):
+        import grpc
+        servers = []
+
+        async def start(serving_status):
+            server = grpc.aio.server()
+            if serving_status is not None:
+                async def check(request, context):
+                    return bytes([0x08, serving_status])
+                server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(
+                    "grpc.health.v1.Health", {"Check": grpc.unary_unary_rpc_method_handler(check)}
+                ),))
+            else:
+                pb2.user_pb2_grpc.add_UserServiceServicer_to_server(FakeUserService(), server)
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            servers.append(server)
+            return f"127.0.0.1:{port}"
+
+        yield start
+        for server in servers:
+            await server.stop(None)
+
+    def make_prober(self, registry, handler=None, **kwargs):
+        import httpx
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        from gateway.upstream.health import HealthProber
+
+        class FakePool:
+            def get(self, service_name=None):
+                return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        return HealthProber(registry, channel_manager=GrpcChannelManager(registry), http_pool=FakePool(), **kwargs)
+
+    async def test_grpc_health_protocol(self, health_servers):
+        """Test SERVING, NOT_SERVING, no health service and unreachable upstreams"""
+        registry = {
+            "serving": {"url": await health_servers(1), "grpc": True},
+            "not_serving": {"url": await health_servers(2), "grpc": True},
+            "no_health": {"url": await health_servers(None)},
+            "down": {"url": "127.0.0.1:1"}
+        }
+        prober = self.make_prober(registry, timeout=1.0)
+        results = await prober.probe_all()
+        assert results["serving"]["status"] == "healthy"
+        assert results["serving"]["check"] == "grpc_health"
+        assert results["not_serving"]["status"] == "unhealthy"
+        assert results["not_serving"]["serving_status"] == "NOT_SERVING"
+        assert results["no_health"]["status"] == "healthy"
+        assert results["no_health"]["check"] == "connectivity"
+        assert results["down"]["status"] == "unhealthy"
+        assert all(result["type"] == "gRPC" for result in results.values())
+        await prober.channel_manager.close()
+
+    async def test_services_probed_concurrently(self):
+        """Test that slow HTTP upstreams are probed in parallel and time out individually"""
+        import asyncio
+        import time
+        import httpx
+
+        async def handler(request):
+            await asyncio.sleep(0.3 if request.url.host != "hung" else 5)
+            return httpx.Response(200 if request.url.host != "broken" else 500)
+
+        registry = {
+            name: {"url": f"http://{name}:8000", "health_endpoint": "/health"}
+            for name in ("a", "b", "c", "broken", "hung")
+        }
+        prober = self.make_prober(registry, handler, timeout=1.0)
+        started = time.perf_counter()
+        results = await prober.probe_all()
+        assert time.perf_counter() - started < 1.5
+        assert [results[name]["status"] for name in ("a", "b", "c")] == ["healthy"] * 3
+        assert results["broken"]["status_code"] == 500
+        assert results["hung"]["error"] == "Health check timed out"
+
+    async def test_readiness_from_cache(self):
+        """Test readiness before probing, with required services and after stop"""
+        import asyncio
+        import httpx
+
+        status = {"code": 200}
+        registry = {"orders": {"url": "http://orders:5207", "health_endpoint": "/health"}}
+        prober = self.make_prober(
+            registry, lambda request: httpx.Response(status["code"]), interval=0.05, required_services=["orders"]
+        )
+        assert prober.readiness()["ready"] is False
+        prober.start()
+        await asyncio.sleep(0.02)
+        assert prober.readiness()["ready"] is True
+        status["code"] = 503
+        await asyncio.sleep(0.1)
+        assert prober.readiness()["unhealthy_required_services"] == ["orders"]
+        await prober.stop()
+        assert prober.task is None
+
+
+class TestCircuitBreaker:
+    """Test per-upstream circuit breakers"""
+
+    def test_trips_on_failure_rate(self):
+        """Test that the breaker opens once the window failure rate crosses the threshold"""
+        from fastapi import HTTPException
+        from gateway.upstream.circuit_breaker import CircuitBreaker
+        breaker = CircuitBreaker("orders", min_calls=4, open_duration=30)
+        for failed in (False, True, False):
+            breaker.record(0.01, failed, breaker.before_call())
+        assert breaker.state == "closed"
+        breaker.record(0.01, True, breaker.before_call())
+        assert breaker.state == "open"
+        with pytest.raises(HTTPException) as error:
+            breaker.before_call()
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "30"
+        assert breaker.get_state()["rejected"] == 1
+
+    def test_trips_on_slow_calls(self):
+        """Test that calls slower than the threshold count against the breaker"""
+        from gateway.upstream.circuit_breaker import CircuitBreaker
+        breaker = CircuitBreaker("users", slow_call_duration=1.0, slow_call_rate=0.5, min_calls=2)
+        breaker.record(0.1, False, breaker.before_call())
+        breaker.record(2.0, False, breaker.before_call())
+        assert breaker.state == "open"
+
+    def test_half_open_trials(self):
+        """Test that a limited number of trial calls decides whether the breaker closes"""
+        from fastapi import HTTPException
+        from gateway.upstream.circuit_breaker import CircuitBreaker
+        breaker = CircuitBreaker("orders", min_calls=1, half_open_calls=2)
+        breaker.record(0.01, True, breaker.before_call())
+        breaker.opened_at -= breaker.open_duration
+        trials = [breaker.before_call(), breaker.before_call()]
+        assert trials == [True, True] and breaker.state == "half_open"
+        with pytest.raises(HTTPException):
+            breaker.before_call()
+        breaker.record(0.01, True, trials[0])
+        assert breaker.state == "open"
+
+        breaker.opened_at -= breaker.open_duration
+        first = breaker.before_call()
+        breaker.release(first)
+        for _ in range(2):
+            breaker.record(0.01, False, breaker.before_call())
+        assert breaker.state == "closed"
+        assert breaker.get_state()["window_calls"] == 0
+
+    async def test_call_grpc_fails_fast_while_open(self, monkeypatch):
+        """Test that an unreachable upstream stops being dialled once its breaker opens"""
+        import grpc
+        import time
+        import pb2.user_pb2
+        from fastapi import HTTPException
+        from gateway.upstream import calls
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        from gateway.upstream.retries import RetryBudgetRegistry
+
+        registry = {"users": {"url": "127.0.0.1:1", "timeout": 1, "breaker_min_calls": 2}}
+        breakers = CircuitBreakerRegistry(registry)
+        channels = GrpcChannelManager(registry)
+        monkeypatch.setattr(calls, "get_channel_manager", lambda: channels)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: breakers)
+        monkeypatch.setattr(calls, "get_retry_budgets", lambda: RetryBudgetRegistry(registry))
+
+        message = pb2.user_pb2.GetUserByIdRequest(id="user-1")
+        for _ in range(2):
+            with pytest.raises(grpc.RpcError):
+                await calls.call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", message)
+        started = time.perf_counter()
+        with pytest.raises(HTTPException) as error:
+            await calls.call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", message)
+        assert error.value.status_code == 503
+        assert time.perf_counter() - started < 0.01
+        await channels.close()
+
+    async def test_business_errors_do_not_trip(self, monkeypatch):
+        """Test that errors caused by the request itself leave the breaker closed"""
+        import grpc
+        import pb2.user_pb2
+        from gateway.upstream import calls
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+
+        server = grpc.aio.server()
+        pb2.user_pb2_grpc.add_UserServiceServicer_to_server(FakeUserService(), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        registry = {"users": {"url": f"127.0.0.1:{port}", "breaker_min_calls": 2}}
+        breakers = CircuitBreakerRegistry(registry)
+        channels = GrpcChannelManager(registry)
+        monkeypatch.setattr(calls, "get_channel_manager", lambda: channels)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: breakers)
+
+        message = pb2.user_pb2.VerifyCredentialsRequest(username="user", password="wrong")
+        for _ in range(3):
+            with pytest.raises(grpc.RpcError) as error:
+                await calls.call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "VerifyCredentials", message)
+            assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+        assert breakers.get("users").get_state()["state"] == "closed"
+        assert breakers.get("users").get_state()["window_failures"] == 0
+        await channels.close()
+        await server.stop(None)
+
+
+    async def test_client_budget_timeouts_do_not_trip(self, monkeypatch):
+        """Test that calls cut short by the client's own deadline leave the breaker closed"""
+        import asyncio
+        import httpx
+        from gateway.upstream import calls
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyRegistry
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.timeouts import AdaptiveTimeouts
+
+        registry = {"users": {"breaker_min_calls": 2}}
+        breakers = CircuitBreakerRegistry(registry)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: breakers)
+        monkeypatch.setattr(calls, "get_adaptive_limits", lambda: AdaptiveConcurrencyRegistry(registry))
+        monkeypatch.setattr(calls, "get_adaptive_timeouts", lambda: AdaptiveTimeouts(registry))
+
+        async def make_call(timeout, is_budget_timeout):
+            try:
+                await asyncio.wait_for(asyncio.sleep(0.05), timeout)
+            except asyncio.TimeoutError:
+                raise httpx.ReadTimeout("deadline exceeded")
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        for _ in range(10):
+            request = make_request({"X-Request-Timeout": "0.01"}, receive)
+            with pytest.raises(httpx.ReadTimeout):
+                await calls.run_upstream_call(request, "users", make_call, method_name="GetById")
+        state = breakers.get("users").get_state()
+        assert state["state"] == "closed" and state["window_calls"] == 0
+
+        async def timed_out(timeout, is_budget_timeout):
+            raise httpx.ReadTimeout("upstream too slow")
+
+        # A timeout under the service's own deadline still counts
+        with pytest.raises(httpx.ReadTimeout):
+            await calls.run_upstream_call(None, "users", timed_out, method_name="GetById")
+        assert breakers.get("users").get_state()["window_failures"] == 1
+
+
+class FlakyUserService(pb2.user_pb2_grpc.UserServiceServicer):
+    """UserService failing with UNAVAILABLE for the first `failures` calls of each RPC"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = {"GetById": 0, "Update": 0}
+
+    async def fail_or(self, name, context, response):
+        import grpc
+        self.calls[name] += 1
+        if self.calls[name] <= self.failures:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "warming up")
+        return response
+
+    async def GetById(self, request, context):
+        import pb2.user_pb2
+        return await self.fail_or("GetById", context, pb2.user_pb2.GetUserByIdResponse())
+
+    async def Update(self, request, context):
+        import pb2.user_pb2
+        return await self.fail_or("Update", context, pb2.user_pb2.UpdateUserResponse())
+
+
+class TestRetries:
+    """Test retries of idempotent RPCs under a retry budget"""
+
+    @pytest.fixture
+    async def flaky_users(self, monkeypatch):
+        import grpc
+        from gateway.upstream import calls
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        from gateway.upstream.retries import RetryBudgetRegistry
+        from gateway.upstream.stale_cache import StaleCache
+
+        async def start(failures, **settings):
+            service = FlakyUserService(failures)
+            server = grpc.aio.server()
+            pb2.user_pb2_grpc.add_UserServiceServicer_to_server(service, server)
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            servers.append(server)
+            registry = {"users": {
+                "url": f"127.0.0.1:{port}",
+                "idempotent_rpcs": ["GetById"],
+                "retry_backoff_base": 0.001,
+                **settings
+            }}
+            channels.append(GrpcChannelManager(registry))
+            monkeypatch.setattr(calls, "get_channel_manager", lambda: channels[-1])
+            monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+            budgets = RetryBudgetRegistry(registry)
+            monkeypatch.setattr(calls, "get_retry_budgets", lambda: budgets)
+            monkeypatch.setattr(calls, "get_stale_cache", lambda: StaleCache(registry))
+            return service, budgets.get("users")
+
+        servers, channels = [], []
+        yield start
+        for manager in channels:
+            await manager.close()
+        for server in servers:
+            await server.stop(None)
+
+    def test_budget_is_a_fraction_of_calls(self):
+        """Test that retries are limited to the banked tokens plus ratio per call"""
+        from gateway.upstream.retries import RetryBudget
+        budget = RetryBudget(ratio=0.1, max_tokens=2)
+        assert budget.withdraw() and budget.withdraw()
+        assert not budget.withdraw()
+        for _ in range(10):
+            budget.deposit()
+        assert budget.withdraw()
+        assert not budget.withdraw()
+        assert budget.get_stats()["exhausted"] == 2
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Test full-jitter exponential backoff"""
+        from gateway.upstream.retries import backoff_delay
+        delays = [backoff_delay(3, 0.1, 0.25) for _ in range(200)]
+        assert all(0 <= delay <= 0.25 for delay in delays)
+        assert len(set(delays)) > 100
+
+    async def test_idempotent_rpc_retried(self, flaky_users):
+        """Test that a transient UNAVAILABLE on an idempotent RPC is retried"""
+        import pb2.user_pb2
+        from gateway.upstream.calls import call_grpc
+        service, budget = await flaky_users(failures=2)
+        await call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", pb2.user_pb2.GetUserByIdRequest(id="1"))
+        assert service.calls["GetById"] == 3
+        assert budget.get_stats()["retries"] == 2
+
+    async def test_non_idempotent_rpc_not_retried(self, flaky_users):
+        """Test that writes are never repeated"""
+        import grpc
+        import pb2.user_pb2
+        from gateway.upstream.calls import call_grpc
+        service, budget = await flaky_users(failures=1)
+        with pytest.raises(grpc.RpcError):
+            await call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "Update", pb2.user_pb2.UpdateUserRequest())
+        assert service.calls["Update"] == 1
+        assert budget.get_stats()["calls"] == 0
+
+    async def test_exhausted_budget_stops_retries(self, flaky_users):
+        """Test that an outage cannot multiply load once the budget is spent"""
+        import grpc
+        import pb2.user_pb2
+        from gateway.upstream.calls import call_grpc
+        service, budget = await flaky_users(failures=100, retry_budget_max=1, retry_max_attempts=5)
+        for _ in range(3):
+            with pytest.raises(grpc.RpcError):
+                await call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", pb2.user_pb2.GetUserByIdRequest(id="1"))
+        # One retry from the reserve, then 0.2 tokens of deposits are not enough for another
+        assert service.calls["GetById"] == 4
+        assert budget.get_stats()["exhausted"] == 3
+
+
+class TestHedging:
+    """Test hedged idempotent reads"""
+
+    def make_hedging(self, **settings):
+        from gateway.upstream.hedging import HedgeRegistry
+        hedging = HedgeRegistry({"users": {"hedged_rpcs": ["GetById"], "hedge_min_delay": 0.01, **settings}})
+        latency = hedging.get_latency("users", "GetById")
+        for _ in range(100):
+            latency.add(0.02)
+        return hedging
+
+    def test_latency_window_quantiles(self):
+        """Test quantiles over the most recent samples only"""
+        from gateway.upstream.latency import LatencyWindow
+        window = LatencyWindow(size=100, refresh_every=1)
+        assert window.quantile(0.95) is None
+        for i in range(1, 101):
+            window.add(i / 1000)
+        assert window.quantile(0.95) == 0.096
+        for _ in range(100):
+            window.add(0.5)
+        assert window.quantile(0.5) == 0.5
+
+    async def test_slow_primary_loses_to_hedge(self):
+        """Test that a hedge is sent after the p95 delay and the slow attempt is cancelled"""
+        import asyncio
+        import time
+        from gateway.upstream.hedging import call_hedged
+        hedging = self.make_hedging()
+        attempts = []
+
+        async def attempt():
+            number = len(attempts)
+            attempts.append("started")
+            try:
+                await asyncio.sleep(1.0 if number == 0 else 0.01)
+            except asyncio.CancelledError:
+                attempts[number] = "cancelled"
+                raise
+            return number
+
+        started = time.perf_counter()
+        assert await call_hedged("users", "GetById", attempt, hedging) == 1
+        assert time.perf_counter() - started < 0.2
+        await asyncio.sleep(0)
+        assert attempts == ["cancelled", "started"]
+        stats = hedging.get_stats("users")
+        assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+    async def test_fast_primary_not_hedged(self):
+        """Test that calls finishing within the delay send a single request"""
+        from gateway.upstream.hedging import call_hedged
+        hedging = self.make_hedging()
+        calls = []
+
+        async def attempt():
+            calls.append(1)
+            return "ok"
+
+        assert await call_hedged("users", "GetById", attempt, hedging) == "ok"
+        assert len(calls) == 1
+        assert hedging.get_latency("users", "GetById").count == 101
+
+    async def test_hedges_capped_by_budget(self):
+        """Test that hedges stop once the hedge budget is spent"""
+        import asyncio
+        from gateway.upstream.hedging import call_hedged
+        hedging = self.make_hedging(hedge_budget_max=1, hedge_budget_ratio=0)
+        calls = []
+
+        async def attempt():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        for _ in range(3):
+            await call_hedged("users", "GetById", attempt, hedging)
+        assert len(calls) == 4
+        assert hedging.get_stats("users")["capped"] == 2
+
+    async def test_failed_hedge_falls_back_to_primary(self):
+        """Test that the slower attempt still answers when the other fails"""
+        import asyncio
+        from gateway.upstream.hedging import call_hedged
+        hedging = self.make_hedging()
+        calls = []
+
+        async def attempt():
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("hedge failed")
+            await asyncio.sleep(0.05)
+            return "primary"
+
+        assert await call_hedged("users", "GetById", attempt, hedging) == "primary"
+
+
+class TestAdaptiveConcurrency:
+    """Test latency-driven concurrency limits per upstream"""
+
+    def test_limit_follows_latency(self):
+        """Test that the limit grows at baseline latency and shrinks when latency climbs"""
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyLimit
+        limit = AdaptiveConcurrencyLimit("inventory", initial_limit=10, max_limit=100)
+        limit.in_flight = 10
+        for _ in range(50):
+            limit.update(0.01)
+        grown = limit.limit
+        assert grown > 20
+        for _ in range(50):
+            limit.update(0.1)
+        assert limit.limit < grown / 2
+
+    def test_idle_upstream_limit_does_not_grow(self):
+        """Test that an under-used limit stays put instead of drifting up"""
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyLimit
+        limit = AdaptiveConcurrencyLimit("inventory", initial_limit=10)
+        for _ in range(50):
+            limit.update(0.01)
+        assert limit.limit == 10
+
+    def test_failures_back_off(self):
+        """Test multiplicative decrease on failed calls, bounded by the minimum"""
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyLimit
+        limit = AdaptiveConcurrencyLimit("orders", initial_limit=10, min_limit=8)
+        limit.in_flight = 3
+        limit.release(0.5, failed=True)
+        assert limit.limit == 9
+        limit.release(0.5, failed=True)
+        limit.release(0.5, failed=True)
+        assert limit.limit == 8
+
+    async def test_excess_calls_queue_then_shed(self):
+        """Test that calls over the limit wait briefly for a slot, then get 503"""
+        import asyncio
+        from fastapi import HTTPException
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyLimit
+        limit = AdaptiveConcurrencyLimit("users", initial_limit=1, min_limit=1, queue_timeout=0.05)
+        await limit.acquire()
+        queued = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0.01)
+        limit.release(0.01)
+        await queued
+        assert limit.in_flight == 1
+
+        with pytest.raises(HTTPException) as error:
+            await limit.acquire()
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "1"
+        assert limit.get_stats()["queue"] == 0
+        assert limit.get_stats()["shed"] == 1
+
+
+    async def test_client_budget_timeouts_leave_limit(self, monkeypatch):
+        """Test that calls cut short by the client's own deadline do not shrink the limit"""
+        import asyncio
+        import httpx
+        from gateway.upstream import calls
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyRegistry
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.timeouts import AdaptiveTimeouts
+
+        registry = {"users": {}}
+        limits = AdaptiveConcurrencyRegistry(registry)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+        monkeypatch.setattr(calls, "get_adaptive_limits", lambda: limits)
+        monkeypatch.setattr(calls, "get_adaptive_timeouts", lambda: AdaptiveTimeouts(registry))
+
+        async def make_call(timeout, is_budget_timeout):
+            try:
+                await asyncio.wait_for(asyncio.sleep(0.05), timeout)
+            except asyncio.TimeoutError:
+                raise httpx.ReadTimeout("deadline exceeded")
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        initial = limits.get("users").limit
+        for _ in range(10):
+            request = make_request({"X-Request-Timeout": "0.01"}, receive)
+            with pytest.raises(httpx.ReadTimeout):
+                await calls.run_upstream_call(request, "users", make_call, method_name="GetById")
+        assert limits.get("users").limit == initial
+        assert limits.get("users").in_flight == 0
+
+
+class TestBulkheads:
+    """Test per-upstream request compartments"""
+
+    def test_full_compartment_rejects(self):
+        """Test that a full bulkhead answers 503 at once and reports its saturation"""
+        from fastapi import HTTPException
+        from gateway.upstream.bulkheads import Bulkhead
+        bulkhead = Bulkhead("orders", max_concurrent=2)
+        bulkhead.acquire()
+        bulkhead.acquire()
+        with pytest.raises(HTTPException) as error:
+            bulkhead.acquire()
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "1"
+        stats = bulkhead.get_stats()
+        assert stats["saturation"] == 1.0
+        assert stats["rejected"] == 1 and stats["peak_in_flight"] == 2
+        bulkhead.full_since -= 1
+        bulkhead.release()
+        assert bulkhead.full_since is None
+        assert bulkhead.get_stats()["saturated_seconds"] >= 1
+        bulkhead.acquire()
+
+    async def test_hung_upstream_does_not_block_others(self, monkeypatch):
+        """Test that requests to a hung upstream fill only its own compartment"""
+        import asyncio
+        import httpx
+        from fastapi import HTTPException
+        from gateway.upstream import calls
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyRegistry
+        from gateway.upstream.bulkheads import BulkheadRegistry
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+
+        hang = asyncio.Event()
+
+        async def handler(request):
+            if request.url.host == "orders":
+                await hang.wait()
+            return httpx.Response(200)
+
+        class Pool:
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+            def get(self, service_name):
+                return self.client
+
+        registry = {
+            "orders": {"url": "http://orders", "timeout": 5, "bulkhead_max_concurrent": 2},
+            "auth": {"url": "http://auth", "timeout": 5}
+        }
+        bulkheads = BulkheadRegistry(registry)
+        monkeypatch.setattr(calls, "get_http_pool", Pool)
+        monkeypatch.setattr(calls, "get_bulkheads", lambda: bulkheads)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+        monkeypatch.setattr(calls, "get_adaptive_limits", lambda: AdaptiveConcurrencyRegistry(registry))
+
+        hung = [asyncio.ensure_future(calls.call_http(None, "orders", "GET", "http://orders/x")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as error:
+            await calls.call_http(None, "orders", "GET", "http://orders/x")
+        assert error.value.status_code == 503
+        assert (await calls.call_http(None, "auth", "GET", "http://auth/x")).status_code == 200
+
+        hang.set()
+        await asyncio.gather(*hung)
+        assert bulkheads.get("orders").get_stats()["in_flight"] == 0
+        await Pool.client.aclose()
+
+
+class TestAdaptiveTimeouts:
+    """Test per-method timeouts learned from latency quantiles"""
+
+    def test_timeout_from_quantile(self):
+        """Test the registry timeout before enough samples, then a bounded multiple of p99"""
+        from gateway.upstream.timeouts import AdaptiveTimeouts
+        timeouts = AdaptiveTimeouts({"orders": {"timeout": 30, "timeout_min": 0.1, "timeout_min_samples": 10}})
+        for _ in range(9):
+            timeouts.record("orders", "GetOrderStatus", 0.02)
+        assert timeouts.get("orders", "GetOrderStatus") == 30
+        timeouts.record("orders", "GetOrderStatus", 0.02)
+        assert timeouts.get("orders", "GetOrderStatus") == 0.1
+        for _ in range(10):
+            timeouts.record("orders", "GetOrderStatus", 0.2)
+        assert timeouts.get("orders", "GetOrderStatus") == pytest.approx(0.6)
+        for _ in range(20):
+            timeouts.record("orders", "GetAllOrders", 12.0)
+        # Slow admin queries keep the full registry timeout
+        assert timeouts.get("orders", "GetAllOrders") == 30
+        assert timeouts.get_stats("orders")["GetOrderStatus"]["samples"] == 20
+
+    async def test_learned_timeout_cuts_slow_calls(self, monkeypatch):
+        """Test that a call far slower than usual times out early and raises the timeout"""
+        import asyncio
+        import httpx
+        from gateway.upstream import calls
+        from gateway.upstream.adaptive_concurrency import AdaptiveConcurrencyRegistry
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.timeouts import AdaptiveTimeouts
+
+        registry = {"users": {"timeout": 30, "timeout_min": 0.05, "timeout_min_samples": 5}}
+        timeouts = AdaptiveTimeouts(registry)
+        monkeypatch.setattr(calls, "get_adaptive_timeouts", lambda: timeouts)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+        monkeypatch.setattr(calls, "get_adaptive_limits", lambda: AdaptiveConcurrencyRegistry(registry))
+
+        def upstream(delay):
+            async def make_call(timeout, is_budget_timeout):
+                try:
+                    await asyncio.wait_for(asyncio.sleep(delay), timeout)
+                except asyncio.TimeoutError:
+                    raise httpx.ReadTimeout("upstream too slow")
+                return timeout
+            return make_call
+
+        assert await calls.run_upstream_call(None, "users", upstream(0), method_name="GetById") == 30
+        for _ in range(4):
+            await calls.run_upstream_call(None, "users", upstream(0), method_name="GetById")
+        with pytest.raises(httpx.ReadTimeout):
+            await calls.run_upstream_call(None, "users", upstream(1), method_name="GetById")
+        assert timeouts.get("users", "GetById") >= 0.15
+
+
+class TestStaleIfError:
+    """Test serving the last good answer of idempotent reads while the upstream fails"""
+
+    def test_store_budget_and_max_stale(self):
+        """Test that the oldest answers go first over budget and old ones are not served"""
+        from gateway.upstream.stale_cache import StaleStore
+        store = StaleStore(max_stale=60, max_bytes=100)
+        store.put(b"a", "first", 60)
+        store.put(b"b", "second", 60)
+        assert store.get(b"a") is None
+        assert store.get(b"b")[0] == "second"
+        store.put(b"huge", "too big", 101)
+        assert store.get_stats()["entries"] == 1 and store.bytes == 60
+
+        key, (response, size, stored_at) = next(iter(store.entries.items()))
+        store.entries[key] = (response, size, stored_at - 61)
+        assert store.get(b"b") is None
+        assert store.bytes == 0
+
+    async def test_stale_answer_on_upstream_failure(self, monkeypatch):
+        """Test that a failing upstream gets the last good answer, flagged with Warning and Age"""
+        import asyncio
+        import grpc
+        import pb2.user_pb2
+        from gateway.upstream import calls
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        from gateway.upstream.retries import RetryBudgetRegistry
+        from gateway.upstream.stale_cache import StaleCache, stale_headers
+
+        class UserService(pb2.user_pb2_grpc.UserServiceServicer):
+            down = False
+
+            async def GetById(self, request, context):
+                if self.down:
+                    await context.abort(grpc.StatusCode.UNAVAILABLE, "down")
+                return pb2.user_pb2.GetUserByIdResponse(User=pb2.user_pb2.User(id=request.id))
+
+        service = UserService()
+        server = grpc.aio.server()
+        pb2.user_pb2_grpc.add_UserServiceServicer_to_server(service, server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        registry = {"users": {"url": f"127.0.0.1:{port}", "stale_rpcs": {"GetById": {"max_stale": 60}}}}
+        channels = GrpcChannelManager(registry)
+        stale_cache = StaleCache(registry)
+        monkeypatch.setattr(calls, "get_channel_manager", lambda: channels)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+        monkeypatch.setattr(calls, "get_retry_budgets", lambda: RetryBudgetRegistry(registry))
+        monkeypatch.setattr(calls, "get_stale_cache", lambda: stale_cache)
+
+        async def connected():
+            await asyncio.Event().wait()
+
+        def get_by_id(request, user_id):
+            message = pb2.user_pb2.GetUserByIdRequest(id=user_id)
+            return calls.call_grpc(request, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", message)
+
+        fresh = make_request(receive=connected)
+        assert (await get_by_id(fresh, "user-1")).User.id == "user-1"
+        assert stale_headers(fresh.scope) == []
+
+        service.down = True
+        request = make_request(receive=connected)
+        assert (await get_by_id(request, "user-1")).User.id == "user-1"
+        assert dict(stale_headers(request.scope)) == {b"warning": b'110 - "Response is Stale"', b"age": b"0"}
+        with pytest.raises(grpc.RpcError):
+            await get_by_id(None, "user-2")
+        assert stale_cache.get_stats("users")["GetById"]["served"] == 1
+        await channels.close()
+        await server.stop(None)
+
+
+class TestLoadBalancing:
+    """Test power-of-two-choices balancing over multi-endpoint upstreams"""
+
+    ENDPOINTS = [{"url": "users-1:5002"}, {"url": "users-2:5002"}, {"url": "users-3:5002", "weight": 8}]
+
+    def test_picks_less_loaded_and_heavier_endpoints(self):
+        """Test that busy endpoints are avoided and weights skew the choice"""
+        from collections import Counter
+        from gateway.upstream.balancer import LoadBalancer
+        balancer = LoadBalancer("users", self.ENDPOINTS[:2])
+        balancer.endpoints[0].in_flight = 10
+        assert all(balancer.pick().url == "users-2:5002" for _ in range(20))
+
+        balancer = LoadBalancer("users", self.ENDPOINTS)
+        picks = Counter(balancer.pick().url for _ in range(1000))
+        assert picks["users-3:5002"] > 600
+
+    def test_ejection_and_health(self):
+        """Test that failing or unhealthy endpoints are skipped, unless none are left"""
+        from gateway.upstream.balancer import LoadBalancer
+        balancer = LoadBalancer("users", self.ENDPOINTS[:2], eject_after=2)
+        first, second = balancer.endpoints
+        for _ in range(2):
+            first.in_flight += 1
+            balancer.record(first, 0.01, failed=True)
+        assert balancer.get_stats()["users-1:5002"]["ejected"]
+        assert all(balancer.pick() is second for _ in range(20))
+
+        balancer.set_health("users-2:5002", False)
+        # Every endpoint is out: keep trying them rather than failing every call
+        assert {balancer.pick() for _ in range(50)} == {first, second}
+        first.ejected_until = 0
+        assert all(balancer.pick() is first for _ in range(20))
+
+    async def test_client_budget_timeouts_do_not_eject(self):
+        """Test that timeouts set by the caller's budget leave the endpoint in rotation"""
+        import httpx
+        from gateway.upstream.balancer import LoadBalancer
+        balancer = LoadBalancer("users", self.ENDPOINTS[:2], eject_after=2)
+
+        async def run(endpoint):
+            raise httpx.ReadTimeout("deadline exceeded")
+
+        for _ in range(5):
+            with pytest.raises(httpx.ReadTimeout):
+                await balancer.call(run, is_budget_timeout=lambda error: True)
+        stats = balancer.get_stats()
+        assert not any(endpoint["ejected"] for endpoint in stats.values())
+        assert sum(endpoint["calls"] for endpoint in stats.values()) == 0
+        assert all(endpoint.in_flight == 0 for endpoint in balancer.endpoints)
+
+        for _ in range(4):
+            with pytest.raises(httpx.ReadTimeout):
+                await balancer.call(run)
+        assert any(endpoint["ejected"] for endpoint in balancer.get_stats().values())
+
+    def test_endpoint_urls(self):
+        """Test that HTTP calls addressed to the service url go to the picked endpoint"""
+        from gateway.upstream.balancer import LoadBalancerRegistry
+        registry = LoadBalancerRegistry({"auth": {
+            "url": "http://auth-service:5001",
+            "endpoints": [{"url": "http://auth-1:5001"}, {"url": "http://auth-2:5001"}]
+        }})
+        balancer = registry.get("auth")
+        endpoint = balancer.endpoints[1]
+        assert balancer.endpoint_url("http://auth-service:5001/api/auth", endpoint) == "http://auth-2:5001/api/auth"
+        assert balancer.endpoint_url("/api/auth/logout", endpoint) == "http://auth-2:5001/api/auth/logout"
+        assert balancer.endpoint_url("http://elsewhere/x", endpoint) == "http://elsewhere/x"
+        assert registry.get("users") is None
+
+    async def test_grpc_calls_spread_and_probe_ejects(self, monkeypatch):
+        """Test that calls reach every replica and a replica failing its probe stops getting calls"""
+        import grpc
+        import pb2.user_pb2
+        from gateway.upstream import calls
+        from gateway.upstream.balancer import LoadBalancerRegistry
+        from gateway.upstream.circuit_breaker import CircuitBreakerRegistry
+        from gateway.upstream.grpc_channels import GrpcChannelManager
+        from gateway.upstream.health import HealthProber
+        from gateway.upstream.retries import RetryBudgetRegistry
+        from gateway.upstream.stale_cache import StaleCache
+
+        class Replica(pb2.user_pb2_grpc.UserServiceServicer):
+            def __init__(self, name):
+                self.name = name
+                self.calls = 0
+
+            async def GetById(self, request, context):
+                self.calls += 1
+                return pb2.user_pb2.GetUserByIdResponse(User=pb2.user_pb2.User(id=self.name))
+
+        replicas, servers, endpoints = [Replica("a"), Replica("b")], [], []
+        for replica in replicas:
+            server = grpc.aio.server()
+            pb2.user_pb2_grpc.add_UserServiceServicer_to_server(replica, server)
+            endpoints.append({"url": f"127.0.0.1:{server.add_insecure_port('127.0.0.1:0')}"})
+            await server.start()
+            servers.append(server)
+        registry = {"users": {"url": endpoints[0]["url"], "grpc": True, "endpoints": endpoints}}
+        channels = GrpcChannelManager(registry)
+        balancers = LoadBalancerRegistry(registry)
+        monkeypatch.setattr(calls, "get_channel_manager", lambda: channels)
+        monkeypatch.setattr(calls, "get_load_balancers", lambda: balancers)
+        monkeypatch.setattr(calls, "get_circuit_breakers", lambda: CircuitBreakerRegistry(registry))
+        monkeypatch.setattr(calls, "get_retry_budgets", lambda: RetryBudgetRegistry(registry))
+        monkeypatch.setattr(calls, "get_stale_cache", lambda: StaleCache(registry))
+
+        message = pb2.user_pb2.GetUserByIdRequest(id="user-1")
+        for _ in range(40):
+            await calls.call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", message)
+        assert all(replica.calls > 0 for replica in replicas)
+
+        await servers[1].stop(None)
+        prober = HealthProber(registry, timeout=0.5, channel_manager=channels, load_balancers=balancers)
+        result = await prober.probe("users", registry["users"])
+        assert result["status"] == "healthy" and result["healthy_endpoints"] == 1
+        calls_before = replicas[0].calls
+        for _ in range(10):
+            response = await calls.call_grpc(None, "users", pb2.user_pb2_grpc.UserServiceStub, "GetById", message)
+            assert response.User.id == "a"
+        assert replicas[0].calls == calls_before + 10
+        await channels.close()
+        await servers[0].stop(None)